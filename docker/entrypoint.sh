@@ -119,10 +119,41 @@ fi
 
 # 6. Стартиране на web интерфейса (background)
 echo "Starting web interface..."
+# gunicorn (gthread workers, see web/gunicorn.conf.py) unless settings.web.server is "development"
 cd /app/web
-python3 app.py &
+mkdir -p /var/run/mail-bridge
+WEB_SERVER=$(python3 app.py --server 2>/dev/null || echo gunicorn)
+if [ "$WEB_SERVER" = "gunicorn" ] && command -v gunicorn > /dev/null; then
+    gunicorn -c gunicorn.conf.py app:app &
+else
+    [ "$WEB_SERVER" = "gunicorn" ] && echo "WARNING: gunicorn not installed, using the development server"
+    python3 app.py &
+fi
 WEB_PID=$!
 
-# 7. Стартиране на fetchmail (foreground!)
+# 7. Fetch mail: native fetcher or fetchmail + delivery daemon (foreground!)
+FETCH_MODE=$(python3 /scripts/fetcher.py --mode 2>/dev/null || echo fetchmail)
+if [ "$FETCH_MODE" = "native" ]; then
+    echo "Starting native POP3 fetcher..."
+    exec python3 /scripts/fetcher.py
+fi
+
+# 7.1. Start the persistent delivery daemon used by fetchmail's MDA
+echo "Starting mail delivery daemon..."
+python3 /scripts/mail_daemon.py &
+DAEMON_PID=$!
+for i in 1 2 3 4 5; do
+    [ -S /var/run/mail-bridge/mda.sock ] && break
+    sleep 1
+done
+if [ -S /var/run/mail-bridge/mda.sock ]; then
+    echo "Mail delivery daemon started"
+else
+    echo "WARNING: Mail delivery daemon not ready, mda_client.py will fall back to process_mail.py"
+fi
+
+# 7.2. Стартиране на fetchmail (foreground!)
+# The pid file lets the web interface check fetchmail without pgrep
 echo "Starting fetchmail..."
-exec fetchmail -f /config/fetchmailrc --nodetach --verbose
+mkdir -p /var/run/mail-bridge
+exec fetchmail -f /config/fetchmailrc --nodetach --verbose --pidfile /var/run/mail-bridge/fetchmail.pid
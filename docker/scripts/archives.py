@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Compressed and archived import sources
+
+Opens gzip/bz2/xz compressed mbox files and zip or tar archives as
+streams: nothing is extracted to disk, members are decompressed while the
+importer reads them. Tar archives are read in stream mode ("r|*"), so even
+a compressed tarball is read front to back exactly once.
+"""
+
+import os
+import bz2
+import gzip
+import lzma
+import tarfile
+import zipfile
+
+COMPRESSED = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+TAR_SUFFIXES = ('.tar', '.tgz', '.tbz', '.tbz2', '.txz', '.tar.gz', '.tar.bz2', '.tar.xz')
+
+def _strip_compression(name):
+    """(name without compression suffix, suffix or None)"""
+    lower = name.lower()
+    for suffix in COMPRESSED:
+        if lower.endswith(suffix):
+            return name[:-len(suffix)], suffix
+    return name, None
+
+def is_archive(name):
+    lower = str(name).lower()
+    return lower.endswith('.zip') or lower.endswith(TAR_SUFFIXES)
+
+def member_kind(name):
+    """'eml' or 'mbox' for a (possibly compressed) message file name, None for anything else"""
+    base, _ = _strip_compression(name)
+    base = base.lower()
+    if os.path.basename(base).startswith('._') or '__macosx/' in base:
+        # macOS resource forks next to the real files in zips made by Finder
+        return None
+    if base.endswith('.eml'):
+        return 'eml'
+    # Apple Mail exports Foo.mbox/mbox, other tools write plain "mbox" files
+    if base.endswith('.mbox') or os.path.basename(base) == 'mbox':
+        return 'mbox'
+    return None
+
+def is_compressed_mbox(name):
+    name = str(name)
+    return _strip_compression(name)[1] is not None and member_kind(name) == 'mbox' and not is_archive(name)
+
+def is_stream_source(name):
+    """True for sources the importer has to read as a stream instead of memory-mapping"""
+    return is_archive(name) or is_compressed_mbox(name)
+
+def decompress(fileobj, name):
+    """Wrap fileobj in a decompressor if name has a compression suffix"""
+    _, suffix = _strip_compression(name)
+    if suffix is None:
+        return fileobj
+    return COMPRESSED[suffix](fileobj, 'rb')
+
+def open_stream(path):
+    """Open a (compressed) file for sequential reading of its uncompressed content"""
+    _, suffix = _strip_compression(str(path))
+    if suffix is None:
+        return open(path, 'rb')
+    return COMPRESSED[suffix](path, 'rb')
+
+def archive_members(path):
+    """Yield (member name, kind, file object) for every .eml and mbox in a zip or tar archive
+
+    Each file object is only valid until the next member is requested.
+    """
+    path = str(path)
+    if path.lower().endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                kind = member_kind(info.filename)
+                if info.is_dir() or kind is None:
+                    continue
+                with archive.open(info) as member:
+                    yield info.filename, kind, decompress(member, info.filename)
+        return
+    with tarfile.open(path, mode='r|*') as archive:
+        for info in archive:
+            kind = member_kind(info.name)
+            if not info.isfile() or kind is None:
+                continue
+            member = archive.extractfile(info)
+            yield info.name, kind, decompress(member, info.name)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Benchmark message catalog queries at mailbox scale
+
+Fills a scratch catalog with synthetic messages (word frequencies follow
+Zipf's law, like real text, so there are very common and very rare
+terms) and times the queries behind /api/messages and
+/api/messages/search: first and deep pages of a list, and searches for
+common, rare and field-restricted terms, with and without a folder filter.
+
+Usage: python3 bench_catalog.py [--messages 1000000] [--users 3] [--folders 20] [--runs 50] [--db PATH]
+--db keeps the catalog so later runs skip building it.
+"""
+
+import os
+import time
+import random
+import shutil
+import tempfile
+import argparse
+import statistics
+
+from catalog import Catalog, BODY_PREFIX
+
+VOCABULARY = 20000
+BUILD_BATCH = 10000
+
+def make_words(seed=42):
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < VOCABULARY:
+        words.add(''.join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    # Sorted first: set order changes with hash randomisation, and --db needs the same words every run
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+def build(catalog, messages, users, folders, words, seed=42):
+    """Insert synthetic rows straight into the catalog (the parsing cost is bench_import's business)"""
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, len(words) + 1)]
+    cum_weights = []
+    total = 0
+    for weight in weights:
+        total += weight
+        cum_weights.append(total)
+    senders = [f"Sender {i} <sender{i}@example{i % 50}.com>" for i in range(2000)]
+    start_date = 1.5e9
+    conn = catalog._connect()
+    started = time.perf_counter()
+    for first in range(0, messages, BUILD_BATCH):
+        rows = []
+        for i in range(first, min(first + BUILD_BATCH, messages)):
+            body = ' '.join(rng.choices(words, cum_weights=cum_weights, k=170))[:BODY_PREFIX]
+            directory = "" if i % 3 == 0 else f".Folder{i % folders}"
+            rows.append((f"user{i % users}", directory, f"{i}.M{i}P1.bench", f"cur/{i}.M{i}P1.bench:2,S", 'S',
+                         f"<{i}@bench>", ' '.join(rng.choices(words, cum_weights=cum_weights, k=6)),
+                         rng.choice(senders), "me@example.com", start_date + i * 60 + rng.random() * 30,
+                         rng.randint(2000, 200000), body, time.time()))
+        with conn:
+            conn.executemany(
+                "INSERT INTO messages (imap_user, directory, name, filename, flags, message_id, subject, sender, "
+                "recipients, date, size, body, added_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        done = min(first + BUILD_BATCH, messages)
+        print(f"\r🔨 {done} messages, {done / (time.perf_counter() - started):.0f} msg/s", end='', flush=True)
+    print()
+    conn.execute("ANALYZE")
+
+def measure(runs, query):
+    """Median and worst time in ms of query(run) over runs calls"""
+    times = []
+    for run in range(runs):
+        start = time.perf_counter()
+        query(run)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), max(times)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark message catalog list and search queries')
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--folders', type=int, default=20)
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--db', help='Catalog file to build once and reuse')
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_catalog_')
+    path = args.db or os.path.join(scratch, "catalog.db")
+    catalog = Catalog(scratch, path=path)
+    words = make_words()
+    try:
+        count = catalog.count()
+        if count == 0:
+            build(catalog, args.messages, args.users, args.folders, words)
+            count = catalog.count()
+        print(f"📊 {count} messages, {os.path.getsize(path) / 1048576:.0f} MB catalog, "
+              f"median and worst of {args.runs} runs")
+
+        rng = random.Random(7)
+        max_id = catalog._connect().execute("SELECT max(id) FROM messages").fetchone()[0]
+
+        def deep_cursor(run):
+            date, row_id = catalog._connect().execute(
+                "SELECT date, id FROM messages WHERE id >= ? LIMIT 1", (rng.randint(1, max_id),)).fetchone()
+            return f"{date!r}:{row_id}"
+
+        cursors = [deep_cursor(run) for run in range(args.runs)]
+        common, medium, rare = words[0], words[50], words[5000]
+        cases = {
+            "list all, first page": lambda run: catalog.messages(limit=50),
+            "list folder, first page": lambda run: catalog.messages("user1", "Folder5", limit=50),
+            "list all, deep page": lambda run: catalog.messages(limit=50, cursor=cursors[run]),
+            "list folder, deep page": lambda run: catalog.messages("user0", "INBOX", limit=50, cursor=cursors[run]),
+            f"search common '{common}'": lambda run: catalog.search(common, limit=50),
+            f"search medium '{medium}'": lambda run: catalog.search(medium, limit=50),
+            f"search rare '{rare}'": lambda run: catalog.search(rare, limit=50),
+            "search two words": lambda run: catalog.search(f"{medium} {words[80]}", limit=50),
+            "search prefix": lambda run: catalog.search(words[300][:4] + '*', limit=50),
+            "search from:": lambda run: catalog.search("from:sender17", limit=50),
+            "search medium, folder": lambda run: catalog.search(medium, "user1", "Folder5", limit=50),
+            "search rare, folder": lambda run: catalog.search(rare, "user1", "Folder5", limit=50),
+            "search, deep page": lambda run: catalog.search(common, limit=50, cursor=rng.randint(1, max_id)),
+        }
+        for label, query in cases.items():
+            query(0)
+            median, worst = measure(args.runs, query)
+            print(f"{label:<32} {median:8.2f} ms  (worst {worst:.2f} ms)")
+    finally:
+        catalog.close()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
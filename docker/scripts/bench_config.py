@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark config loading at process start
+
+Each case starts a fresh interpreter (like fetchmail running
+process_mail.py for a message) and loads accounts.yaml plus its compiled
+filter rules: straight from YAML as before config_store.py, through
+config_store without a cache file, and from the pickle cache.
+
+Usage: python3 bench_config.py [--accounts 20] [--rules 200] [--runs 20]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import statistics
+import subprocess
+
+import yaml
+
+SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+
+CASES = {
+    "yaml.safe_load + compile": (
+        "import yaml; from filter_engine import CompiledRules\n"
+        "with open(PATH) as f: config = yaml.safe_load(f)\n"
+        "CompiledRules(config.get('filter_rules', []))"
+    ),
+    "config_store, no cache": "import config_store; config_store.load(PATH).rules",
+    "config_store, cached": "import config_store; config_store.load(PATH).rules",
+}
+
+def make_config(accounts, rules):
+    return {
+        'accounts': [
+            {'name': f"account{i}", 'pop_server': f"pop{i}.example.com", 'pop_port': 995,
+             'user': f"user{i}@example.com", 'password_env': f"POP_PASS_{i}", 'ssl': True,
+             'keep': False, 'imap_user': f"user{i % 3}", 'enabled': True,
+             'folders': {'inbox': 'INBOX', 'invoices': 'Invoices', 'priority': 'Priority'}}
+            for i in range(accounts)
+        ],
+        'settings': {'check_interval': 300, 'log_level': 'INFO',
+                     'push_notifications': {'enabled': False, 'webhook_url': ''}},
+        'filter_rules': [
+            {'name': f"rule{i}",
+             'conditions': {'subject_contains': [f"invoice {i}", f"rechnung {i}"],
+                            'from_contains': [f"billing{i}@vendor.example"]},
+             'action': {'folder': f"Folder{i % 10}", 'push_notification': i % 2 == 0}}
+            for i in range(rules)
+        ],
+    }
+
+def cold_start(code, path, runs, before=None):
+    """Median wall time of a fresh interpreter running code"""
+    script = f"import sys; sys.path.insert(0, {SCRIPTS!r}); PATH = {path!r}\n{code}"
+    times = []
+    for _ in range(runs):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", script], check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark config loading at process start')
+    parser.add_argument('--accounts', type=int, default=20)
+    parser.add_argument('--rules', type=int, default=200)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_config_')
+    path = os.path.join(scratch, "accounts.yaml")
+    cache = os.path.join(scratch, ".accounts.yaml.cache")
+    with open(path, 'w') as f:
+        yaml.dump(make_config(args.accounts, args.rules), f, default_flow_style=False, indent=2)
+
+    def drop_cache():
+        if os.path.exists(cache):
+            os.unlink(cache)
+
+    print(f"📊 Config cold start: {args.accounts} accounts, {args.rules} rules, "
+          f"{os.path.getsize(path) / 1024:.0f} KB YAML, median of {args.runs} runs")
+    try:
+        baseline = cold_start("pass", path, args.runs)
+        print(f"{'interpreter only':<26} {baseline * 1000:7.1f} ms")
+        for label, code in CASES.items():
+            before = drop_cache if label.endswith("no cache") else None
+            if label.endswith("cached"):
+                cold_start(code, path, 1)
+            elapsed = cold_start(code, path, args.runs, before)
+            print(f"{label:<26} {elapsed * 1000:7.1f} ms  (+{(elapsed - baseline) * 1000:.1f} ms over interpreter)")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Benchmark compiled filter rules against the original per-message rule loop
+
+Generates random rule sets and messages, checks that both implementations
+pick the same rule for every message and prints per-message timings.
+
+Usage: python3 bench_filters.py [--rules 10,100,500,3000] [--messages 200] [--body-kb 50]
+"""
+
+import argparse
+import random
+import string
+import time
+
+import filter_engine
+from filter_engine import CompiledRules
+
+def legacy_match(filter_rules, subject, from_addr, body):
+    """The rule loop MailProcessor.apply_filter_rules used before compilation"""
+    for rule in filter_rules:
+        conditions = rule.get('conditions', {})
+        matches = True
+        if 'subject_contains' in conditions:
+            subject_terms = conditions['subject_contains']
+            if isinstance(subject_terms, str):
+                subject_terms = [subject_terms]
+            if not any(term.lower() in subject for term in subject_terms):
+                matches = False
+        if 'from_contains' in conditions:
+            from_terms = conditions['from_contains']
+            if isinstance(from_terms, str):
+                from_terms = [from_terms]
+            if not any(term.lower() in from_addr for term in from_terms):
+                matches = False
+        if 'body_contains' in conditions:
+            body_terms = conditions['body_contains']
+            if isinstance(body_terms, str):
+                body_terms = [body_terms]
+            if not any(term.lower() in body for term in body_terms):
+                matches = False
+        if matches:
+            return rule
+    return None
+
+def random_word(rng, low=4, high=10):
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(low, high)))
+
+def make_rules(rng, vocabulary, count):
+    rules = []
+    for i in range(count):
+        conditions = {}
+        kind = rng.random()
+        if kind < 0.4:
+            conditions['subject_contains'] = [rng.choice(vocabulary).upper() for _ in range(rng.randint(1, 3))]
+        elif kind < 0.7:
+            conditions['from_contains'] = rng.choice(vocabulary)
+        else:
+            conditions['body_contains'] = [rng.choice(vocabulary) for _ in range(rng.randint(1, 3))]
+        if rng.random() < 0.2:
+            conditions['subject_contains'] = [rng.choice(vocabulary)]
+        rules.append({'name': f'rule{i}', 'conditions': conditions, 'action': {'folder': f'F{i}'}})
+    return rules
+
+def make_messages(rng, vocabulary, count, body_kb):
+    filler = [random_word(rng) for _ in range(2000)]
+    messages = []
+    for _ in range(count):
+        subject = ' '.join(rng.choice(filler) for _ in range(6))
+        if rng.random() < 0.3:
+            subject += ' ' + rng.choice(vocabulary)
+        from_addr = f"{rng.choice(filler)}@{rng.choice(filler)}.com"
+        words = []
+        size = 0
+        while size < body_kb * 1024:
+            word = rng.choice(vocabulary) if rng.random() < 0.001 else rng.choice(filler)
+            words.append(word)
+            size += len(word) + 1
+        messages.append((subject.lower(), from_addr.lower(), ' '.join(words)))
+    return messages
+
+def run(rule_count, message_count, body_kb, seed=42):
+    rng = random.Random(seed)
+    vocabulary = [random_word(rng, 5, 12) for _ in range(max(50, rule_count * 3))]
+    rules = make_rules(rng, vocabulary, rule_count)
+    messages = make_messages(rng, vocabulary, message_count, body_kb)
+
+    start = time.perf_counter()
+    compiled = CompiledRules(rules)
+    compile_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = [legacy_match(rules, *m) for m in messages]
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = [compiled.match(*m) for m in messages]
+    compiled_time = time.perf_counter() - start
+
+    if [r and r['name'] for r in expected] != [r and r['name'] for r in actual]:
+        raise SystemExit(f"❌ Result mismatch with {rule_count} rules")
+
+    matched = sum(1 for r in actual if r is not None)
+    automaton = any(m.automaton is not None for m in compiled.matchers.values())
+    print(f"{rule_count:>6} rules  {matched:>4}/{message_count} matched  "
+          f"compile {compile_time * 1000:7.1f} ms  "
+          f"legacy {legacy_time / message_count * 1000:8.3f} ms/msg  "
+          f"compiled {compiled_time / message_count * 1000:8.3f} ms/msg  "
+          f"x{legacy_time / compiled_time:5.1f}"
+          f"{'  (automaton)' if automaton else ''}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark filter rule matching')
+    parser.add_argument('--rules', default='10,100,500,3000', help='Comma separated rule counts')
+    parser.add_argument('--messages', type=int, default=200, help='Messages per run')
+    parser.add_argument('--body-kb', type=int, default=50, help='Body size per message in KB')
+    parser.add_argument('--automaton-min-terms', type=int, default=None,
+                        help='Override the term count from which fields use Aho-Corasick')
+    args = parser.parse_args()
+
+    if args.automaton_min_terms is not None:
+        filter_engine.AUTOMATON_MIN_TERMS = args.automaton_min_terms
+
+    print(f"📊 Filter rule benchmark: {args.messages} messages, {args.body_kb} KB bodies")
+    for count in args.rules.split(','):
+        run(int(count), args.messages, args.body_kb)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark the mbox importer against the original mailbox.mbox loop
+
+Generates an mbox corpus of the requested size, checks that the offset
+scanner splits it exactly like mailbox.mbox and reports the throughput of
+both import paths.
+
+Usage: python3 bench_import.py [--size-mb 2048] [--workers 4] [--legacy-mb 256] [--keep]
+"""
+
+import os
+import time
+import random
+import shutil
+import hashlib
+import mailbox
+import tempfile
+import argparse
+from pathlib import Path
+
+import import_emails
+
+def legacy_import(mbox_file, cur_dir):
+    """The per-message loop import_mbox_file used before the offset scanner"""
+    imported = 0
+    for message in mailbox.mbox(mbox_file):
+        raw_msg = message.as_bytes()
+        content_hash = hashlib.md5(raw_msg).hexdigest()[:8]
+        cur_dir.mkdir(parents=True, exist_ok=True)
+        with open(cur_dir / f"{int(time.time())}.{imported}.{content_hash}:2,S", 'wb') as f:
+            f.write(raw_msg)
+        imported += 1
+    return imported
+
+def generate_mbox(path, size_mb, seed=42):
+    """Write an mbox of roughly size_mb with 2-200 KB messages; returns the message count"""
+    rng = random.Random(seed)
+    words = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 9)))
+             for _ in range(5000)]
+    lines = [' '.join(rng.choice(words) for _ in range(12)).encode() for _ in range(4000)]
+    target = size_mb * 1024 * 1024
+    written = count = 0
+    with open(path, 'wb', buffering=1024 * 1024) as f:
+        while written < target:
+            body_lines = rng.randint(25, 2500)
+            body = b"\n".join(rng.choice(lines) for _ in range(body_lines))
+            message = (
+                b"From sender%d@example.com Mon Jan  1 00:00:00 2024\n"
+                b"From: Sender %d <sender%d@example.com>\n"
+                b"To: user1@example.com\n"
+                b"Subject: Message %d\n"
+                b"Message-ID: <%d@bench.example.com>\n"
+                b"\n%s\n>From the quoted line\nLine with From inside\n\n"
+                % (count, count, count, count, count, body)
+            )
+            f.write(message)
+            written += len(message)
+            count += 1
+    return count
+
+def verify_split(mbox_file, sample=500):
+    """Compare the scanner's message bytes with mailbox.mbox for the first messages"""
+    box = mailbox.mbox(mbox_file)
+    with open(mbox_file, 'rb') as f:
+        data = f.read(64 * 1024 * 1024)
+    for index, (start, end) in enumerate(import_emails.scan_mbox(data)):
+        if index >= sample or end >= len(data):
+            break
+        if data[start:end] != box.get_bytes(index):
+            raise SystemExit(f"❌ Message {index} differs from mailbox.mbox")
+    box.close()
+
+def timed(label, size, func):
+    start = time.perf_counter()
+    count = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {count:>8} msgs  {elapsed:7.2f} s  "
+          f"{count / elapsed:8.0f} msg/s  {size / 1048576 / elapsed:7.1f} MB/s")
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the mbox importer')
+    parser.add_argument('--size-mb', type=int, default=2048, help='Size of the generated mbox')
+    parser.add_argument('--legacy-mb', type=int, default=256,
+                        help='Size of the corpus used for the legacy loop (0 to skip)')
+    parser.add_argument('--workers', type=int, default=import_emails.DEFAULT_WORKERS)
+    parser.add_argument('--dir', default=None, help='Scratch directory (default: system temp)')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated corpus')
+    args = parser.parse_args()
+
+    scratch = Path(tempfile.mkdtemp(prefix='bench_import_', dir=args.dir))
+    try:
+        mbox_file = scratch / 'corpus.mbox'
+        print(f"📦 Generating {args.size_mb} MB corpus in {scratch}")
+        expected = generate_mbox(mbox_file, args.size_mb)
+        size = mbox_file.stat().st_size
+        verify_split(mbox_file)
+
+        imported = timed(f"import ({args.workers} workers)", size,
+                         lambda: import_emails.import_mbox_file(mbox_file, scratch / 'new', 'user1',
+                                                                args.workers)
+                         and len(os.listdir(scratch / 'new' / 'user1' / 'Maildir' / 'cur')))
+        if imported != expected:
+            raise SystemExit(f"❌ Imported {imported} of {expected} messages")
+        shutil.rmtree(scratch / 'new')
+
+        if args.legacy_mb:
+            legacy_file = scratch / 'legacy.mbox'
+            generate_mbox(legacy_file, min(args.legacy_mb, args.size_mb))
+            legacy_size = legacy_file.stat().st_size
+            timed("import (new path)", legacy_size,
+                  lambda: import_emails.import_mbox_file(legacy_file, scratch / 'new', 'user1', args.workers)
+                  and len(os.listdir(scratch / 'new' / 'user1' / 'Maildir' / 'cur')))
+            timed("legacy mailbox loop", legacy_size,
+                  lambda: legacy_import(legacy_file, scratch / 'legacy' / 'cur'))
+    finally:
+        if not args.keep:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
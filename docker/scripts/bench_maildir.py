@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark the Maildir writer against the original direct writes
+
+The original importer and test downloader named files
+"<seconds>.<md5[:8]>:2,S" and wrote them straight into cur/ or new/; the
+benchmark also counts how many messages that scheme silently overwrote.
+
+Usage: python3 bench_maildir.py [--messages 5000] [--size-kb 20] [--threads 4]
+"""
+
+import os
+import time
+import random
+import shutil
+import hashlib
+import tempfile
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from maildir import MaildirWriter
+
+def legacy_write(cur_dir, raw_msg):
+    """Filename scheme and write used by import_emails/test_download before maildir.py"""
+    filename = f"{int(time.time())}.{hashlib.md5(raw_msg).hexdigest()[:8]}:2,S"
+    with open(os.path.join(cur_dir, filename), 'wb') as f:
+        f.write(raw_msg)
+
+def make_messages(count, size_kb, duplicates=0.05, seed=42):
+    """Random messages, a few of them byte-identical (re-sent mail, mailing list copies)"""
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        if messages and rng.random() < duplicates:
+            messages.append(rng.choice(messages))
+        else:
+            messages.append(b"Subject: %d\n\n" % i + rng.randbytes(size_kb * 1024))
+    return messages
+
+def run(messages, threads, write):
+    chunks = [messages[i::threads] for i in range(threads)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(write, chunks))
+    elapsed = time.perf_counter() - start
+    return elapsed
+
+def count_files(path):
+    return sum(len(os.listdir(os.path.join(path, sub))) for sub in ("new", "cur") if os.path.isdir(os.path.join(path, sub)))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Maildir writer')
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--size-kb', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=64, help='Messages per MaildirBatch')
+    parser.add_argument('--dir', default=None, help='Scratch directory (default: system temp)')
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages, args.size_kb)
+    scratch = tempfile.mkdtemp(prefix='bench_maildir_', dir=args.dir)
+    total_mb = sum(map(len, messages)) / 1048576
+    print(f"📊 Maildir writer benchmark: {len(messages)} messages, {total_mb:.0f} MB, {args.threads} threads")
+
+    def legacy(path):
+        os.makedirs(os.path.join(path, "cur"))
+        return lambda chunk: [legacy_write(os.path.join(path, "cur"), m) for m in chunk]
+
+    def single(path, fsync):
+        writer = MaildirWriter(path, fsync=fsync)
+        return lambda chunk: [writer.add(m, seen=True) for m in chunk]
+
+    def batched(path, fsync):
+        writer = MaildirWriter(path, fsync=fsync)
+
+        def write(chunk):
+            with writer.batch(args.batch) as batch:
+                for m in chunk:
+                    batch.add(m, seen=True)
+        return write
+
+    cases = [
+        ("legacy direct write", legacy),
+        ("writer, no fsync", lambda p: single(p, False)),
+        ("writer, batched fsync", lambda p: batched(p, True)),
+        ("writer, fsync each", lambda p: single(p, True)),
+    ]
+    try:
+        for index, (label, factory) in enumerate(cases):
+            path = os.path.join(scratch, str(index))
+            elapsed = run(messages, args.threads, factory(path))
+            stored = count_files(path)
+            lost = len(messages) - stored
+            print(f"{label:<24} {elapsed:7.2f} s  {len(messages) / elapsed:8.0f} msg/s  "
+                  f"{total_mb / elapsed:7.1f} MB/s  {stored:>6} stored"
+                  f"{f'  ({lost} overwritten)' if lost else ''}")
+            shutil.rmtree(path)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Benchmark the web interface under concurrent load
+
+Starts the web interface against a scratch accounts.yaml, once under
+gunicorn (web/gunicorn.conf.py) and once under Flask's development server,
+and has client threads request the dashboard, the status page and the
+JSON APIs while other clients keep running connection tests against a
+POP3 server that accepts connections and never answers. Reports latency
+per page and how many requests were answered.
+
+Usage: python3 bench_web.py [--seconds 20] [--clients 16] [--slow-tests 8] [--server both|gunicorn|development]
+"""
+
+import os
+import sys
+import time
+import socket
+import shutil
+import tempfile
+import argparse
+import threading
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PAGES = ['/', '/status', '/api/logs?lines=100', '/api/mailboxes', '/api/messages?limit=50', '/metrics']
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def silent_pop3_server():
+    """Port of a server that accepts connections and never sends a greeting"""
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(128)
+    held = []
+
+    def accept():
+        while True:
+            conn, _ = server.accept()
+            held.append(conn)
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server.getsockname()[1]
+
+def write_config(path, maildir_root, pop_port, test_timeout):
+    import yaml
+    config = {
+        'accounts': [{'name': 'silent', 'pop_server': '127.0.0.1', 'pop_port': pop_port, 'ssl': False,
+                      'user': 'bench', 'password': 'bench', 'imap_user': 'bench'}],
+        'settings': {
+            'delivery': {'method': 'maildir', 'maildir_root': maildir_root},
+            'metrics': {'path': os.path.join(maildir_root, '.mail-bridge', 'metrics.db')},
+            'web': {'connection_test_timeout': test_timeout},
+        },
+    }
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f)
+
+def start_server(kind, app_dir, config_path, port, scratch):
+    env = dict(os.environ, MAIL_BRIDGE_CONFIG=config_path,
+               PYTHONPATH=os.pathsep.join(filter(None, [SCRIPTS_DIR, os.environ.get('PYTHONPATH')])))
+    if kind == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+                   '--pid', os.path.join(scratch, 'web.pid'), 'app:app']
+    else:
+        command = [sys.executable, '-c',
+                   f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    proc = subprocess.Popen(command, cwd=app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=5).read()
+            return proc
+        except (urllib.error.URLError, OSError):
+            if proc.poll() is not None:
+                break
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{kind} server did not start")
+
+def fetch(url, timeout):
+    """(status, seconds) of one GET; status 0 when there was no answer in time"""
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = 0
+    return status, time.perf_counter() - start
+
+def run_load(base, seconds, clients, slow_tests, test_timeout):
+    results = {page: [] for page in PAGES}
+    tests = []
+    stop = time.time() + seconds
+
+    def client(number):
+        i = number
+        while time.time() < stop:
+            page = PAGES[i % len(PAGES)]
+            results[page].append(fetch(base + page, timeout=30))
+            i += 1
+
+    def tester():
+        while time.time() < stop:
+            tests.append(fetch(base + '/accounts/test/silent', timeout=test_timeout * 3))
+
+    threads = [threading.Thread(target=tester) for _ in range(slow_tests)]
+    # The connection tests get going first, so the pages are measured while they hang
+    for thread in threads:
+        thread.start()
+    time.sleep(0.5)
+    threads += [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for thread in threads[slow_tests:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, tests
+
+def report(kind, results, tests, seconds):
+    answered = sum(1 for page in results for status, _ in results[page] if status == 200)
+    print(f"\n🌐 {kind}: {answered / seconds:.0f} pages/s answered")
+    for page, samples in results.items():
+        times = sorted(t * 1000 for status, t in samples if status == 200)
+        failed = sum(1 for status, _ in samples if status != 200)
+        if not times:
+            print(f"  {page:<26} no answers ({failed} failed)")
+            continue
+        p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+        print(f"  {page:<26} median {statistics.median(times):7.1f} ms  p95 {p95:7.1f} ms  "
+              f"worst {times[-1]:7.1f} ms  ({len(times)} ok, {failed} failed)")
+    statuses = {}
+    for status, _ in tests:
+        statuses[status] = statuses.get(status, 0) + 1
+    print(f"  connection tests: " + ", ".join(f"{count} x {status or 'no answer'}"
+                                              for status, count in sorted(statuses.items())))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the web interface under concurrent load')
+    parser.add_argument('--seconds', type=int, default=20)
+    parser.add_argument('--clients', type=int, default=16, help='Threads requesting pages')
+    parser.add_argument('--slow-tests', type=int, default=8, help='Threads running connection tests that hang')
+    parser.add_argument('--test-timeout', type=int, default=5, help='settings.web.connection_test_timeout')
+    parser.add_argument('--server', choices=['both', 'gunicorn', 'development'], default='both')
+    parser.add_argument('--app-dir', default='/app/web' if os.path.isdir('/app/web')
+                        else os.path.join(os.path.dirname(SCRIPTS_DIR), 'web'))
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench_web_')
+    config_path = os.path.join(scratch, 'accounts.yaml')
+    write_config(config_path, os.path.join(scratch, 'maildata'), silent_pop3_server(), args.test_timeout)
+    kinds = ['gunicorn', 'development'] if args.server == 'both' else [args.server]
+    print(f"📊 {args.clients} clients, {args.slow_tests} hanging connection tests, {args.seconds}s per server")
+    try:
+        for kind in kinds:
+            port = free_port()
+            proc = start_server(kind, args.app_dir, config_path, port, scratch)
+            try:
+                results, tests = run_load(f'http://127.0.0.1:{port}', args.seconds, args.clients,
+                                          args.slow_tests, args.test_timeout)
+            finally:
+                proc.terminate()
+                proc.wait()
+            report(kind, results, tests, args.seconds)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,613 @@
+#!/usr/bin/env python3
+"""
+Searchable catalog of the messages in the IMAP users' Maildirs
+
+One SQLite row per message (<maildir root>/.mail-bridge/catalog.db) with
+the header fields a message list shows, its folder, flags, size and
+Maildir file, plus an FTS5 index over subject, sender and the first
+body_prefix characters of the body text. The web interface lists and
+searches mail from here instead of opening message files.
+
+Rows are added as mail arrives:
+- delivery (process_mail) records a message as soon as Dovecot accepted
+  it; the file name is Dovecot's choice, so the row is linked to its file
+  by the next sync
+- writers that know the file (the importer) add it right after the rename
+- sync() walks the folders whose new/ or cur/ mtime changed since their
+  last sync and catalogs files it has not seen, follows flag changes and
+  moves between new/ and cur/, and drops messages that were expunged.
+  Run for the first time it is the backfill of existing mail; it commits
+  every SYNC_BATCH messages, so it can be interrupted and picks up where
+  it stopped.
+
+Lists are ordered by Date (newest first) and searches by catalog order
+(most recently cataloged first), both paged with a cursor instead of an
+OFFSET, so every page costs the same (see bench_catalog.py).
+
+Usage: python3 catalog.py [--root /maildata] [--full] [--search QUERY] [--user USER] [--folder FOLDER]
+"""
+
+import os
+import re
+import time
+import html
+import binascii
+import logging
+import threading
+from email.header import decode_header, make_header
+from email.utils import parsedate_to_datetime
+
+from mailbox_stats import DEFAULT_MAILDIR_ROOT, folder_name, folder_directory, locate, mailbox_folders, maildir_root
+
+logger = logging.getLogger(__name__)
+
+SYNC_INTERVAL = 60
+# Messages cataloged per transaction while syncing
+SYNC_BATCH = 500
+# Start of a message file parsed for the catalog (headers and the first text part)
+READ_BYTES = 32 * 1024
+# Characters of body text stored and indexed per message
+BODY_PREFIX = 1024
+PREVIEW_CHARS = 200
+MAX_PAGE = 500
+# Nesting of multipart parts searched for the text
+MAX_MIME_DEPTH = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    imap_user TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    name TEXT,
+    filename TEXT,
+    flags TEXT NOT NULL DEFAULT '',
+    message_id TEXT,
+    subject TEXT NOT NULL DEFAULT '',
+    sender TEXT NOT NULL DEFAULT '',
+    recipients TEXT NOT NULL DEFAULT '',
+    date REAL NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    body TEXT NOT NULL DEFAULT '',
+    added_at REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS messages_file ON messages (imap_user, directory, name);
+CREATE INDEX IF NOT EXISTS messages_folder_date ON messages (imap_user, directory, date, id);
+CREATE INDEX IF NOT EXISTS messages_date ON messages (date, id);
+CREATE INDEX IF NOT EXISTS messages_unlinked ON messages (imap_user, directory, message_id) WHERE name IS NULL;
+CREATE TABLE IF NOT EXISTS catalog_folders (
+    imap_user TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    new_mtime INTEGER,
+    cur_mtime INTEGER,
+    synced_at REAL,
+    PRIMARY KEY (imap_user, directory)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    subject, sender, body, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, subject, sender, body) VALUES (new.id, new.subject, new.sender, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, subject, sender, body)
+    VALUES ('delete', old.id, old.subject, old.sender, old.body);
+END;
+"""
+# subject, sender and body are never updated in place (a changed message is
+# a new file), so there is no UPDATE trigger; sync only touches file columns
+
+_COLUMNS = ("m.id, m.imap_user, m.directory, m.filename, m.flags, m.message_id, m.subject, m.sender, "
+            "m.recipients, m.date, m.size, m.body")
+
+_HEADER_END = re.compile(rb'\r?\n\r?\n')
+# One header field with its continuation lines
+_FIELD = re.compile(rb'^([!-9;-~]+)[ \t]*:(.*(?:\r?\n[ \t].*)*)', re.MULTILINE)
+MESSAGE_FIELDS = ('message-id', 'subject', 'from', 'to', 'date', 'content-type', 'content-transfer-encoding')
+PART_FIELDS = ('content-type', 'content-transfer-encoding', 'content-disposition')
+_PARAM = re.compile(r';\s*([^\s=;]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^;\s]*)')
+_TAGS = re.compile(r'<(script|style)\b.*?</\1\s*>|<[^>]*>', re.IGNORECASE | re.DOTALL)
+# A search term, optionally restricted to a field: from:alice subject:"order 1234" invoice
+_TERM = re.compile(r'(?:(\w+):)?("[^"]*"?|[^\s"]+)')
+_WORD = re.compile(r'\w+')
+FIELDS = {'from': 'sender', 'subject': 'subject', 'body': 'body'}
+
+def catalog_path(root):
+    return os.path.join(str(root), ".mail-bridge", "catalog.db")
+
+def _decoded(value):
+    """Header value with RFC 2047 encoded words decoded"""
+    if value is None:
+        return ''
+    if '=?' not in value:
+        return value
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return value
+
+def header_fields(head, wanted):
+    """{lower-case name: value} of the first of each wanted field in a header section
+
+    Much cheaper than the email parser, which also handles the fields that
+    are not needed here; 8-bit values are read as UTF-8.
+    """
+    fields = {}
+    for name, value in _FIELD.findall(head):
+        name = name.decode('ascii').lower()
+        if name in wanted and name not in fields:
+            fields[name] = ' '.join(value.decode('utf-8', errors='replace').split())
+    return fields
+
+def content_type(fields):
+    """(lower-case type, {parameter: value}) of a Content-Type field; text/plain if missing"""
+    value = fields.get('content-type', '')
+    main = value.split(';', 1)[0].strip().lower()
+    if '/' not in main:
+        main = 'text/plain'
+    params = {}
+    for name, param in _PARAM.findall(value):
+        params.setdefault(name.lower(), param[1:-1].replace('\\"', '"') if param.startswith('"') else param)
+    return main, params
+
+def _split_head(raw):
+    """(header section, body) of a message or MIME part"""
+    if raw.startswith(b'\n') or raw.startswith(b'\r\n'):
+        return b'', raw[raw.index(b'\n') + 1:]
+    match = _HEADER_END.search(raw)
+    if match is None:
+        return raw, b''
+    return raw[:match.end()], raw[match.end():]
+
+def _text_part(fields, body, depth=0):
+    """(type, charset, transfer encoding, body) of the first text/plain part, else of the first text/html part
+
+    None if there is neither. Parts are found by splitting the body on the
+    boundary instead of feeding it line by line through the email parser.
+    """
+    main, params = content_type(fields)
+    if main.startswith('multipart/'):
+        boundary = params.get('boundary')
+        if not boundary or depth >= MAX_MIME_DEPTH:
+            return None
+        html_part = None
+        for chunk in body.split(b'--' + boundary.encode('utf-8'))[1:]:
+            if chunk.startswith(b'--'):
+                break
+            line_end = chunk.find(b'\n')
+            if line_end < 0:
+                continue
+            part_head, part_body = _split_head(chunk[line_end + 1:])
+            found = _text_part(header_fields(part_head, PART_FIELDS), part_body, depth + 1)
+            if found is not None:
+                if found[0] == 'text/plain':
+                    return found
+                html_part = html_part or found
+        return html_part
+    if main in ('text/plain', 'text/html') and not fields.get('content-disposition', '').lower().startswith('attachment'):
+        return main, params.get('charset'), fields.get('content-transfer-encoding', '').lower(), body
+    return None
+
+def _decode_body(encoding, body):
+    try:
+        if encoding == 'base64':
+            data = b''.join(body.split())
+            return binascii.a2b_base64(data[:len(data) // 4 * 4])
+        if encoding == 'quoted-printable':
+            return binascii.a2b_qp(body)
+    except (binascii.Error, ValueError):
+        return b''
+    return body
+
+def body_text(fields, body, limit=BODY_PREFIX):
+    """First limit characters of a message's text, whitespace collapsed and HTML reduced to text"""
+    part = _text_part(fields, body)
+    if part is None:
+        return ''
+    main, charset, encoding, body = part
+    # Decoding a large part only to cut it afterwards would be wasted
+    payload = _decode_body(encoding, body[:limit * 4])
+    try:
+        text = payload.decode(charset or 'utf-8', errors='replace')
+    except LookupError:
+        text = payload.decode('utf-8', errors='replace')
+    if main == 'text/html':
+        text = html.unescape(_TAGS.sub(' ', text))
+    return ' '.join(text.split())[:limit]
+
+def _message_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except Exception:
+        return None
+
+def parse_message(raw, body_prefix=BODY_PREFIX):
+    """Catalog fields of a message from (the start of) its raw bytes"""
+    head, body = _split_head(raw[:READ_BYTES])
+    fields = header_fields(head, MESSAGE_FIELDS)
+    return {
+        'message_id': fields.get('message-id') or None,
+        'subject': _decoded(fields.get('subject')),
+        'sender': _decoded(fields.get('from')),
+        'recipients': _decoded(fields.get('to')),
+        'date': _message_date(fields.get('date')),
+        'body': body_text(fields, body, body_prefix) if body_prefix else '',
+    }
+
+def split_filename(filename):
+    """(unique name, flags) of a Maildir file name "<unique>[,S=..]:2,<flags>" """
+    name, _, flags = filename.partition(':2,')
+    return name.split(':', 1)[0], flags
+
+def _name_time(name):
+    """Delivery time encoded at the start of a Maildir unique name, or None"""
+    seconds = name.split('.', 1)[0]
+    return float(seconds) if seconds.isdigit() else None
+
+def fts_query(text):
+    """FTS5 query for user input: every term must match; from:/subject:/body: select a field
+
+    Terms match whole words, "quoted words" a phrase and a trailing *
+    (invoi*) any word starting with it. Prefixes are opt-in because a
+    short one merges the lists of every word it covers, which is slow on a
+    large catalog. Only words are passed on, so no input is an FTS5 syntax
+    error. Returns '' when the input has no words.
+    """
+    parts = []
+    for field, term in _TERM.findall(text):
+        column = FIELDS.get(field.lower())
+        if field and column is None:
+            # "re:invoice" or a URL, not a field filter
+            term = f"{field}:{term}"
+        words = _WORD.findall(term)
+        if not words:
+            continue
+        phrase = '"' + ' '.join(words) + '"'
+        if term.endswith('*') and not term.startswith('"'):
+            phrase += '*'
+        parts.append(f"{column} : {phrase}" if column else phrase)
+    return ' AND '.join(parts)
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def _list_folder(path):
+    """{unique name: (subdir/filename, flags)} of the messages in a Maildir folder"""
+    files = {}
+    for sub in ("new", "cur"):
+        try:
+            entries = os.listdir(os.path.join(path, sub))
+        except FileNotFoundError:
+            continue
+        for filename in entries:
+            if filename.startswith('.'):
+                continue
+            name, flags = split_filename(filename)
+            files[name] = (f"{sub}/{filename}", flags)
+    return files
+
+class Catalog:
+    """Message catalog and full-text index of the Maildirs under one root"""
+
+    def __init__(self, root=DEFAULT_MAILDIR_ROOT, path=None, body_prefix=BODY_PREFIX):
+        self.root = os.path.abspath(str(root))
+        self.path = path or catalog_path(root)
+        self.body_prefix = body_prefix
+        self.lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connect(self):
+        # sqlite3 only once the catalog is used, and a fresh connection after a fork
+        if self._conn is None or self._pid != os.getpid():
+            import sqlite3
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _parse_file(self, path):
+        """Catalog fields and size of a message file, or None if it disappeared"""
+        try:
+            with open(path, 'rb') as f:
+                raw = f.read(READ_BYTES)
+                size = os.fstat(f.fileno()).st_size
+        except FileNotFoundError:
+            return None
+        fields = parse_message(raw, self.body_prefix)
+        if fields['date'] is None:
+            fields['date'] = _name_time(split_filename(os.path.basename(path))[0]) or time.time()
+        return fields, size
+
+    @staticmethod
+    def _insert(conn, imap_user, directory, name, filename, flags, fields, size, now):
+        conn.execute(
+            "INSERT OR IGNORE INTO messages (imap_user, directory, name, filename, flags, message_id, subject, "
+            "sender, recipients, date, size, body, added_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (imap_user, directory, name, filename, flags, fields['message_id'], fields['subject'],
+             fields['sender'], fields['recipients'], fields['date'], size, fields['body'], now))
+
+    def add_message(self, imap_user, folder, raw, size):
+        """Catalog a message just delivered to an IMAP folder; raw is (at least) its start
+
+        The file is not known yet; sync() links the row to it.
+        """
+        fields = parse_message(raw, self.body_prefix)
+        now = time.time()
+        if fields['date'] is None:
+            fields['date'] = now
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                self._insert(conn, imap_user, folder_directory(folder), None, None, '', fields, size, now)
+
+    def add_files(self, folder_path, paths):
+        """Catalog message files just written to a Maildir folder; ignored if it is not under this root"""
+        location = self._location(folder_path)
+        if location is None:
+            return
+        imap_user, directory = location
+        rows = []
+        for path in paths:
+            parsed = self._parse_file(path)
+            if parsed is not None:
+                filename = os.path.basename(path)
+                name, flags = split_filename(filename)
+                rows.append((name, f"{os.path.basename(os.path.dirname(path))}/{filename}", flags) + parsed)
+        if not rows:
+            return
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                for name, filename, flags, fields, size in rows:
+                    self._insert(conn, imap_user, directory, name, filename, flags, fields, size, now)
+
+    def _location(self, folder_path):
+        location = locate(folder_path)
+        if location is None or location[0] != self.root:
+            return None
+        return location[1], location[2]
+
+    def sync(self, full=False):
+        """Catalog what changed on disk in every folder (or check every folder if full); returns folders synced"""
+        if not os.path.isdir(self.root):
+            # An unmounted volume must not look like every message was expunged
+            return 0
+        with self.lock:
+            conn = self._connect()
+            synced = {(user, directory): (new_mtime, cur_mtime)
+                      for user, directory, new_mtime, cur_mtime in conn.execute(
+                          "SELECT imap_user, directory, new_mtime, cur_mtime FROM catalog_folders")}
+            # Folders with delivered messages still waiting for their file
+            unlinked = set(conn.execute("SELECT DISTINCT imap_user, directory FROM messages WHERE name IS NULL"))
+        found = set()
+        count = 0
+        for user, directory, path in mailbox_folders(self.root):
+            found.add((user, directory))
+            # Taken before listing: a change during the sync shows up as a new mtime next time
+            mtimes = (_mtime(os.path.join(path, "new")), _mtime(os.path.join(path, "cur")))
+            if not full and synced.get((user, directory)) == mtimes and (user, directory) not in unlinked:
+                continue
+            self._sync_folder(user, directory, path, mtimes)
+            count += 1
+        gone = [key for key in set(synced) | unlinked if key not in found]
+        if gone:
+            with self.lock:
+                conn = self._connect()
+                with conn:
+                    conn.executemany("DELETE FROM messages WHERE imap_user = ? AND directory = ?", gone)
+                    conn.executemany("DELETE FROM catalog_folders WHERE imap_user = ? AND directory = ?", gone)
+        return count
+
+    def _sync_folder(self, user, directory, path, mtimes):
+        started = time.time()
+        files = _list_folder(path)
+        with self.lock:
+            known = {name: (row_id, filename) for row_id, name, filename in self._connect().execute(
+                "SELECT id, name, filename FROM messages WHERE imap_user = ? AND directory = ? AND name IS NOT NULL",
+                (user, directory))}
+
+        moved = [(filename, flags, known[name][0]) for name, (filename, flags) in files.items()
+                 if name in known and known[name][1] != filename]
+        expunged = [(row_id,) for name, (row_id, _) in known.items() if name not in files]
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany("UPDATE messages SET filename = ?, flags = ? WHERE id = ?", moved)
+                conn.executemany("DELETE FROM messages WHERE id = ?", expunged)
+
+        new = [(name, filename, flags) for name, (filename, flags) in files.items() if name not in known]
+        added = 0
+        for start in range(0, len(new), SYNC_BATCH):
+            rows = []
+            for name, filename, flags in new[start:start + SYNC_BATCH]:
+                parsed = self._parse_file(os.path.join(path, filename))
+                if parsed is not None:
+                    rows.append((name, filename, flags) + parsed)
+            now = time.time()
+            with self.lock:
+                conn = self._connect()
+                with conn:
+                    for name, filename, flags, fields, size in rows:
+                        # A delivered message recorded without its file: link it instead of adding it twice
+                        linked = conn.execute(
+                            "UPDATE messages SET name = ?, filename = ?, flags = ? WHERE id = ("
+                            "SELECT id FROM messages WHERE imap_user = ? AND directory = ? AND name IS NULL "
+                            "AND message_id IS ? AND subject = ? AND sender = ? LIMIT 1)",
+                            (name, filename, flags, user, directory, fields['message_id'], fields['subject'],
+                             fields['sender'])).rowcount
+                        if not linked:
+                            self._insert(conn, user, directory, name, filename, flags, fields, size, now)
+                            added += 1
+
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                # Delivered before the listing but not found: expunged already, or filed elsewhere by Sieve
+                conn.execute("DELETE FROM messages WHERE imap_user = ? AND directory = ? AND name IS NULL "
+                             "AND added_at < ?", (user, directory, started))
+                conn.execute(
+                    "INSERT INTO catalog_folders (imap_user, directory, new_mtime, cur_mtime, synced_at) "
+                    "VALUES (?, ?, ?, ?, ?) ON CONFLICT (imap_user, directory) DO UPDATE SET "
+                    "new_mtime = excluded.new_mtime, cur_mtime = excluded.cur_mtime, synced_at = excluded.synced_at",
+                    (user, directory, mtimes[0], mtimes[1], time.time()))
+        if added or expunged:
+            logger.info(f"Catalog: {user}/{folder_name(directory)} +{added} -{len(expunged)} messages")
+
+    def _message(self, row):
+        row_id, user, directory, filename, flags, message_id, subject, sender, recipients, date, size, body = row
+        return {
+            'id': row_id,
+            'imap_user': user,
+            'folder': folder_name(directory),
+            'subject': subject,
+            'from': sender,
+            'to': recipients,
+            'date': date,
+            'size': size,
+            'flags': flags,
+            'unread': filename is None or filename.startswith('new/') or 'S' not in flags,
+            'message_id': message_id,
+            'path': os.path.join(self.root, user, "Maildir", directory, filename) if filename else None,
+            'preview': body[:PREVIEW_CHARS],
+        }
+
+    @staticmethod
+    def _filters(imap_user, folder):
+        clauses, params = [], []
+        if imap_user:
+            clauses.append("m.imap_user = ?")
+            params.append(imap_user)
+        if folder:
+            clauses.append("m.directory = ?")
+            params.append(folder_directory(folder))
+        return clauses, params
+
+    def messages(self, imap_user=None, folder=None, limit=50, cursor=None):
+        """(messages newest first, cursor of the next page or None)
+
+        cursor is the value returned with the previous page.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE))
+        clauses, params = self._filters(imap_user, folder)
+        if cursor:
+            date, _, row_id = str(cursor).partition(':')
+            clauses.append("(m.date, m.id) < (?, ?)")
+            params += [float(date), int(row_id)]
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.lock:
+            rows = self._connect().execute(
+                f"SELECT {_COLUMNS} FROM messages m {where} ORDER BY m.date DESC, m.id DESC LIMIT ?",
+                params + [limit + 1]).fetchall()
+        next_cursor = f"{rows[limit - 1][9]!r}:{rows[limit - 1][0]}" if len(rows) > limit else None
+        return [self._message(row) for row in rows[:limit]], next_cursor
+
+    def search(self, query, imap_user=None, folder=None, limit=50, cursor=None):
+        """(messages matching query, most recently cataloged first; cursor of the next page or None)
+
+        See fts_query() for the query syntax.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE))
+        match = fts_query(query)
+        if not match:
+            return [], None
+        clauses, params = self._filters(imap_user, folder)
+        clauses.insert(0, "messages_fts MATCH ?")
+        params.insert(0, match)
+        if cursor:
+            clauses.append("messages_fts.rowid < ?")
+            params.append(int(cursor))
+        # CROSS JOIN keeps the full-text index as the outer loop, read in rowid order without sorting
+        with self.lock:
+            rows = self._connect().execute(
+                f"SELECT {_COLUMNS} FROM messages_fts CROSS JOIN messages m ON m.id = messages_fts.rowid "
+                f"WHERE {' AND '.join(clauses)} ORDER BY messages_fts.rowid DESC LIMIT ?",
+                params + [limit + 1]).fetchall()
+        next_cursor = str(rows[limit - 1][0]) if len(rows) > limit else None
+        return [self._message(row) for row in rows[:limit]], next_cursor
+
+    def count(self):
+        with self.lock:
+            return self._connect().execute("SELECT count(*) FROM messages").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+def shared(root=DEFAULT_MAILDIR_ROOT, body_prefix=BODY_PREFIX):
+    """The process-wide Catalog of a Maildir root"""
+    root = os.path.abspath(str(root))
+    with _shared_lock:
+        if root not in _shared:
+            _shared[root] = Catalog(root, body_prefix=body_prefix)
+        return _shared[root]
+
+def from_settings(settings):
+    """The shared Catalog configured in settings.catalog, or None if it is disabled"""
+    catalog_settings = settings.get('catalog', {}) or {}
+    if not catalog_settings.get('enabled', True):
+        return None
+    return shared(maildir_root(settings), catalog_settings.get('body_prefix', BODY_PREFIX))
+
+_syncers = {}
+
+def start_sync(catalog, interval=SYNC_INTERVAL):
+    """Sync the catalog from a background thread now and every interval seconds (once per root)"""
+    with _shared_lock:
+        if catalog.root in _syncers:
+            return
+
+        def run():
+            while True:
+                try:
+                    catalog.sync()
+                except Exception as e:
+                    logger.error(f"Message catalog sync failed: {e}")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name="catalog-sync", daemon=True)
+        _syncers[catalog.root] = thread
+        thread.start()
+
+def main():
+    import argparse
+    from datetime import datetime
+    parser = argparse.ArgumentParser(description='Update, list and search the message catalog')
+    parser.add_argument('--root', default=DEFAULT_MAILDIR_ROOT, help='Directory holding <user>/Maildir')
+    parser.add_argument('--full', action='store_true', help='Check every folder, not only changed ones')
+    parser.add_argument('--no-sync', action='store_true', help='Query the catalog as it is')
+    parser.add_argument('--search', help='Search query, e.g. \'invoice from:shop subject:"order 12"\'')
+    parser.add_argument('--user', help='Only this IMAP user')
+    parser.add_argument('--folder', help='Only this IMAP folder')
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    catalog = Catalog(args.root)
+    if not args.no_sync:
+        started = time.time()
+        synced = catalog.sync(full=args.full)
+        print(f"🔄 Synced {synced} folder(s) in {time.time() - started:.2f}s, {catalog.count()} messages cataloged")
+    started = time.time()
+    if args.search:
+        messages, _ = catalog.search(args.search, args.user, args.folder, args.limit)
+    else:
+        messages, _ = catalog.messages(args.user, args.folder, args.limit)
+    for message in messages:
+        print(f"{'📩' if message['unread'] else '📧'} {datetime.fromtimestamp(message['date']):%Y-%m-%d %H:%M} "
+              f"{message['imap_user']}/{message['folder']:<16} {message['from'][:30]:<30} {message['subject'][:60]}")
+    print(f"🔍 {len(messages)} message(s) in {(time.time() - started) * 1000:.1f} ms")
+    catalog.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Cached access to accounts.yaml
+
+The web interface, the delivery daemon and the fetcher all read the same
+configuration. ConfigStore parses and normalises it once per version of
+the file (keyed on inode, size, mtime and ctime, so a stat() per request
+is all an unchanged file costs) and hands out a shared ConfigSnapshot.
+
+A snapshot compiles the filter rules on first use and decrypts passwords
+only when a caller asks for one; pages that list accounts never touch the
+key derivation or Fernet. Snapshots are shared and must not be modified:
+code that edits the configuration takes a copy with for_edit().
+
+Parsing YAML (and importing PyYAML) dominates the start of a short-lived
+process such as process_mail.py, so whoever parses a new version of the
+file also writes .accounts.yaml.cache next to it: a pickle of the
+normalised config and its compiled rules, tagged with the identity of the
+YAML it came from. A cold start with a current cache costs one stat and
+one unpickle (see bench_config.py).
+"""
+
+import os
+import sys
+import copy
+import pickle
+import logging
+import threading
+
+from filter_engine import CompiledRules
+
+DEFAULT_CONFIG_PATH = "/config/accounts.yaml"
+# Bump when ConfigSnapshot or CompiledRules change shape
+CACHE_FORMAT = 1
+
+logger = logging.getLogger(__name__)
+
+_password_manager = None
+_password_lock = threading.Lock()
+
+def password_manager():
+    """The process-wide PasswordManager (deriving its key is slow, so only once)"""
+    global _password_manager
+    with _password_lock:
+        if _password_manager is None:
+            from password_manager import PasswordManager
+            _password_manager = PasswordManager()
+        return _password_manager
+
+def empty_config():
+    return {'accounts': [], 'settings': {}, 'filter_rules': []}
+
+def normalize(config):
+    """Fill in missing or empty top-level sections so callers can rely on their types"""
+    if not isinstance(config, dict):
+        if config is not None:
+            logger.error("Configuration is not a mapping, ignoring it")
+        return empty_config()
+    for key, default in empty_config().items():
+        if not isinstance(config.get(key), type(default)):
+            config[key] = default
+    config['accounts'] = [account for account in config['accounts'] if isinstance(account, dict)]
+    return config
+
+class ConfigSnapshot:
+    """One parsed version of accounts.yaml; read-only and shared between threads"""
+
+    def __init__(self, data, identity=None, rules=None, error=None):
+        self.data = data
+        self.identity = identity
+        self.error = error
+        self._rules = rules
+        self._passwords = {}
+        self._lock = threading.Lock()
+
+    @property
+    def settings(self):
+        return self.data['settings']
+
+    @property
+    def accounts(self):
+        return self.data['accounts']
+
+    @property
+    def filter_rules(self):
+        return self.data['filter_rules']
+
+    @property
+    def rules(self):
+        """filter_rules compiled into a CompiledRules (once per snapshot)"""
+        if self._rules is None:
+            with self._lock:
+                if self._rules is None:
+                    self._rules = CompiledRules(self.filter_rules)
+        return self._rules
+
+    def account(self, name):
+        for account in self.accounts:
+            if account.get('name') == name:
+                return account
+        return None
+
+    def password(self, account):
+        """POP3 password of an account from password_env, encrypted_password or password"""
+        if account.get('password_env'):
+            return os.environ.get(account['password_env'], '')
+        encrypted = account.get('encrypted_password')
+        if not encrypted:
+            return account.get('password', '')
+        with self._lock:
+            if encrypted not in self._passwords:
+                self._passwords[encrypted] = password_manager().decrypt(encrypted)
+            return self._passwords[encrypted]
+
+    def for_edit(self, decrypt=False):
+        """Private deep copy to modify and save; decrypt fills in every account's 'password'"""
+        config = copy.deepcopy(self.data)
+        if not decrypt:
+            return config
+        for account in config['accounts']:
+            if 'encrypted_password' in account:
+                try:
+                    account['password'] = self.password(account)
+                except Exception as e:
+                    logger.error(f"Failed to decrypt password for {account.get('name', 'unknown')}: {e}")
+                    account['password'] = ''
+        return config
+
+class ConfigStore:
+    """Loads accounts.yaml again only when the file changed"""
+
+    def __init__(self, path=DEFAULT_CONFIG_PATH):
+        self.path = path
+        self.snapshot = None
+        self.lock = threading.Lock()
+
+    def _identity(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+
+    @property
+    def cache_path(self):
+        directory, name = os.path.split(self.path)
+        return os.path.join(directory, f".{name}.cache")
+
+    def get(self):
+        """Current ConfigSnapshot, parsing the file only if it changed since the last call"""
+        identity = self._identity()
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.identity == identity:
+            return snapshot
+        with self.lock:
+            if self.snapshot is None or self.snapshot.identity != identity:
+                self.snapshot = self._load_cache(identity) or self._parse(identity)
+            return self.snapshot
+
+    def _load_cache(self, identity):
+        """Snapshot from the pickle cache if it was made from this version of the YAML"""
+        if identity is None:
+            return None
+        try:
+            with open(self.cache_path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['tag'] != (CACHE_FORMAT, sys.version_info[:2], identity):
+                return None
+            return ConfigSnapshot(cached['config'], identity, cached['rules'])
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable config cache {self.cache_path}: {e}")
+            return None
+
+    def _parse(self, identity):
+        if identity is None:
+            return ConfigSnapshot(empty_config(), identity, error=f"{self.path} not found")
+        import yaml
+        try:
+            with open(self.path, 'r') as f:
+                config = normalize(yaml.safe_load(f))
+        except Exception as e:
+            logger.error(f"Error loading config: {e}")
+            return ConfigSnapshot(empty_config(), identity, error=str(e))
+        snapshot = ConfigSnapshot(config, identity)
+        self._write_cache(snapshot)
+        return snapshot
+
+    def _write_cache(self, snapshot):
+        """Save snapshot (with its compiled rules) for the next process; best effort"""
+        cached = {
+            'tag': (CACHE_FORMAT, sys.version_info[:2], snapshot.identity),
+            'config': snapshot.data,
+            'rules': snapshot.rules,
+        }
+        import tempfile
+        directory = os.path.dirname(self.cache_path) or '.'
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix='.accounts-cache-', dir=directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(cached, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self.cache_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except Exception as e:
+            logger.debug(f"Could not write config cache {self.cache_path}: {e}")
+
+    def invalidate(self):
+        """Forget the cached snapshot, e.g. on SIGHUP"""
+        with self.lock:
+            self.snapshot = None
+
+    def save(self, config):
+        """Write config with passwords encrypted; returns True on success"""
+        config = copy.deepcopy(config)
+        try:
+            for account in config.get('accounts', []):
+                if account.get('password') and not self._same_password(account):
+                    account['encrypted_password'] = password_manager().encrypt(account['password'])
+                account.pop('password', None)
+            import yaml
+            with open(self.path, 'w') as f:
+                yaml.dump(config, f, default_flow_style=False, indent=2)
+        except Exception as e:
+            logger.error(f"Error saving config: {e}")
+            return False
+        self.invalidate()
+        return True
+
+    @staticmethod
+    def _same_password(account):
+        """True if encrypted_password already holds password (Fernet output differs on every call)"""
+        encrypted = account.get('encrypted_password')
+        if not encrypted:
+            return False
+        try:
+            return password_manager().decrypt(encrypted) == account['password']
+        except ValueError:
+            return False
+
+def account_diff(old_accounts, new_accounts):
+    """(added, removed, changed) account names between two account lists"""
+    old = {account.get('name', 'unnamed'): account for account in old_accounts}
+    new = {account.get('name', 'unnamed'): account for account in new_accounts}
+    added = [name for name in new if name not in old]
+    removed = [name for name in old if name not in new]
+    changed = [name for name in new if name in old and new[name] != old[name]]
+    return added, removed, changed
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_store(path=DEFAULT_CONFIG_PATH):
+    """The shared ConfigStore of a config file"""
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ConfigStore(path)
+        return _stores[path]
+
+def load(path=DEFAULT_CONFIG_PATH):
+    """Shared ConfigSnapshot of path"""
+    return get_store(path).get()
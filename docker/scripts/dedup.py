@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Duplicate message index
+
+A message is identified per IMAP user by its Message-ID plus a hash of its
+body (line endings and trailing blank lines normalised), so the same mail
+imported twice or fetched again after the UIDL state was lost is
+recognised even though transport headers like Received differ.
+
+Keys live in SQLite; a Bloom filter in memory answers "never seen" without
+touching the database, so the common case costs a few bit tests no matter
+how many messages are stored. The filter is saved on close once enough keys
+were added since the saved copy, and caught up from rows other processes
+added since (detected with PRAGMA data_version). It is grown in a background
+thread when it fills up. A process that handles a single message skips the
+filter (bloom=False) and looks the key up in the table's index.
+
+Usage: python3 dedup.py [--path /maildata/.mail-bridge/dedup.db]
+"""
+
+import os
+import re
+import sys
+import math
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+DEFAULT_DEDUP_PATH = "/maildata/.mail-bridge/dedup.db"
+DEFAULT_CAPACITY = 1000000
+DEFAULT_ERROR_RATE = 0.001
+# Keys added since the saved filter before close() saves it again (the filter is MBs)
+SNAPSHOT_INTERVAL = 1000
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen_messages (
+    id INTEGER PRIMARY KEY,
+    key BLOB NOT NULL UNIQUE,
+    source TEXT,
+    seen_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bloom_snapshot (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    capacity INTEGER NOT NULL,
+    error_rate REAL NOT NULL,
+    synced_id INTEGER NOT NULL,
+    bits BLOB NOT NULL,
+    key_count INTEGER
+);
+"""
+
+_HEADER_END = re.compile(rb'\r?\n\r?\n')
+_MESSAGE_ID = re.compile(rb'(?im)^message-id:[ \t]*((?:.*)(?:\r?\n[ \t].*)*)')
+_FALLBACK_HEADERS = re.compile(rb'(?im)^(from|date|subject):[ \t]*((?:.*)(?:\r?\n[ \t].*)*)')
+
+class BloomFilter:
+    """Fixed-size Bloom filter over 16-byte digests (double hashing)"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, error_rate=DEFAULT_ERROR_RATE, bits=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8) if bits is None else bytearray(bits)
+        self.count = 0
+
+    def _positions(self, key):
+        h1 = int.from_bytes(key[:8], 'little')
+        h2 = int.from_bytes(key[8:16], 'little') | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+def body_digest(chunks):
+    """Hash body chunks with CRLF folded to LF and trailing newlines ignored"""
+    digest = hashlib.blake2b(digest_size=16)
+    carry = b""
+    newlines = 0
+    for chunk in chunks:
+        data = (carry + chunk).replace(b"\r\n", b"\n")
+        carry = b""
+        if data.endswith(b"\r"):
+            data, carry = data[:-1], b"\r"
+        stripped = data.rstrip(b"\n")
+        if stripped:
+            digest.update(b"\n" * newlines)
+            digest.update(stripped)
+            newlines = len(data) - len(stripped)
+        else:
+            newlines += len(data)
+    if carry:
+        digest.update(b"\n" * newlines + carry)
+    return digest.digest()
+
+def message_key(imap_user, header_bytes, body_hash):
+    """Dedup key of a message from its raw header section and body_digest()"""
+    match = _MESSAGE_ID.search(header_bytes)
+    if match and match.group(1).strip():
+        identity = b"id:" + b"".join(match.group(1).split())
+    else:
+        # No Message-ID: fall back to the headers an author controls
+        identity = b"hdr:" + b"\0".join(
+            name.lower() + b"=" + b" ".join(value.split())
+            for name, value in _FALLBACK_HEADERS.findall(header_bytes)
+        )
+    key = hashlib.blake2b(digest_size=16)
+    key.update(imap_user.encode('utf-8') + b"\0" + identity + b"\0" + body_hash)
+    return key.digest()
+
+def raw_message_key(imap_user, raw_msg):
+    """Dedup key of a complete raw message"""
+    match = _HEADER_END.search(raw_msg)
+    header_end = match.end() if match else len(raw_msg)
+    return message_key(imap_user, raw_msg[:header_end], body_digest([raw_msg[header_end:]]))
+
+def _save_snapshot(conn, capacity, error_rate, synced_id, bits, key_count):
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO bloom_snapshot (id, capacity, error_rate, synced_id, bits, key_count) "
+            "VALUES (1, ?, ?, ?, ?, ?)",
+            (capacity, error_rate, synced_id, bits, key_count)
+        )
+
+class DedupIndex:
+    """Persistent set of message keys, safe to share between threads
+
+    claim() reserves a key before the message is written; commit() records
+    it once the write succeeded and release() gives it back on failure, so
+    a crash never marks an undelivered message as seen.
+    """
+
+    def __init__(self, path=DEFAULT_DEDUP_PATH, capacity=DEFAULT_CAPACITY, error_rate=DEFAULT_ERROR_RATE,
+                 bloom=True):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        self.pending = set()
+        self.skipped = 0
+        self.data_version = None
+        self.bloom = None
+        self.synced_id = 0
+        self.saved_id = None
+        self.rebuilding = False
+        if bloom:
+            self._load_bloom(capacity, error_rate)
+
+    def _migrate(self):
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(bloom_snapshot)")]
+        if 'key_count' not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE bloom_snapshot ADD COLUMN key_count INTEGER")
+
+    def _load_bloom(self, capacity, error_rate):
+        row = self.conn.execute(
+            "SELECT capacity, error_rate, synced_id, bits, key_count FROM bloom_snapshot WHERE id = 1"
+        ).fetchone()
+        if row and row[1] == error_rate:
+            self.bloom = BloomFilter(row[0], row[1], row[3])
+            if row[4] is None:
+                # Saved before the count was stored; counted once, the next save records it
+                row = row[:4] + (self.conn.execute(
+                    "SELECT COUNT(*) FROM seen_messages WHERE id <= ?", (row[2],)).fetchone()[0],)
+            else:
+                self.saved_id = row[2]
+            self.bloom.count = row[4]
+            self.synced_id = row[2]
+        else:
+            stored = self.conn.execute("SELECT COUNT(*) FROM seen_messages").fetchone()[0]
+            self.bloom = BloomFilter(max(capacity, stored * 2), error_rate)
+        self._catch_up(force=True)
+
+    def _catch_up(self, force=False):
+        """Add keys committed by other connections since the last check"""
+        if self.bloom is None:
+            return
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if not force and version == self.data_version:
+            return
+        self.data_version = version
+        rows = self.conn.execute(
+            "SELECT id, key FROM seen_messages WHERE id > ? ORDER BY id", (self.synced_id,)
+        )
+        for row_id, key in rows:
+            self.bloom.add(key)
+            self.synced_id = row_id
+        if self.bloom.count > self.bloom.capacity and not self.rebuilding:
+            # Takes seconds at millions of keys; the full filter keeps answering (with more
+            # false positives, which the table lookup catches) until the new one is ready
+            self.rebuilding = True
+            capacity = max(self.bloom.capacity, self.bloom.count) * 2
+            threading.Thread(target=self._rebuild, args=(capacity, self.bloom.error_rate),
+                             name="dedup-rebuild", daemon=True).start()
+
+    def _rebuild(self, capacity, error_rate):
+        """Grow the filter once it holds more keys than it was sized for"""
+        try:
+            bloom = BloomFilter(capacity, error_rate)
+            synced_id = 0
+            conn = sqlite3.connect(self.path, timeout=30)
+            try:
+                for row_id, key in conn.execute("SELECT id, key FROM seen_messages ORDER BY id"):
+                    bloom.add(key)
+                    synced_id = row_id
+            finally:
+                conn.close()
+            with self.lock:
+                if self.bloom is None:
+                    return
+                for row_id, key in self.conn.execute(
+                        "SELECT id, key FROM seen_messages WHERE id > ? ORDER BY id", (synced_id,)):
+                    bloom.add(key)
+                    synced_id = row_id
+                self.bloom, self.synced_id = bloom, synced_id
+                bits, count = bytes(bloom.bits), bloom.count
+            # Saved right away, so other processes load the grown filter instead of growing it again
+            conn = sqlite3.connect(self.path, timeout=30)
+            try:
+                _save_snapshot(conn, capacity, error_rate, synced_id, bits, count)
+            finally:
+                conn.close()
+            with self.lock:
+                self.saved_id = max(self.saved_id or 0, synced_id)
+            logger.info(f"Dedup Bloom filter grown to {capacity} keys")
+        except Exception as e:
+            logger.error(f"Dedup Bloom filter rebuild failed: {e}")
+        finally:
+            self.rebuilding = False
+
+    def _stored(self, key):
+        return self.conn.execute("SELECT 1 FROM seen_messages WHERE key = ?", (key,)).fetchone() is not None
+
+    def __contains__(self, key):
+        with self.lock:
+            self._catch_up()
+            return key in self.pending or self._seen(key)
+
+    def _seen(self, key):
+        if self.bloom is not None and key not in self.bloom:
+            return False
+        return self._stored(key)
+
+    def claim(self, key):
+        """Reserve a key; False if the message was already delivered or is being delivered"""
+        with self.lock:
+            self._catch_up()
+            if key in self.pending or self._seen(key):
+                self.skipped += 1
+                return False
+            self.pending.add(key)
+            return True
+
+    def commit(self, keys, source=None):
+        """Record claimed keys whose messages are now stored"""
+        if not keys:
+            return
+        now = time.time()
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO seen_messages (key, source, seen_at) VALUES (?, ?, ?)",
+                    [(key, source, now) for key in keys]
+                )
+            # Pull the new rows into the filter before the keys leave pending
+            self._catch_up(force=True)
+            self.pending.difference_update(keys)
+
+    def release(self, keys):
+        """Give back claimed keys whose messages could not be stored"""
+        with self.lock:
+            for key in keys:
+                self.pending.discard(key)
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM seen_messages").fetchone()[0]
+
+    def close(self):
+        """Save the Bloom filter so the next start does not rebuild it (when it changed enough)"""
+        with self.lock:
+            try:
+                if self.bloom is None:
+                    return
+                self._catch_up()
+                if self.saved_id is not None and self.synced_id - self.saved_id < SNAPSHOT_INTERVAL:
+                    return
+                _save_snapshot(self.conn, self.bloom.capacity, self.bloom.error_rate, self.synced_id,
+                               bytes(self.bloom.bits), self.bloom.count)
+            finally:
+                self.bloom = None
+                self.conn.close()
+
+def main():
+    path = DEFAULT_DEDUP_PATH
+    if '--path' in sys.argv:
+        path = sys.argv[sys.argv.index('--path') + 1]
+    if not os.path.exists(path):
+        print(f"❌ No dedup index at {path}")
+        sys.exit(1)
+    index = DedupIndex(path)
+    print(f"🔎 {index.count()} messages indexed in {path}")
+    print(f"   Bloom filter: {index.bloom.size / 8 / 1048576:.1f} MB, {index.bloom.hashes} hashes, "
+          f"capacity {index.bloom.capacity}")
+    index.close()
+
+if __name__ == '__main__':
+    main()
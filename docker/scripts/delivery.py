@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Delivery backends for handing processed mail to Dovecot
+
+LMTPDelivery keeps one LMTP session open on Dovecot's unix listener and
+delivers many messages over it, selecting the folder with a +detail
+recipient. LDADelivery spawns dovecot-lda per message and is used as the
+fallback. MaildirDelivery writes into the Maildir directly (tmp -> rename)
+for setups without Dovecot's LMTP or LDA. The backend is resolved once,
+when the processor starts.
+"""
+
+import os
+import re
+import time
+import shutil
+import smtplib
+import threading
+import logging
+
+from maildir import MaildirWriter, folder_path
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LMTP_SOCKET = "/var/run/dovecot/lmtp"
+DEFAULT_MAILDIR_ROOT = "/maildata"
+# A session idle longer than this is checked with NOOP before the next message
+LMTP_IDLE_CHECK = 10
+
+LDA_PATHS = [
+    "/usr/lib/dovecot/dovecot-lda",
+    "/usr/libexec/dovecot/dovecot-lda",
+    "/usr/bin/dovecot-lda",
+]
+
+# Line endings normalised to CRLF for LMTP DATA (same rule as smtplib)
+_EOL = re.compile(rb'(?:\r\n|\n|\r(?!\n))')
+_LEADING_DOT = re.compile(rb'(?m)^\.')
+
+# Characters allowed in an unquoted address local part (RFC 5321 atext plus dots)
+_DETAIL_SAFE = re.compile(r"^[A-Za-z0-9!#$%&'*+/=?^_`{|}~.-]+$")
+
+class DeliveryError(Exception):
+    """Raised when a message could not be handed to Dovecot"""
+
+class MessageStream:
+    """A raw message as a short in-memory head followed by a (spool) file
+
+    The head holds the header fields added by mail-bridge; the file holds
+    the original bytes, read from offset start. chunks() rewinds the file,
+    so a stream can be delivered again by a fallback backend.
+    """
+
+    def __init__(self, fileobj, head=b"", start=0, chunk_size=65536):
+        self.fileobj = fileobj
+        self.head = head
+        self.start = start
+        self.chunk_size = chunk_size
+
+    def chunks(self):
+        if self.head:
+            yield self.head
+        self.fileobj.seek(self.start)
+        while True:
+            chunk = self.fileobj.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def size(self):
+        """Bytes chunks() yields"""
+        return len(self.head) + self.fileobj.seek(0, os.SEEK_END) - self.start
+
+def dot_stuffed(chunks):
+    """Encode message chunks for SMTP/LMTP DATA: CRLF line endings, leading dots doubled"""
+    # Pieces of an unfinished line, joined once its newline arrives (a multi-MB line stays linear)
+    pending = []
+    for chunk in chunks:
+        cut = chunk.rfind(b"\n") + 1
+        if not cut:
+            pending.append(chunk)
+            continue
+        pending.append(chunk[:cut])
+        block = b"".join(pending)
+        pending = [chunk[cut:]] if cut < len(chunk) else []
+        yield _LEADING_DOT.sub(b"..", _EOL.sub(b"\r\n", block))
+    tail = b"".join(pending)
+    if tail:
+        yield _LEADING_DOT.sub(b"..", _EOL.sub(b"\r\n", tail)) + b"\r\n"
+
+def resolve_lda():
+    """Return the dovecot-lda command, or None if it is not installed"""
+    for path in LDA_PATHS:
+        if os.path.exists(path):
+            return path
+    return shutil.which("dovecot-lda")
+
+class LDADelivery:
+    """Deliver by running dovecot-lda once per message"""
+
+    name = "lda"
+
+    def __init__(self, lda_cmd):
+        self.lda_cmd = lda_cmd
+
+    def deliver(self, imap_user, folder, message):
+        import subprocess
+        proc = subprocess.Popen(
+            [self.lda_cmd, "-d", imap_user, "-m", folder],
+            stdin=subprocess.PIPE
+        )
+        try:
+            for chunk in message.chunks():
+                proc.stdin.write(chunk)
+        except BrokenPipeError:
+            pass
+        finally:
+            proc.stdin.close()
+        proc.wait()
+        if proc.returncode != 0:
+            raise DeliveryError(f"dovecot-lda exited with code {proc.returncode}")
+
+    def close(self):
+        pass
+
+class MaildirDelivery:
+    """Deliver by writing into <root>/<user>/Maildir with the tmp -> rename protocol"""
+
+    name = "maildir"
+
+    def __init__(self, root=DEFAULT_MAILDIR_ROOT, fsync=True):
+        self.root = root
+        self.fsync = fsync
+        self.writers = {}
+        self.lock = threading.Lock()
+
+    def writer(self, imap_user, folder):
+        path = folder_path(self.root, imap_user, folder)
+        with self.lock:
+            writer = self.writers.get(path)
+            if writer is None:
+                writer = self.writers[path] = MaildirWriter(path, fsync=self.fsync)
+        return writer
+
+    def deliver(self, imap_user, folder, message):
+        try:
+            self.writer(imap_user, folder).add(message.chunks())
+        except OSError as e:
+            raise DeliveryError(f"Maildir delivery failed: {e}")
+
+    def close(self):
+        pass
+
+class LMTPDelivery:
+    """Deliver over a persistent LMTP session to Dovecot"""
+
+    name = "lmtp"
+
+    def __init__(self, socket_path=DEFAULT_LMTP_SOCKET, fallback=None, timeout=30, idle_check=LMTP_IDLE_CHECK):
+        self.socket_path = socket_path
+        self.fallback = fallback
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self.lock = threading.Lock()
+        self.conn = None
+        self.last_used = 0.0
+
+    def _connect(self):
+        conn = smtplib.LMTP(timeout=self.timeout)
+        conn.connect(self.socket_path)
+        conn.ehlo_or_helo_if_needed()
+        logger.info(f"Opened LMTP session on {self.socket_path}")
+        return conn
+
+    def _session(self):
+        """Return (session, unchecked): a recently used session as it is, an idle one after a NOOP
+
+        unchecked is True when the session is reused without NOOP; _send()
+        reconnects once if such a session turns out to be closed.
+        """
+        if self.conn is not None:
+            if time.monotonic() - self.last_used < self.idle_check:
+                return self.conn, True
+            try:
+                if self.conn.noop()[0] == 250:
+                    return self.conn, False
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._drop()
+        self.conn = self._connect()
+        return self.conn, False
+
+    def _drop(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+    def _reset(self):
+        """RSET after a refused transaction; a session that cannot even do that is dropped"""
+        try:
+            self.conn.rset()
+        except (smtplib.SMTPException, OSError, AttributeError):
+            self._drop()
+
+    @staticmethod
+    def recipient(imap_user, folder):
+        if not folder or folder == "INBOX":
+            return imap_user
+        return f"{imap_user}+{folder}"
+
+    def _send(self, conn, recipient, message, unchecked=False):
+        """Run one MAIL/RCPT/DATA transaction, streaming the message body"""
+        try:
+            code, resp = conn.mail("")
+        except (smtplib.SMTPServerDisconnected, OSError):
+            if not unchecked:
+                raise
+            # Dovecot closed the session since the last message; nothing of this one was sent yet
+            self._drop()
+            conn = self.conn = self._connect()
+            code, resp = conn.mail("")
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, resp, "<>")
+        code, resp = conn.rcpt(recipient)
+        if code not in (250, 251):
+            raise smtplib.SMTPRecipientsRefused({recipient: (code, resp)})
+        code, resp = conn.docmd("data")
+        if code != 354:
+            raise smtplib.SMTPDataError(code, resp)
+        for block in dot_stuffed(message.chunks()):
+            conn.send(block)
+        conn.send(b".\r\n")
+        # LMTP answers once per recipient; there is exactly one
+        code, resp = conn.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
+
+    def deliver(self, imap_user, folder, message):
+        if folder and folder != "INBOX" and not _DETAIL_SAFE.match(folder):
+            if self.fallback is None:
+                raise DeliveryError(f"Folder '{folder}' cannot be addressed over LMTP")
+            metrics.inc('mailbridge_delivery_fallbacks_total', reason='folder')
+            self.fallback.deliver(imap_user, folder, message)
+            return
+
+        with self.lock:
+            try:
+                conn, unchecked = self._session()
+            except (smtplib.SMTPException, OSError) as e:
+                if self.fallback is None:
+                    raise DeliveryError(f"LMTP unavailable: {e}")
+                logger.warning(f"LMTP unavailable ({e}), using {self.fallback.name}")
+                conn = None
+
+            if conn is not None:
+                try:
+                    self._send(conn, self.recipient(imap_user, folder), message, unchecked)
+                    self.last_used = time.monotonic()
+                    return
+                except smtplib.SMTPRecipientsRefused as e:
+                    self._reset()
+                    raise DeliveryError(f"LMTP refused recipient: {e.recipients}")
+                except smtplib.SMTPResponseException as e:
+                    self._reset()
+                    raise DeliveryError(f"LMTP delivery failed: {e.smtp_code} {e.smtp_error!r}")
+                except (smtplib.SMTPServerDisconnected, OSError) as e:
+                    self._drop()
+                    raise DeliveryError(f"LMTP connection lost during delivery: {e}")
+
+        metrics.inc('mailbridge_delivery_fallbacks_total', reason='unavailable')
+        self.fallback.deliver(imap_user, folder, message)
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                try:
+                    self.conn.quit()
+                except Exception:
+                    pass
+                self.conn = None
+
+def create_delivery_backend(settings):
+    """Resolve the delivery backend from the 'settings.delivery' section"""
+    delivery = settings.get('delivery', {}) or {}
+    method = delivery.get('method', 'lmtp')
+    fallback_method = delivery.get('fallback', 'lda')
+
+    lda = None
+    if method == 'lda' or fallback_method == 'lda':
+        lda_cmd = delivery.get('lda_path') or resolve_lda()
+        if lda_cmd:
+            logger.info(f"Using dovecot-lda command: {lda_cmd}")
+            lda = LDADelivery(lda_cmd)
+        else:
+            logger.warning("dovecot-lda not found in any standard location")
+
+    maildir = None
+    if method == 'maildir' or fallback_method == 'maildir':
+        maildir = MaildirDelivery(delivery.get('maildir_root', DEFAULT_MAILDIR_ROOT),
+                                  fsync=delivery.get('fsync', True))
+        if method == 'maildir':
+            return maildir
+
+    if method == 'lmtp':
+        socket_path = delivery.get('lmtp_socket', DEFAULT_LMTP_SOCKET)
+        if os.path.exists(socket_path):
+            return LMTPDelivery(socket_path, fallback=lda or maildir, timeout=delivery.get('timeout', 30))
+        logger.warning(f"LMTP socket {socket_path} not found")
+
+    if lda is None and maildir is not None:
+        return maildir
+    if lda is None:
+        raise DeliveryError("No usable delivery backend (LMTP socket and dovecot-lda both missing)")
+    return lda
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Native POP3 fetcher
+Polls every enabled account from accounts.yaml concurrently on a bounded
+thread pool, each on its own interval and socket timeout, and hands the
+messages straight to the in-process filter/delivery pipeline. Used instead
+of fetchmail when settings.fetcher.mode is "native".
+
+Delivered UIDLs are kept in a UIDLStore, so each poll costs a single UIDL
+listing and only unseen messages are retrieved, across restarts too.
+RETR and DELE are pipelined when the server advertises PIPELINING, and an
+optional TOP header pre-pass fetches messages that trigger a push
+notification first during a large catch-up.
+
+Usage: python3 fetcher.py [--once] [--mode]
+"""
+
+import os
+import sys
+import time
+import poplib
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from mail_daemon import ProcessorHolder, CONFIG_PATH
+from process_mail import process_message, logger
+from uidl_store import UIDLStore, account_key, DEFAULT_STATE_PATH
+from pop3_pipeline import POP3, POP3_SSL, capabilities, pipeline, header_prepass, DEFAULT_WINDOW, DEFAULT_MAX_LINE
+import config_store
+import metrics
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_TIMEOUT = 60
+# Lets the web interface check that the fetcher runs without scanning the process table
+PID_FILE = "/var/run/mail-bridge/fetcher.pid"
+
+def account_password(account):
+    """Resolve the POP3 password from password_env, encrypted_password or password"""
+    if account.get('password_env'):
+        return os.environ.get(account['password_env'], '')
+    if account.get('encrypted_password'):
+        return config_store.password_manager().decrypt(account['encrypted_password'])
+    return account.get('password', '')
+
+def write_pidfile(path):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(f"{os.getpid()}\n")
+    except OSError as e:
+        logger.warning(f"Could not write {path}: {e}")
+
+def connect(account, timeout, max_line=DEFAULT_MAX_LINE):
+    """Open an authenticated POP3 session for an account"""
+    pop_server = account.get('pop_server')
+    pop_port = account.get('pop_port', 995)
+    if account.get('ssl', True):
+        pop = POP3_SSL(pop_server, pop_port, timeout=timeout)
+    else:
+        pop = POP3(pop_server, pop_port, timeout=timeout)
+    pop.max_line = max_line
+    pop.user(account.get('user'))
+    pop.pass_(account_password(account))
+    return pop
+
+class AccountPoller:
+    """Fetch state for one account"""
+
+    def __init__(self, account, settings, store):
+        fetcher_settings = settings.get('fetcher', {}) or {}
+        self.account = account
+        self.name = account.get('name', 'unnamed')
+        self.imap_user = account.get('imap_user')
+        self.keep = account.get('keep', True)
+        self.interval = account.get('check_interval', settings.get('check_interval', 300))
+        self.timeout = account.get('timeout', fetcher_settings.get('timeout', DEFAULT_TIMEOUT))
+        self.window = fetcher_settings.get('pipeline_window', DEFAULT_WINDOW)
+        self.prepass = fetcher_settings.get('header_prepass', False)
+        self.max_line = fetcher_settings.get('max_line', DEFAULT_MAX_LINE)
+        self.next_due = 0.0
+        self.running = False
+        # Poller this one replaced after a config change; must finish before this one starts
+        self.predecessor = None
+        self.store = store
+        self.state_key = account_key(account)
+        # UIDLs already delivered, loaded by the first poll (after any predecessor's
+        # last one) and then kept in step with the store
+        self.seen = None
+        self.stats = {'polls': 0, 'fetched': 0, 'errors': 0, 'last_poll': None,
+                      'last_duration': None, 'last_error': None}
+
+    def list_uidls(self, pop):
+        """Map message number -> UIDL from one UIDL command, or None if unsupported"""
+        try:
+            response = pop.uidl()[1]
+        except poplib.error_proto:
+            return None
+        uidls = {}
+        for line in response:
+            number, uidl = line.decode('ascii', errors='replace').split(' ', 1)
+            uidls[int(number)] = uidl
+        return uidls
+
+    def schedule(self, pop, processor, numbers, window):
+        """Order numbers so messages routed to a push notification by their headers come first"""
+        routes = header_prepass(pop, processor.rules, numbers, window)
+        notify = {n for n, rule in routes.items() if rule and rule.get('action', {}).get('push_notify')}
+        undecided = sum(1 for route in routes.values() if route is None)
+        logger.info(f"[{self.name}] Header pre-pass: {len(routes) - undecided} routed from headers "
+                    f"({len(notify)} notify), {undecided} need the body")
+        return sorted(numbers, key=lambda n: n not in notify)
+
+    def poll(self, processor):
+        """Download and deliver new messages; returns the number delivered"""
+        started = time.time()
+        delivered = 0
+        if self.seen is None:
+            self.seen = self.store.load(self.state_key)
+        pop = connect(self.account, self.timeout, self.max_line)
+        completed = False
+        try:
+            caps = capabilities(pop)
+            window = self.window if 'PIPELINING' in caps else 1
+            uidls = self.list_uidls(pop)
+            to_delete = []
+            if uidls is None:
+                if self.keep:
+                    logger.warning(f"[{self.name}] Server has no UIDL support, fetching every message")
+                numbers = list(range(1, pop.stat()[0] + 1))
+                uidls = {}
+            else:
+                on_server = set(uidls.values())
+                gone = self.seen - on_server
+                if gone:
+                    self.store.remove(self.state_key, gone)
+                    self.seen -= gone
+                numbers = [n for n, uidl in sorted(uidls.items()) if uidl not in self.seen]
+                if not self.keep:
+                    # Delivered earlier but the DELE never got committed
+                    to_delete = [n for n, uidl in sorted(uidls.items()) if uidl in self.seen]
+
+            if self.prepass and 'TOP' in caps and len(numbers) > 1:
+                numbers = self.schedule(pop, processor, numbers, window)
+
+            retrs = (f"RETR {n}" for n in numbers)
+            for command, result in pipeline(pop, retrs, window):
+                number = int(command.split()[1])
+                if isinstance(result, poplib.error_proto):
+                    logger.error(f"[{self.name}] RETR {number} failed: {result}")
+                    continue
+                raw_message = b"\n".join(result[1]) + b"\n"
+                if process_message(processor, self.imap_user, raw_message) != 0:
+                    # Leave it on the server and try again next poll
+                    logger.error(f"[{self.name}] Delivery of message {number} failed")
+                    continue
+                delivered += 1
+                uidl = uidls.get(number)
+                if uidl is not None:
+                    self.store.add(self.state_key, uidl)
+                    self.seen.add(uidl)
+                if not self.keep:
+                    to_delete.append(number)
+
+            # Deletions only take effect at QUIT, so sending them last changes nothing
+            deles = (f"DELE {n}" for n in to_delete)
+            for command, result in pipeline(pop, deles, window, multiline=False):
+                if isinstance(result, poplib.error_proto):
+                    logger.warning(f"[{self.name}] {command} failed: {result}")
+            completed = True
+        finally:
+            if completed:
+                try:
+                    pop.quit()
+                except Exception:
+                    pop.close()
+            else:
+                # The session may have lost its place in the responses; QUIT would apply any DELE sent
+                pop.close()
+            self.stats['last_duration'] = time.time() - started
+        return delivered
+
+def pollable_accounts(snapshot):
+    """Enabled, complete accounts of a config snapshot"""
+    accounts = []
+    for account in snapshot.accounts:
+        if not account.get('enabled', True):
+            continue
+        if not all([account.get('pop_server'), account.get('user'), account.get('imap_user')]):
+            logger.warning(f"Skipping incomplete account {account.get('name', 'unnamed')}")
+            continue
+        accounts.append(account)
+    return accounts
+
+def poll_settings(settings):
+    """The settings every AccountPoller copies; a change restarts all of them"""
+    fetcher_settings = settings.get('fetcher', {}) or {}
+    return (settings.get('check_interval'), fetcher_settings.get('timeout'),
+            fetcher_settings.get('pipeline_window'), fetcher_settings.get('header_prepass'),
+            fetcher_settings.get('max_line'))
+
+class Fetcher:
+    """Schedules AccountPollers on a bounded thread pool"""
+
+    def __init__(self, config_path=CONFIG_PATH):
+        self.holder = ProcessorHolder(config_path)
+        processor = self.holder.get()
+        settings = processor.config.get('settings', {}) or {}
+        fetcher_settings = settings.get('fetcher', {}) or {}
+        self.max_workers = fetcher_settings.get('max_workers', DEFAULT_MAX_WORKERS)
+        self.store = UIDLStore(fetcher_settings.get('state_path', DEFAULT_STATE_PATH))
+        self.snapshot = None
+        self.pollers = []
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="fetch")
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.apply_config(processor.snapshot)
+
+    def apply_config(self, snapshot):
+        """Bring the pollers in line with a config snapshot
+
+        Unchanged accounts keep their poller, schedule and statistics; only
+        added, removed or changed accounts are (re)started. A poll already
+        running for a changed or removed account is allowed to finish.
+        """
+        settings = snapshot.settings
+        accounts = pollable_accounts(snapshot)
+        names = [account.get('name', 'unnamed') for account in accounts]
+        previous, self.snapshot = self.snapshot, snapshot
+        if previous is None:
+            added, removed, changed = names, [], []
+        else:
+            added, removed, changed = config_store.account_diff(pollable_accounts(previous), accounts)
+            if poll_settings(previous.settings) != poll_settings(settings):
+                changed = [name for name in names if name not in added]
+            max_workers = (settings.get('fetcher', {}) or {}).get('max_workers', DEFAULT_MAX_WORKERS)
+            if max_workers != self.max_workers:
+                logger.warning(f"fetcher.max_workers changed to {max_workers}, takes effect after a restart")
+        restart = set(added) | set(changed)
+        with self.lock:
+            current = {poller.name: poller for poller in self.pollers}
+            pollers = []
+            for account in accounts:
+                name = account.get('name', 'unnamed')
+                if name not in restart and name in current:
+                    pollers.append(current[name])
+                    continue
+                poller = AccountPoller(account, settings, self.store)
+                if name in current and current[name].running:
+                    poller.predecessor = current[name]
+                pollers.append(poller)
+            self.pollers = pollers
+        if previous is not None and (added or removed or changed):
+            logger.info(f"Accounts reloaded: {len(added)} added, {len(removed)} removed, {len(changed)} changed")
+
+    def reload_if_changed(self):
+        """Apply accounts.yaml if it changed (or a reload was requested) since the last check"""
+        processor = self.holder.get()
+        if processor.snapshot is not self.snapshot:
+            self.apply_config(processor.snapshot)
+
+    def request_reload(self):
+        self.holder.request_reload()
+
+    def _run_poll(self, poller):
+        started = time.perf_counter()
+        try:
+            with self.holder.use() as processor:
+                delivered = poller.poll(processor)
+            poller.stats['fetched'] += delivered
+            poller.stats['last_error'] = None
+            metrics.inc('mailbridge_fetch_messages_total', delivered, account=poller.name)
+            if delivered:
+                logger.info(f"[{poller.name}] Delivered {delivered} message(s)")
+        except Exception as e:
+            poller.stats['errors'] += 1
+            poller.stats['last_error'] = str(e)
+            metrics.inc('mailbridge_fetch_errors_total', account=poller.name)
+            logger.error(f"[{poller.name}] Poll failed: {e}")
+        finally:
+            poller.stats['polls'] += 1
+            poller.stats['last_poll'] = time.time()
+            metrics.inc('mailbridge_fetch_polls_total', account=poller.name)
+            metrics.observe('mailbridge_fetch_seconds', time.perf_counter() - started, account=poller.name)
+            with self.lock:
+                poller.next_due = time.time() + poller.interval
+                poller.running = False
+
+    def poll_due(self):
+        """Submit every account whose interval has elapsed; returns the futures"""
+        now = time.time()
+        futures = []
+        with self.lock:
+            for poller in self.pollers:
+                if poller.predecessor is not None:
+                    if poller.predecessor.running:
+                        continue
+                    poller.predecessor = None
+                if not poller.running and poller.next_due <= now:
+                    poller.running = True
+                    futures.append(self.executor.submit(self._run_poll, poller))
+        return futures
+
+    def run_once(self):
+        for future in self.poll_due():
+            future.result()
+
+    def run(self):
+        logger.info(f"Native fetcher polling {len(self.pollers)} account(s)")
+        while not self.stopping.is_set():
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                logger.error(f"Config reload failed: {e}")
+            self.poll_due()
+            with self.lock:
+                pending = [p.next_due for p in self.pollers if not p.running]
+            wait = min(pending) - time.time() if pending else 1.0
+            self.stopping.wait(max(0.5, min(wait, 5.0)))
+        self.executor.shutdown(wait=True)
+
+    def stop(self):
+        self.stopping.set()
+
+def fetch_mode(config_path=CONFIG_PATH):
+    """'native' or 'fetchmail', from settings.fetcher.mode"""
+    settings = config_store.load(config_path).settings
+    return (settings.get('fetcher', {}) or {}).get('mode', 'fetchmail')
+
+def main():
+    if '--mode' in sys.argv:
+        print(fetch_mode())
+        return
+
+    fetcher = Fetcher()
+    write_pidfile(PID_FILE)
+    if '--once' in sys.argv:
+        fetcher.run_once()
+        fetcher.executor.shutdown(wait=True)
+    else:
+        signal.signal(signal.SIGTERM, lambda signum, frame: fetcher.stop())
+        signal.signal(signal.SIGHUP, lambda signum, frame: fetcher.request_reload())
+        metrics.start_flusher()
+        fetcher.run()
+
+    fetcher.store.close()
+    processor = fetcher.holder.processor
+    if processor is not None:
+        processor.close()
+    if fetcher.holder.push_worker is not None:
+        fetcher.holder.push_worker.stop()
+
+if __name__ == "__main__":
+    main()
@@ -3,22 +3,25 @@
 Generate fetchmail configuration from accounts.yaml
 """
 
-import yaml
 import os
 import sys
+import tempfile
 from pathlib import Path
 
+import config_store
+
+FETCHMAILRC_PATH = "/config/fetchmailrc"
+
 def load_accounts_config(config_path="/config/accounts.yaml"):
-    """Load accounts configuration from YAML file"""
-    try:
-        with open(config_path, 'r') as f:
-            return yaml.safe_load(f)
-    except FileNotFoundError:
+    """Load accounts configuration (from the config cache when it is current)"""
+    if not os.path.exists(config_path):
         print(f"ERROR: Configuration file {config_path} not found", file=sys.stderr)
         sys.exit(1)
-    except yaml.YAMLError as e:
-        print(f"ERROR: Invalid YAML in {config_path}: {e}", file=sys.stderr)
+    snapshot = config_store.load(config_path)
+    if snapshot.error:
+        print(f"ERROR: Invalid YAML in {config_path}: {snapshot.error}", file=sys.stderr)
         sys.exit(1)
+    return snapshot.data
 
 def generate_fetchmailrc(config):
     """Generate fetchmailrc content from configuration"""
@@ -71,32 +74,56 @@ def generate_fetchmailrc(config):
         else:
             lines.append("  no keep")
             
-        # Use Python script for mail delivery
-        lines.append(f'  mda "/scripts/process_mail.py {imap_user}"')
+        # Hand mail to the persistent delivery daemon (falls back to process_mail.py)
+        lines.append(f'  mda "/scripts/mda_client.py {imap_user}"')
         lines.append("")
     
     return '\n'.join(lines)
 
+def write_if_changed(path, content):
+    """Atomically replace path with content (mode 0600) unless it already holds it; True if written
+    
+    fetchmail restarts itself whenever its rc file changes, so an unchanged
+    file must not be touched.
+    """
+    try:
+        with open(path, 'r') as f:
+            if f.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(prefix='.fetchmailrc-', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except OSError:
+        # e.g. the file itself is a bind mount and cannot be replaced
+        os.unlink(tmp_path)
+        with open(path, 'w') as f:
+            f.write(content)
+        os.chmod(path, 0o600)
+    return True
+
+def update_fetchmailrc(config, output_path=FETCHMAILRC_PATH):
+    """Regenerate fetchmailrc from config; True if its content changed"""
+    return write_if_changed(output_path, generate_fetchmailrc(config))
+
 def main():
     """Main function"""
     config_path = "/config/accounts.yaml"
-    output_path = "/config/fetchmailrc"
+    output_path = FETCHMAILRC_PATH
     
     # Load configuration
     config = load_accounts_config(config_path)
     
-    # Generate fetchmailrc
-    fetchmailrc_content = generate_fetchmailrc(config)
-    
-    # Write to output file
+    # Generate fetchmailrc, leaving the file alone if nothing changed
     try:
-        with open(output_path, 'w') as f:
-            f.write(fetchmailrc_content)
-        
-        # Set proper permissions (only readable by owner)
-        os.chmod(output_path, 0o600)
-        
-        print(f"Generated {output_path} successfully")
+        if update_fetchmailrc(config, output_path):
+            print(f"Generated {output_path} successfully")
+        else:
+            print(f"{output_path} is up to date")
         print(f"Configured {len(config.get('accounts', []))} accounts")
         
     except IOError as e:
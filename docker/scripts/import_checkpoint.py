@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Checkpoints for long running imports
+
+import_emails.py records how far it got in each source (byte offset in an
+mbox, file position in a directory of .eml files) every few seconds.
+--resume continues from the last checkpoint; everything before it is known
+to be in the Maildir. Messages written after the checkpoint but before a
+crash are imported again and dropped by the dedup index.
+"""
+
+import os
+import time
+import sqlite3
+from contextlib import closing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS import_checkpoints (
+    source TEXT NOT NULL,
+    imap_user TEXT NOT NULL,
+    target TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    messages INTEGER NOT NULL,
+    finished INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (source, imap_user, target)
+);
+"""
+
+class ImportCheckpoints:
+    """SQLite table of import progress per (source, user, target)"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def _identity(source, imap_user, target):
+        return (str(os.path.realpath(source)), imap_user, str(os.path.realpath(target)))
+
+    def load(self, source, imap_user, target):
+        """(position, messages, finished) of the last run, or None if it does not match the source"""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT size, mtime_ns, position, messages, finished FROM import_checkpoints "
+                "WHERE source = ? AND imap_user = ? AND target = ?",
+                self._identity(source, imap_user, target)
+            ).fetchone()
+        if row is None:
+            return None
+        st = os.stat(source)
+        if (row[0], row[1]) != (st.st_size, st.st_mtime_ns):
+            print(f"⚠️  {source} changed since the last run, starting over")
+            return None
+        return row[2], row[3], bool(row[4])
+
+    def save(self, source, imap_user, target, position, messages, finished=False):
+        st = os.stat(source)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO import_checkpoints "
+                "(source, imap_user, target, size, mtime_ns, position, messages, finished, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self._identity(source, imap_user, target)
+                + (st.st_size, st.st_mtime_ns, position, messages, int(finished), time.time())
+            )
+
+class Progress:
+    """Tracks the contiguous prefix of a source that is fully imported
+
+    Batches finish out of order on the worker pool; a checkpoint may only
+    cover batch n once every batch before it is done.
+    """
+
+    def __init__(self, checkpoints, source, imap_user, target, position=0, messages=0, interval=10):
+        self.checkpoints = checkpoints
+        self.key = (source, imap_user, target)
+        self.position = position
+        self.messages = messages
+        self.interval = interval
+        self.done = {}
+        self.next_index = 0
+        self.last_save = time.time()
+
+    def complete(self, index, end_position, messages):
+        """Record batch index as finished; saves a checkpoint every interval seconds"""
+        self.done[index] = (end_position, messages)
+        while self.next_index in self.done:
+            end_position, messages = self.done.pop(self.next_index)
+            self.position = end_position
+            self.messages += messages
+            self.next_index += 1
+        if self.checkpoints is not None and time.time() - self.last_save >= self.interval:
+            self.save()
+
+    def save(self, finished=False):
+        if self.checkpoints is None:
+            return
+        self.checkpoints.save(*self.key, self.position, self.messages, finished)
+        self.last_save = time.time()
@@ -1,108 +1,636 @@
 #!/usr/bin/env python3
 """
 MailDocker Email Import Script
-Import emails from .eml or .mbox files into Dovecot maildirs
+Import emails from .eml or .mbox files (plain, gzip/bz2/xz compressed, or
+inside zip and tar archives) into Dovecot maildirs
+
+mbox files are split by scanning a memory map for "From " separator lines;
+messages are never parsed, their raw bytes are copied into the Maildir by
+a pool of writer threads, each handling a contiguous batch of messages
+through a MaildirBatch (tmp -> rename, one round of fsyncs per batch).
+Messages already in the dedup index (same Message-ID and body) are skipped,
+so running an import twice does not duplicate the mailbox. Progress is
+checkpointed every few seconds; --resume continues an interrupted import
+and --dry-run only reports what would be imported.
+
+Compressed mboxes and archives are never extracted to disk: they are
+decompressed as a stream and split on the fly, the batches go through the
+same writer pool. Their checkpoints count uncompressed bytes (mbox) or
+messages (archive); resuming reads the skipped part again but writes
+nothing for it.
+
+--profile imports a whole Thunderbird profile: every mbox folder (including
+.sbd subfolders) goes to the matching Maildir++ folder, folders are
+imported in parallel processes and X-Mozilla-Status becomes Maildir flags.
 """
 
 import os
 import sys
-import email
-import mailbox
-import shutil
+import mmap
+import time
+import threading
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait, as_completed
 import argparse
 
-def import_eml_file(eml_file, target_maildir, imap_user):
+from maildir import MaildirWriter, folder_path
+from dedup import DedupIndex, raw_message_key
+from import_checkpoint import ImportCheckpoints, Progress
+import archives
+import catalog
+import config_store
+import mailbox_stats
+import thunderbird
+
+DEFAULT_WORKERS = 4
+# Writer threads per folder process in --profile mode
+PROFILE_THREADS = 2
+BATCH_MESSAGES = 256
+BATCH_BYTES = 8 * 1024 * 1024
+PROGRESS_INTERVAL = 5
+STREAM_CHUNK = 1024 * 1024
+# settings.mailbox_stats and settings.catalog decide what each written batch is added to
+CONFIG_PATH = os.environ.get('MAIL_BRIDGE_CONFIG', config_store.DEFAULT_CONFIG_PATH)
+
+class ImportStats:
+    """Thread-safe message/byte counters with periodic throughput reports"""
+
+    def __init__(self, total_bytes=None, label=None):
+        self.messages = 0
+        self.bytes = 0
+        self.errors = 0
+        self.skipped = 0
+        self.expunged = 0
+        self.label = label
+        self.total_bytes = total_bytes
+        self.started = time.time()
+        self.last_report = self.started
+        self.lock = threading.Lock()
+
+    def add(self, messages, size, errors=0, skipped=0, expunged=0):
+        with self.lock:
+            self.messages += messages
+            self.bytes += size
+            self.errors += errors
+            self.skipped += skipped
+            self.expunged += expunged
+
+    def report(self, force=False):
+        now = time.time()
+        if not force and now - self.last_report < PROGRESS_INTERVAL:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-6)
+        progress = ""
+        if self.total_bytes:
+            progress = f" ({self.bytes * 100 / self.total_bytes:.1f}%)"
+        skipped = f", {self.skipped} duplicates skipped" if self.skipped else ""
+        label = f"[{self.label}] " if self.label else ""
+        print(f"📧 {label}Imported {self.messages} messages, {self.bytes / 1048576:.1f} MB{progress}{skipped} "
+              f"- {self.messages / elapsed:.0f} msg/s, {self.bytes / 1048576 / elapsed:.1f} MB/s")
+
+def folder_writer(target_maildir, imap_user, folder=None, fsync=True):
+    # Every flushed batch is added to the dashboard's per-folder counts and the message catalog,
+    # each unless turned off in settings like for delivered mail
+    settings = config_store.load(CONFIG_PATH).settings
+    stats = None
+    if (settings.get('mailbox_stats', {}) or {}).get('enabled', True):
+        stats = mailbox_stats.shared(target_maildir)
+    message_catalog = None
+    catalog_settings = settings.get('catalog', {}) or {}
+    if catalog_settings.get('enabled', True):
+        message_catalog = catalog.shared(target_maildir, catalog_settings.get('body_prefix', catalog.BODY_PREFIX))
+    return MaildirWriter(folder_path(target_maildir, imap_user, folder), fsync=fsync,
+                         stats=stats, catalog=message_catalog)
+
+def dedup_scope(imap_user, folder=None):
+    """Duplicates are per user for the inbox, per folder for other folders (copies are kept)"""
+    if not folder or folder.upper() == "INBOX":
+        return imap_user
+    return f"{imap_user}/{folder}"
+
+def scan_mbox(data, offset=0):
+    """Yield (start, end) byte offsets of each message in an mbox buffer
+
+    start is just past the "From " envelope line, end excludes the blank
+    line that separates the message from the next one. Empty messages are
+    skipped. A non-zero offset (the end of an earlier message) resumes the
+    scan at the next separator.
+    """
+    if offset == 0 and data[:5] == b"From ":
+        separator = 0
+    else:
+        separator = data.find(b"\nFrom ", max(offset - 1, 0))
+        if separator < 0:
+            return
+        separator += 1
+    size = len(data)
+    while separator < size:
+        start = data.find(b"\n", separator)
+        start = size if start < 0 else start + 1
+        end = data.find(b"\nFrom ", start - 1)
+        if end < 0:
+            end = following = size
+        else:
+            following = end + 1
+        end = max(end, start)
+        if data[end - 1:end] == b"\r":
+            end -= 1
+        if end > start:
+            yield start, end
+        separator = following
+
+def mbox_batches(data, offset=0):
+    """Group mbox message offsets into contiguous batches"""
+    batch = []
+    batch_start = None
+    for start, end in scan_mbox(data, offset):
+        if batch_start is None:
+            batch_start = start
+        batch.append((start, end))
+        if len(batch) >= BATCH_MESSAGES or end - batch_start >= BATCH_BYTES:
+            yield batch
+            batch, batch_start = [], None
+    if batch:
+        yield batch
+
+def stream_mbox(stream, chunk_size=STREAM_CHUNK):
+    """Yield (start, end, raw bytes) for each message of an mbox read front to back
+
+    For mboxes that cannot be memory-mapped (compressed files, archive
+    members). Only the message still being read is kept in memory; offsets
+    count uncompressed bytes from the start of the stream.
+    """
+    buffer = bytearray()
+    base = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+        # Everything before the last separator is complete
+        cut = len(buffer) if eof else buffer.rfind(b"\nFrom ")
+        if cut < 0:
+            continue
+        for start, end in scan_mbox(buffer):
+            if start > cut:
+                break
+            yield base + start, base + end, bytes(buffer[start:end])
+        if eof:
+            return
+        del buffer[:cut + 1]
+        base += cut + 1
+
+def stream_messages(source):
+    """Yield (position, label, raw bytes) for a compressed mbox or a zip/tar archive
+
+    position grows with every message: the uncompressed offset past it for
+    an mbox, the message count for an archive.
+    """
+    if not archives.is_archive(source):
+        with archives.open_stream(source) as stream:
+            for start, end, raw_msg in stream_mbox(stream):
+                yield end, f"message at offset {start}", raw_msg
+        return
+    count = 0
+    for name, kind, member in archives.archive_members(source):
+        if kind == 'eml':
+            count += 1
+            yield count, name, member.read()
+            continue
+        for start, _, raw_msg in stream_mbox(member):
+            count += 1
+            yield count, f"{name} message at offset {start}", raw_msg
+
+def stream_batches(items, position=0):
+    """Group stream_messages() items past position into batches"""
+    batch = []
+    size = 0
+    for item in items:
+        if item[0] <= position:
+            continue
+        batch.append(item)
+        size += len(item[2])
+        if len(batch) >= BATCH_MESSAGES or size >= BATCH_BYTES:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+def store_messages(writer, messages, stats, dedup=None, scope=None, source=None, flags=None):
+    """Write (label, raw bytes) pairs through one MaildirBatch, skipping known duplicates
+
+    flags, if given, maps a raw message to its Maildir flags ("" for
+    unread) or None to drop it; otherwise messages are stored as read.
+    """
+    errors = skipped = expunged = 0
+    claimed = []
+    with writer.batch(BATCH_MESSAGES) as maildir_batch:
+        for label, raw_msg in messages:
+            message_flags = "S" if flags is None else flags(raw_msg)
+            if message_flags is None:
+                expunged += 1
+                continue
+            key = None
+            if dedup is not None:
+                key = raw_message_key(scope, raw_msg)
+                if not dedup.claim(key):
+                    skipped += 1
+                    continue
+            try:
+                maildir_batch.add(raw_msg, flags=message_flags)
+            except OSError as e:
+                print(f"❌ Error writing {label}: {e}")
+                errors += 1
+                if key is not None:
+                    dedup.release([key])
+                continue
+            if key is not None:
+                claimed.append(key)
+    # Only recorded once the batch is safely in the Maildir
+    if claimed:
+        dedup.commit(claimed, source)
+    stats.add(maildir_batch.written, maildir_batch.bytes, errors, skipped, expunged)
+    stats.report()
+
+def _mbox_batch_messages(fd, batch):
+    """Read a contiguous batch of messages with one pread"""
+    base = batch[0][0]
+    chunk = os.pread(fd, batch[-1][1] - base, base)
+    for start, end in batch:
+        yield f"message at offset {start}", chunk[start - base:end - base]
+
+def run_pool(tasks, workers, on_done=None):
+    """Run callables on a thread pool keeping at most 2*workers queued
+
+    on_done is called with each task's result, from the calling thread.
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="import") as executor:
+        pending = set()
+        for task in tasks:
+            pending.add(executor.submit(task))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    if on_done is not None:
+                        on_done(result)
+        for future in pending:
+            result = future.result()
+            if on_done is not None:
+                on_done(result)
+
+def resume_point(checkpoints, source, imap_user, target_maildir):
+    """(position, messages) to start from, or None if the source was already imported"""
+    state = checkpoints.load(source, imap_user, target_maildir) if checkpoints is not None else None
+    if state is None:
+        return 0, 0
+    position, messages, finished = state
+    if finished:
+        print(f"✅ {source} was already imported completely ({messages} messages)")
+        return None
+    print(f"⏩ Resuming {source} after {messages} messages (position {position})")
+    return position, messages
+
+def survey_mbox(mbox_file, offset=0):
+    """Count the messages and bytes an import of mbox_file would write"""
+    with open(mbox_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0, 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            messages = size = 0
+            for start, end in scan_mbox(data, offset):
+                messages += 1
+                size += end - start
+    return messages, size
+
+def survey_stream(source, position=0):
+    """Count the messages and bytes an import of a compressed mbox or archive would write"""
+    messages = size = 0
+    for batch in stream_batches(stream_messages(source), position):
+        messages += len(batch)
+        size += sum(len(raw_msg) for _, _, raw_msg in batch)
+    return messages, size
+
+def import_eml_file(eml_file, target_maildir, imap_user, dedup=None):
     """Import a single .eml file into Dovecot maildir"""
     try:
-        with open(eml_file, 'r', encoding='utf-8') as f:
-            msg = email.message_from_file(f)
-        
-        # Generate unique filename
-        import time
-        import hashlib
-        timestamp = str(int(time.time()))
-        content_hash = hashlib.md5(msg.as_bytes().encode()).hexdigest()[:8]
-        filename = f"{timestamp}.{content_hash}:2,S"
-        
-        # Deliver to cur directory (new messages)
-        cur_dir = Path(target_maildir) / imap_user / "Maildir" / "cur"
-        cur_dir.mkdir(parents=True, exist_ok=True)
-        
-        target_file = cur_dir / filename
-        with open(target_file, 'wb') as f:
-            f.write(msg.as_bytes().encode())
-        
+        raw_msg = Path(eml_file).read_bytes()
+        key = raw_message_key(imap_user, raw_msg) if dedup is not None else None
+        if key is not None and not dedup.claim(key):
+            print(f"⏭️  Skipped duplicate: {eml_file}")
+            return False
+        try:
+            target_file = folder_writer(target_maildir, imap_user).add(raw_msg, seen=True)
+        except Exception:
+            if key is not None:
+                dedup.release([key])
+            raise
+        if key is not None:
+            dedup.commit([key], "import:eml")
         print(f"✅ Imported: {eml_file} -> {target_file}")
         return True
     except Exception as e:
         print(f"❌ Error importing {eml_file}: {e}")
         return False
 
-def import_mbox_file(mbox_file, target_maildir, imap_user):
-    """Import emails from .mbox file into Dovecot maildir"""
+def import_eml_files(eml_files, target_maildir, imap_user, workers=DEFAULT_WORKERS, fsync=True, dedup=None,
+                     checkpoints=None, resume=False, source=None):
+    """Import many .eml files in parallel; returns the number imported
+
+    Checkpoints are keyed by source (the directory the sorted list came from).
+    """
+    writer = folder_writer(target_maildir, imap_user, fsync=fsync)
+    eml_files = list(eml_files)
+    position = done_messages = 0
+    if source is not None and resume:
+        start = resume_point(checkpoints, source, imap_user, target_maildir)
+        if start is None:
+            return 0
+        position, done_messages = start
+    if source is None:
+        checkpoints = None
+    progress = Progress(checkpoints, source, imap_user, target_maildir, position, done_messages)
+    stats = ImportStats()
+
+    def read_files(chunk):
+        for eml_file in chunk:
+            try:
+                yield str(eml_file), Path(eml_file).read_bytes()
+            except OSError as e:
+                print(f"❌ Error importing {eml_file}: {e}")
+                stats.add(0, 0, 1)
+
+    def import_chunk(index, first):
+        chunk = eml_files[first:first + BATCH_MESSAGES]
+        store_messages(writer, read_files(chunk), stats, dedup, imap_user, "import:eml")
+        return index, first + len(chunk), len(chunk)
+
+    starts = range(position, len(eml_files), BATCH_MESSAGES)
     try:
-        mbox = mailbox.mbox(mbox_file)
-        imported = 0
-        
-        for message in mbox:
-            # Generate unique filename
-            import time
-            import hashlib
-            timestamp = str(int(time.time()))
-            content_hash = hashlib.md5(message.as_bytes().encode()).hexdigest()[:8]
-            filename = f"{timestamp}.{content_hash}:2,S"
-            
-            # Deliver to cur directory
-            cur_dir = Path(target_maildir) / imap_user / "Maildir" / "cur"
-            cur_dir.mkdir(parents=True, exist_ok=True)
-            
-            target_file = cur_dir / filename
-            with open(target_file, 'wb') as f:
-                f.write(message.as_bytes().encode())
-            
-            imported += 1
-            if imported % 100 == 0:
-                print(f"📧 Imported {imported} messages...")
-        
-        print(f"✅ Successfully imported {imported} messages from {mbox_file}")
-        return True
+        run_pool((lambda i=i, first=first: import_chunk(i, first) for i, first in enumerate(starts)),
+                 workers, on_done=lambda result: progress.complete(*result))
+    finally:
+        progress.save(finished=progress.position >= len(eml_files))
+    stats.report(force=True)
+    if stats.skipped:
+        print(f"⏭️  Skipped {stats.skipped} duplicate messages")
+    return stats.messages
+
+def import_mbox_file(mbox_file, target_maildir, imap_user, workers=DEFAULT_WORKERS, fsync=True, dedup=None,
+                     checkpoints=None, resume=False):
+    """Import emails from an .mbox file, compressed mbox or zip/tar archive into Dovecot maildir"""
+    importer = import_stream if archives.is_stream_source(mbox_file) else import_mbox
+    try:
+        stats = importer(mbox_file, target_maildir, imap_user, workers, fsync, dedup, checkpoints, resume)
+        if stats is None:
+            return True
+        if stats.errors:
+            print(f"⚠️  {stats.errors} messages could not be written")
+        if stats.skipped:
+            print(f"⏭️  Skipped {stats.skipped} duplicate messages")
+        print(f"✅ Successfully imported {stats.messages} messages from {mbox_file}")
+        return stats.errors == 0
     except Exception as e:
         print(f"❌ Error importing {mbox_file}: {e}")
         return False
 
+def import_mbox(mbox_file, target_maildir, imap_user, workers=DEFAULT_WORKERS, fsync=True, dedup=None,
+                checkpoints=None, resume=False, folder=None, flags=None, label=None):
+    """Import one mbox into a Maildir folder; returns its ImportStats, or None if there was nothing to do"""
+    position, done_messages = 0, 0
+    if resume:
+        start = resume_point(checkpoints, mbox_file, imap_user, target_maildir)
+        if start is None:
+            return None
+        position, done_messages = start
+    writer = folder_writer(target_maildir, imap_user, folder, fsync)
+    scope = dedup_scope(imap_user, folder)
+    source = f"import:{Path(mbox_file).name}"
+    progress = Progress(checkpoints, mbox_file, imap_user, target_maildir, position, done_messages)
+    with open(mbox_file, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return None
+        stats = ImportStats(total_bytes=size - position, label=label)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            fd = f.fileno()
+
+            def import_batch(index, batch):
+                store_messages(writer, _mbox_batch_messages(fd, batch), stats, dedup, scope, source, flags)
+                return index, batch[-1][1], len(batch)
+
+            try:
+                run_pool((lambda i=i, b=b: import_batch(i, b)
+                          for i, b in enumerate(mbox_batches(data, position))),
+                         workers, on_done=lambda result: progress.complete(*result))
+                progress.position = size
+            finally:
+                progress.save(finished=progress.position >= size)
+    stats.report(force=True)
+    return stats
+
+def import_stream(source, target_maildir, imap_user, workers=DEFAULT_WORKERS, fsync=True, dedup=None,
+                  checkpoints=None, resume=False):
+    """Import a compressed mbox or zip/tar archive without extracting it; returns ImportStats or None"""
+    position, done_messages = 0, 0
+    if resume:
+        start = resume_point(checkpoints, source, imap_user, target_maildir)
+        if start is None:
+            return None
+        position, done_messages = start
+    writer = folder_writer(target_maildir, imap_user, fsync=fsync)
+    source_label = f"import:{Path(source).name}"
+    progress = Progress(checkpoints, source, imap_user, target_maildir, position, done_messages)
+    stats = ImportStats()
+
+    def import_batch(index, batch):
+        messages = ((label, raw_msg) for _, label, raw_msg in batch)
+        store_messages(writer, messages, stats, dedup, imap_user, source_label)
+        return index, batch[-1][0], len(batch)
+
+    finished = False
+    try:
+        # Batches are read (and decompressed) here, at most 2*workers of them wait for a writer
+        run_pool((lambda i=i, b=b: import_batch(i, b)
+                  for i, b in enumerate(stream_batches(stream_messages(source), position))),
+                 workers, on_done=lambda result: progress.complete(*result))
+        finished = True
+    finally:
+        progress.save(finished=finished)
+    stats.report(force=True)
+    return stats
+
+def _import_profile_folder(mbox_files, folder, target_maildir, imap_user, fsync, dedup_path, resume):
+    """Import the Thunderbird folders that map to one Maildir folder; runs in a worker process"""
+    dedup = DedupIndex(dedup_path) if dedup_path else None
+    checkpoints = ImportCheckpoints(str(Path(target_maildir) / ".mail-bridge" / "import_state.db"))
+    totals = [0, 0, 0, 0]
+    try:
+        for mbox_file in mbox_files:
+            stats = import_mbox(mbox_file, target_maildir, imap_user, PROFILE_THREADS, fsync, dedup, checkpoints,
+                                resume, folder=folder, flags=thunderbird.mozilla_flags, label=folder)
+            if stats is not None:
+                totals = [total + value for total, value in
+                          zip(totals, (stats.messages, stats.skipped, stats.expunged, stats.errors))]
+    finally:
+        if dedup is not None:
+            dedup.close()
+    return totals
+
+def import_profile(profile_dir, target_maildir, imap_user, workers=DEFAULT_WORKERS, fsync=True,
+                   dedup_path=None, resume=False):
+    """Import every folder of a Thunderbird profile (or Mail/ or account directory)"""
+    # Several accounts can have e.g. an Inbox; one process per target folder keeps dedup exact
+    folders = {}
+    for account in thunderbird.account_dirs(profile_dir):
+        for mbox_file, folder in thunderbird.profile_folders(account):
+            folders.setdefault(folder, []).append(mbox_file)
+    if not folders:
+        print(f"❌ No Thunderbird folders found in {profile_dir}")
+        return False
+    # Largest folders first so one big folder does not finish last on its own
+    order = sorted(folders, key=lambda folder: sum(map(os.path.getsize, folders[folder])), reverse=True)
+    print(f"🗂️  {len(order)} folders, importing {workers} at a time")
+
+    totals = [0, 0, 0, 0]
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_import_profile_folder, folders[folder], folder, str(target_maildir), imap_user,
+                            fsync, dedup_path, resume): folder
+            for folder in order
+        }
+        for future in as_completed(futures):
+            folder = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"❌ Error importing folder {folder}: {e}")
+                failed.append(folder)
+                continue
+            totals = [total + value for total, value in zip(totals, result)]
+            print(f"✅ {folder}: {result[0]} messages")
+
+    messages, skipped, expunged, errors = totals
+    print(f"🎉 Imported {messages} messages into {len(order) - len(failed)} folders")
+    if skipped:
+        print(f"⏭️  Skipped {skipped} duplicate messages")
+    if expunged:
+        print(f"🗑️  Left out {expunged} messages deleted in Thunderbird but not yet compacted")
+    if errors or failed:
+        print(f"⚠️  {errors} messages could not be written, {len(failed)} folders failed")
+    return not (errors or failed)
+
+def dry_run(source, maildir, imap_user, resume, profile=False):
+    """Report what an import would write, without touching the Maildir"""
+    state_path = maildir / ".mail-bridge" / "import_state.db"
+    checkpoints = ImportCheckpoints(str(state_path)) if resume and state_path.exists() else None
+
+    def start_position(path):
+        if checkpoints is None:
+            return 0
+        start = resume_point(checkpoints, path, imap_user, maildir)
+        return None if start is None else start[0]
+
+    if profile:
+        messages = size = 0
+        for account in thunderbird.account_dirs(source):
+            for mbox_file, folder in thunderbird.profile_folders(account):
+                position = start_position(mbox_file)
+                if position is None:
+                    continue
+                folder_messages, folder_size = survey_mbox(mbox_file, position)
+                print(f"   {folder}: {folder_messages} messages, {folder_size / 1048576:.1f} MB")
+                messages += folder_messages
+                size += folder_size
+        print(f"🔍 Dry run: {messages} messages, {size / 1048576:.1f} MB would be imported "
+              f"into {folder_path(maildir, imap_user)}")
+        return
+
+    position = start_position(source)
+    if position is None:
+        return
+
+    if source.is_file() and archives.is_stream_source(source):
+        messages, size = survey_stream(source, position)
+    elif source.is_file() and source.suffix.lower() == '.mbox':
+        messages, size = survey_mbox(source, position)
+    elif source.is_file() and source.suffix.lower() == '.eml':
+        messages, size = 1, source.stat().st_size
+    elif source.is_dir():
+        eml_files = sorted(source.glob('*.eml'))[position:]
+        messages, size = len(eml_files), sum(f.stat().st_size for f in eml_files)
+    else:
+        print(f"❌ Unsupported source: {source}")
+        return
+    print(f"🔍 Dry run: {messages} messages, {size / 1048576:.1f} MB would be imported "
+          f"into {folder_path(maildir, imap_user)}")
+
 def main():
     parser = argparse.ArgumentParser(description='Import emails into MailDocker')
-    parser.add_argument('source', help='Source file or directory')
+    parser.add_argument('source', help='Source file or directory (.eml, .mbox[.gz|.bz2|.xz], .zip, .tar[.gz|...])')
     parser.add_argument('--user', required=True, help='IMAP user (e.g., user1)')
     parser.add_argument('--maildir', default='/maildata', help='MailDocker maildir path')
-    
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='Parallel writer threads (folder processes with --profile)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Source is a Thunderbird profile, its Mail/ directory or an account directory')
+    parser.add_argument('--no-fsync', action='store_true',
+                        help='Skip fsync (faster, but a crash can lose recently imported messages)')
+    parser.add_argument('--no-dedup', action='store_true', help='Import messages even if already present')
+    parser.add_argument('--dedup-db', default=None,
+                        help='Dedup index (default: <maildir>/.mail-bridge/dedup.db)')
+    parser.add_argument('--resume', action='store_true', help='Continue from the last checkpoint')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only report how many messages and bytes would be imported')
+
     args = parser.parse_args()
-    
+
     source = Path(args.source)
     maildir = Path(args.maildir)
     imap_user = args.user
-    
+
     print(f"📧 Importing emails for user: {imap_user}")
     print(f"📁 Target maildir: {maildir}")
     print(f"📂 Source: {source}")
-    
-    if source.is_file():
-        if source.suffix.lower() == '.mbox':
-            import_mbox_file(source, maildir, imap_user)
-        elif source.suffix.lower() == '.eml':
-            import_eml_file(source, maildir, imap_user)
+
+    if args.dry_run:
+        dry_run(source, maildir, imap_user, args.resume, args.profile)
+        return
+
+    if args.profile:
+        if not source.is_dir():
+            print(f"❌ Profile directory not found: {source}")
+            sys.exit(1)
+        dedup_path = None if args.no_dedup else (args.dedup_db or str(maildir / ".mail-bridge" / "dedup.db"))
+        ok = import_profile(source, maildir, imap_user, args.workers, not args.no_fsync, dedup_path, args.resume)
+        sys.exit(0 if ok else 1)
+
+    dedup = None
+    if not args.no_dedup:
+        dedup = DedupIndex(args.dedup_db or str(maildir / ".mail-bridge" / "dedup.db"))
+    checkpoints = ImportCheckpoints(str(maildir / ".mail-bridge" / "import_state.db"))
+    fsync = not args.no_fsync
+
+    try:
+        if source.is_file():
+            if source.suffix.lower() == '.mbox' or archives.is_stream_source(source):
+                import_mbox_file(source, maildir, imap_user, args.workers, fsync, dedup,
+                                 checkpoints, args.resume)
+            elif source.suffix.lower() == '.eml':
+                import_eml_file(source, maildir, imap_user, dedup)
+            else:
+                print(f"❌ Unsupported file format: {source.suffix}")
+        elif source.is_dir():
+            # Import all .eml files in directory
+            imported = import_eml_files(sorted(source.glob('*.eml')), maildir, imap_user, args.workers,
+                                        fsync, dedup, checkpoints, args.resume, source)
+            print(f"✅ Successfully imported {imported} .eml files")
         else:
-            print(f"❌ Unsupported file format: {source.suffix}")
-    elif source.is_dir():
-        # Import all .eml files in directory
-        imported = 0
-        for eml_file in source.glob('*.eml'):
-            if import_eml_file(eml_file, maildir, imap_user):
-                imported += 1
-        print(f"✅ Successfully imported {imported} .eml files")
-    else:
-        print(f"❌ Source not found: {source}")
+            print(f"❌ Source not found: {source}")
+    finally:
+        if dedup is not None:
+            dedup.close()
 
 if __name__ == '__main__':
     main()
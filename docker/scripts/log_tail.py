@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Reading the end of growing log files
+
+process_mail.log is never rotated, so nothing here reads a log from the
+start on a request. tail() seeks backwards from EOF in blocks until it has
+enough lines; its cost depends on the lines asked for, not the file size.
+LogIndex keeps a sparse (timestamp, byte offset) index so a time range
+starts reading near its first record; it is extended incrementally as the
+file grows. follow() yields lines appended after an offset by polling the
+file size, and starts over when the file is truncated or replaced.
+
+Records look like "2024-01-31 12:00:00,123 - LEVEL - message"; lines
+without that prefix (tracebacks) belong to the record before them.
+"""
+
+import os
+import re
+import time
+import bisect
+import threading
+from datetime import datetime
+
+BLOCK_SIZE = 64 * 1024
+# One index entry per this many bytes of log
+INDEX_STEP = 256 * 1024
+FOLLOW_INTERVAL = 1.0
+# How far back a level-filtered tail() searches
+MAX_TAIL_SCAN = 32 * 1024 * 1024
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+
+_RECORD = re.compile(rb'^(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d)(?:,\d+)? - ([A-Z]+) - ')
+
+def parse_prefix(line):
+    """(datetime, level) of a record's first line, or None for a continuation line"""
+    match = _RECORD.match(line)
+    if match is None:
+        return None
+    try:
+        # Much cheaper than strptime, which dominated scanning a time range
+        timestamp = datetime(*map(int, match.group(1, 2, 3, 4, 5, 6)))
+    except ValueError:
+        return None
+    return timestamp, match.group(7).decode('ascii')
+
+def _level_ok(prefix, min_level):
+    if min_level is None:
+        return True
+    return prefix is not None and LEVELS.get(prefix[1], 0) >= min_level
+
+def _decode(lines):
+    return [line.decode('utf-8', errors='replace') for line in lines]
+
+def reverse_lines(f, block_size=BLOCK_SIZE, max_bytes=None):
+    """Lines of a binary file from last to first, without newlines, reading blocks from EOF"""
+    position = end = f.seek(0, os.SEEK_END)
+    carry = b""
+    first = True
+    while position > 0:
+        if max_bytes is not None and end - position >= max_bytes:
+            return
+        step = min(block_size, position)
+        position -= step
+        f.seek(position)
+        parts = (f.read(step) + carry).split(b"\n")
+        # The first part may continue in the block before
+        carry = parts.pop(0)
+        if first:
+            first = False
+            if parts and parts[-1] == b"":
+                parts.pop()
+        yield from reversed(parts)
+    if end:
+        yield carry
+
+def tail(path, lines=10, level=None, block_size=BLOCK_SIZE, max_bytes=MAX_TAIL_SCAN):
+    """Last lines of a log, optionally only records at or above level (with their continuation lines)
+
+    A level filter that matches nothing gives up after max_bytes.
+    """
+    min_level = LEVELS.get(level.upper()) if level else None
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return []
+    newest_first = []
+    with f:
+        record = []
+        for line in reverse_lines(f, block_size, max_bytes if min_level is not None else None):
+            if min_level is None:
+                newest_first.append(line)
+            else:
+                record.append(line)
+                prefix = parse_prefix(line)
+                if prefix is None:
+                    continue
+                if _level_ok(prefix, min_level):
+                    newest_first.extend(record)
+                record = []
+            if len(newest_first) >= lines:
+                break
+    return _decode(reversed(newest_first[:lines]))
+
+class LogIndex:
+    """Sparse timestamp -> offset index of one log file, shared between requests"""
+
+    def __init__(self, path, step=INDEX_STEP):
+        self.path = path
+        self.step = step
+        self.lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, inode):
+        self.inode = inode
+        self.times = []
+        self.offsets = []
+        self.indexed = 0
+
+    def update(self):
+        """Index whatever was appended since the last call"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset(None)
+            return
+        if st.st_ino != self.inode or st.st_size < self.indexed:
+            self._reset(st.st_ino)
+        if st.st_size - self.indexed < self.step and self.offsets:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.indexed)
+            offset = self.indexed
+            next_entry = self.offsets[-1] + self.step if self.offsets else 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                if offset >= next_entry:
+                    prefix = parse_prefix(line)
+                    if prefix is not None and (not self.times or prefix[0] >= self.times[-1]):
+                        self.times.append(prefix[0])
+                        self.offsets.append(offset)
+                        next_entry = offset + self.step
+                offset += len(line)
+            self.indexed = offset
+
+    def start_offset(self, since):
+        """Offset from which a scan sees every record at or after since"""
+        with self.lock:
+            self.update()
+            if since is None or not self.times:
+                return 0
+            position = bisect.bisect_left(self.times, since) - 1
+            return self.offsets[position] if position >= 0 else 0
+
+    def records(self, since=None, until=None, level=None, limit=1000):
+        """Lines of records with since <= time < until (and at or above level), oldest first"""
+        min_level = LEVELS.get(level.upper()) if level else None
+        start = self.start_offset(since)
+        result = []
+        keep = False
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return []
+        with f:
+            f.seek(start)
+            for line in f:
+                prefix = parse_prefix(line)
+                if prefix is not None:
+                    if until is not None and prefix[0] >= until:
+                        break
+                    keep = (since is None or prefix[0] >= since) and _level_ok(prefix, min_level)
+                    if keep and len(result) >= limit:
+                        break
+                if keep:
+                    result.append(line.rstrip(b"\n"))
+        return _decode(result)
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def log_index(path):
+    """The shared LogIndex of path"""
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = LogIndex(path)
+        return _indexes[path]
+
+def follow(path, offset=None, interval=FOLLOW_INTERVAL, idle=None):
+    """Yield (offset after line, line) for complete lines appended to path
+
+    offset=None starts at the current end. If idle is given, None is
+    yielded after idle seconds without new lines so a caller can send a
+    keep-alive (and notice a closed connection).
+    """
+    inode = None
+    buffer = b""
+    last_data = time.time()
+    while True:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            st = None
+        if st is not None:
+            if offset is None:
+                offset = st.st_size
+            if (inode is not None and st.st_ino != inode) or st.st_size < offset:
+                # Rotated or truncated: the new file is read from its start
+                offset, buffer = 0, b""
+            inode = st.st_ino
+            if st.st_size > offset:
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    data = f.read(st.st_size - offset)
+                offset += len(data)
+                buffer += data
+                *complete, buffer = buffer.split(b"\n")
+                # Offset just past each line, counted back from what is still buffered
+                position = offset - len(buffer) - sum(len(line) + 1 for line in complete)
+                for line in complete:
+                    position += len(line) + 1
+                    yield position, line.decode('utf-8', errors='replace')
+                if complete:
+                    last_data = time.time()
+        if idle is not None and time.time() - last_data >= idle:
+            last_data = time.time()
+            yield None
+        time.sleep(interval)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Persistent mail delivery daemon
+Keeps one MailProcessor loaded and serves mda_client.py over a Unix socket,
+so fetchmail no longer starts a Python interpreter for every message.
+
+Protocol (one message per connection):
+    client -> daemon: "<imap_user>\\n" followed by the raw message until EOF
+    daemon -> client: "<exit code>\\n"
+"""
+
+import os
+import sys
+import signal
+import socketserver
+import threading
+from contextlib import contextmanager
+
+from process_mail import MailProcessor, process_message, logger
+from push_queue import PushWorker, worker_settings
+import config_store
+import metrics
+
+CONFIG_PATH = "/config/accounts.yaml"
+SOCKET_PATH = os.environ.get('MAIL_BRIDGE_SOCKET', '/var/run/mail-bridge/mda.sock')
+
+class ProcessorHolder:
+    """Hold the current MailProcessor and rebuild it when accounts.yaml changes"""
+
+    def __init__(self, config_path=CONFIG_PATH):
+        self.config_path = config_path
+        self.push_worker = None
+        self.push_worker_settings = None
+        self.lock = threading.Lock()
+        self.store = config_store.get_store(config_path)
+        self.processor = None
+        self.reload_requested = True
+        # Deliveries running per processor; a replaced one is closed when its last delivery ends
+        self.users = {}
+
+    def get(self):
+        """Return the processor, rebuilding it first if the config changed"""
+        with self.lock:
+            self._refresh()
+            return self.processor
+
+    @contextmanager
+    def use(self):
+        """The current processor for one delivery; a config change meanwhile does not close it"""
+        with self.lock:
+            self._refresh()
+            processor = self.processor
+            self.users[processor] = self.users.get(processor, 0) + 1
+        try:
+            yield processor
+        finally:
+            with self.lock:
+                self.users[processor] -= 1
+                retired = not self.users[processor] and processor is not self.processor
+                if not self.users[processor]:
+                    del self.users[processor]
+            if retired:
+                processor.close()
+
+    def _refresh(self):
+        if self.reload_requested:
+            self.store.invalidate()
+        snapshot = self.store.get()
+        if self.processor is None or snapshot is not self.processor.snapshot:
+            logger.info(f"Loading configuration from {self.config_path}")
+            previous = self.processor
+            self.processor = MailProcessor(self.config_path, snapshot)
+            self._start_push_worker()
+            if previous is not None and not self.users.get(previous):
+                previous.close()
+        self.reload_requested = False
+
+    def _start_push_worker(self):
+        """Run one PushWorker for the queue configured in push_notifications, replaced when that changes"""
+        push_settings = self.processor.push_settings or {}
+        settings = worker_settings(push_settings)
+        if settings != self.push_worker_settings:
+            # Notifications the old worker is sending stay leased, so the new one does not send them twice
+            if self.push_worker is not None:
+                logger.info("Push notification settings changed, stopping the push worker")
+                self.push_worker.stop()
+                self.push_worker = None
+            if settings is not None:
+                self.push_worker = PushWorker.from_settings(push_settings)
+                self.push_worker.start()
+            self.push_worker_settings = settings
+        if self.push_worker is not None:
+            self.processor.push_wakeup = self.push_worker.notify
+
+    def request_reload(self):
+        self.reload_requested = True
+
+class DeliveryHandler(socketserver.StreamRequestHandler):
+    """Handle a single message handed over by mda_client.py"""
+
+    def handle(self):
+        exit_code = 1
+        try:
+            imap_user = self.rfile.readline().decode('utf-8').strip()
+            if not imap_user:
+                logger.error("Missing IMAP user in delivery request")
+            else:
+                with self.server.holder.use() as processor:
+                    exit_code = process_message(processor, imap_user, self.rfile)
+        except Exception as e:
+            logger.error(f"Error handling delivery request: {e}")
+            exit_code = 1
+
+        try:
+            self.wfile.write(f"{exit_code}\n".encode())
+        except OSError as e:
+            logger.error(f"Could not report delivery result to client: {e}")
+
+class DeliveryServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, holder):
+        self.holder = holder
+        super().__init__(socket_path, DeliveryHandler)
+
+def main():
+    socket_path = sys.argv[1] if len(sys.argv) > 1 else SOCKET_PATH
+
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    holder = ProcessorHolder()
+    holder.get()
+
+    server = DeliveryServer(socket_path, holder)
+    os.chmod(socket_path, 0o600)
+
+    signal.signal(signal.SIGHUP, lambda signum, frame: holder.request_reload())
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+
+    metrics.start_flusher()
+    logger.info(f"Mail delivery daemon listening on {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if holder.processor is not None:
+            holder.processor.close()
+        if holder.push_worker is not None:
+            holder.push_worker.stop()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        logger.info("Mail delivery daemon stopped")
+
+if __name__ == "__main__":
+    main()
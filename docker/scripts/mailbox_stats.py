@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Message count, unread count and size per IMAP user and folder
+
+Walking /maildata/<user>/Maildir/{cur,new} costs seconds on folders with
+100k+ files, so the dashboard reads these numbers from a small SQLite index
+(<maildir root>/.mail-bridge/mailbox_stats.db) instead, one row per folder.
+
+Delivery and the importer add what they wrote as they go (add_folder,
+add_path). reconcile() makes the index exact again after changes made by
+IMAP clients (reading, moving, deleting): it stats new/ and cur/ of every
+folder and only rescans a folder whose directory mtimes changed or that
+received additions since its last scan. An unchanged mailbox costs two
+stats per folder.
+
+Usage: python3 mailbox_stats.py [--root /maildata] [--full]
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+
+from maildir import folder_path, imap_utf7_decode
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAILDIR_ROOT = "/maildata"
+RECONCILE_INTERVAL = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folder_stats (
+    imap_user TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    messages INTEGER NOT NULL DEFAULT 0,
+    unread INTEGER NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    new_mtime INTEGER,
+    cur_mtime INTEGER,
+    version INTEGER NOT NULL DEFAULT 1,
+    scanned_version INTEGER NOT NULL DEFAULT 0,
+    scanned_at REAL,
+    PRIMARY KEY (imap_user, directory)
+);
+"""
+
+# Dovecot and MaildirWriter put the size into the file name: "<unique>,S=<bytes>[,W=...]:2,<flags>"
+_SIZE = re.compile(r',S=(\d+)')
+
+def stats_path(root):
+    return os.path.join(str(root), ".mail-bridge", "mailbox_stats.db")
+
+def folder_name(directory):
+    """IMAP name of a Maildir++ directory ('' is INBOX)"""
+    if not directory:
+        return "INBOX"
+    return "/".join(imap_utf7_decode(part) for part in directory[1:].split('.'))
+
+def folder_directory(folder):
+    """Maildir++ directory name of an IMAP folder name ('' for INBOX)"""
+    if not folder or folder.upper() == "INBOX":
+        return ""
+    return os.path.basename(folder_path("", "", folder))
+
+def locate(path):
+    """(root, imap_user, directory) of a folder path <root>/<user>/Maildir[/.Folder], or None"""
+    path = os.path.abspath(str(path))
+    directory = ""
+    if os.path.basename(path) != "Maildir":
+        directory = os.path.basename(path)
+        path = os.path.dirname(path)
+        if not directory.startswith('.') or os.path.basename(path) != "Maildir":
+            return None
+    user_dir = os.path.dirname(path)
+    return os.path.dirname(user_dir), os.path.basename(user_dir), directory
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def scan_folder(path):
+    """(messages, unread, bytes) of one Maildir folder, from its file names where possible"""
+    messages = unread = size = 0
+    for sub in ("new", "cur"):
+        try:
+            entries = os.scandir(os.path.join(path, sub))
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                name = entry.name
+                if name.startswith('.'):
+                    continue
+                messages += 1
+                if sub == "new":
+                    unread += 1
+                else:
+                    _, _, flags = name.partition(':2,')
+                    if 'S' not in flags:
+                        unread += 1
+                match = _SIZE.search(name)
+                if match:
+                    size += int(match.group(1))
+                else:
+                    try:
+                        size += entry.stat().st_size
+                    except FileNotFoundError:
+                        # Moved or expunged while we were looking
+                        messages -= 1
+    return messages, unread, size
+
+def mailbox_folders(root):
+    """Yield (imap_user, directory, path) for every Maildir folder under root"""
+    try:
+        users = sorted(os.listdir(root))
+    except FileNotFoundError:
+        return
+    for user in users:
+        maildir = os.path.join(root, user, "Maildir")
+        if user.startswith('.') or not os.path.isdir(maildir):
+            continue
+        yield user, "", maildir
+        for entry in sorted(os.listdir(maildir)):
+            path = os.path.join(maildir, entry)
+            if entry.startswith('.') and entry not in ('.', '..') and os.path.isdir(os.path.join(path, "cur")):
+                yield user, entry, path
+
+class MailboxStats:
+    """Per-folder statistics of the Maildirs under one root"""
+
+    def __init__(self, root=DEFAULT_MAILDIR_ROOT, path=None):
+        self.root = os.path.abspath(str(root))
+        self.path = path or stats_path(root)
+        self.lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connect(self):
+        # sqlite3 only once the index is used, and a fresh connection after a fork
+        if self._conn is None or self._pid != os.getpid():
+            import sqlite3
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def add(self, imap_user, directory, messages, unread, size):
+        """Count messages just written to a folder"""
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT INTO folder_stats (imap_user, directory, messages, unread, bytes) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (imap_user, directory) DO UPDATE SET messages = messages + excluded.messages, "
+                    "unread = unread + excluded.unread, bytes = bytes + excluded.bytes, version = version + 1",
+                    (imap_user, directory, messages, unread, size))
+
+    def add_folder(self, imap_user, folder, messages, unread, size):
+        """add() for an IMAP folder name as used in filter rules ('INBOX', 'Invoices', 'Work/Reports')"""
+        self.add(imap_user, folder_directory(folder), messages, unread, size)
+
+    def add_path(self, path, messages, unread, size):
+        """add() for a Maildir folder path; ignored if the folder is not under this root"""
+        location = locate(path)
+        if location is None or location[0] != self.root:
+            return
+        self.add(location[1], location[2], messages, unread, size)
+
+    def reconcile(self, full=False):
+        """Rescan folders that changed on disk (or every folder if full); returns how many were rescanned"""
+        with self.lock:
+            rows = {(user, directory): (new_mtime, cur_mtime, version, scanned_version)
+                    for user, directory, new_mtime, cur_mtime, version, scanned_version in self._connect().execute(
+                        "SELECT imap_user, directory, new_mtime, cur_mtime, version, scanned_version FROM folder_stats")}
+        found = set()
+        rescanned = 0
+        for user, directory, path in mailbox_folders(self.root):
+            found.add((user, directory))
+            # Taken before the scan: a change during the scan shows up as a new mtime next time
+            new_mtime = _mtime(os.path.join(path, "new"))
+            cur_mtime = _mtime(os.path.join(path, "cur"))
+            row = rows.get((user, directory))
+            if not full and row is not None and row[:2] == (new_mtime, cur_mtime) and row[2] == row[3]:
+                continue
+            version = row[2] if row is not None else 0
+            messages, unread, size = scan_folder(path)
+            with self.lock:
+                conn = self._connect()
+                with conn:
+                    conn.execute(
+                        "INSERT INTO folder_stats (imap_user, directory, messages, unread, bytes, new_mtime, cur_mtime, "
+                        "version, scanned_version, scanned_at) VALUES (?, ?, ?, ?, ?, ?, ?, 0, 0, ?) "
+                        "ON CONFLICT (imap_user, directory) DO UPDATE SET messages = excluded.messages, "
+                        "unread = excluded.unread, bytes = excluded.bytes, new_mtime = excluded.new_mtime, "
+                        "cur_mtime = excluded.cur_mtime, scanned_at = excluded.scanned_at, scanned_version = ?",
+                        (user, directory, messages, unread, size, new_mtime, cur_mtime, time.time(), version))
+            rescanned += 1
+        gone = [key for key in rows if key not in found]
+        if gone:
+            with self.lock:
+                conn = self._connect()
+                with conn:
+                    conn.executemany("DELETE FROM folder_stats WHERE imap_user = ? AND directory = ?", gone)
+        return rescanned
+
+    def folders(self):
+        """One dict per folder (imap_user, folder, messages, unread, bytes), INBOX first"""
+        with self.lock:
+            rows = self._connect().execute(
+                "SELECT imap_user, directory, messages, unread, bytes, scanned_at FROM folder_stats "
+                "ORDER BY imap_user, directory").fetchall()
+        return [{'imap_user': user, 'folder': folder_name(directory), 'messages': messages, 'unread': unread,
+                 'bytes': size, 'scanned_at': scanned_at}
+                for user, directory, messages, unread, size, scanned_at in rows]
+
+    def users(self):
+        """{imap_user: {'messages', 'unread', 'bytes'}} summed over folders"""
+        totals = {}
+        for row in self.folders():
+            total = totals.setdefault(row['imap_user'], {'messages': 0, 'unread': 0, 'bytes': 0})
+            for key in total:
+                total[key] += row[key]
+        return totals
+
+    def close(self):
+        with self.lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+def shared(root=DEFAULT_MAILDIR_ROOT):
+    """The process-wide MailboxStats of a Maildir root"""
+    root = os.path.abspath(str(root))
+    with _shared_lock:
+        if root not in _shared:
+            _shared[root] = MailboxStats(root)
+        return _shared[root]
+
+def maildir_root(settings):
+    """Root the IMAP users' Maildirs live under, from settings.delivery.maildir_root"""
+    return (settings.get('delivery', {}) or {}).get('maildir_root') or DEFAULT_MAILDIR_ROOT
+
+_reconcilers = {}
+
+def start_reconciler(stats, interval=RECONCILE_INTERVAL):
+    """Reconcile stats from a background thread now and every interval seconds (once per root)"""
+    with _shared_lock:
+        if stats.root in _reconcilers:
+            return
+
+        def run():
+            while True:
+                try:
+                    stats.reconcile()
+                except Exception as e:
+                    logger.error(f"Mailbox statistics reconcile failed: {e}")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name="mailbox-stats", daemon=True)
+        _reconcilers[stats.root] = thread
+        thread.start()
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Update and show the per-folder mailbox statistics')
+    parser.add_argument('--root', default=DEFAULT_MAILDIR_ROOT, help='Directory holding <user>/Maildir')
+    parser.add_argument('--full', action='store_true', help='Rescan every folder, not only changed ones')
+    args = parser.parse_args()
+
+    stats = MailboxStats(args.root)
+    started = time.time()
+    rescanned = stats.reconcile(full=args.full)
+    print(f"🔄 Rescanned {rescanned} folder(s) in {time.time() - started:.2f}s")
+    for row in stats.folders():
+        print(f"📁 {row['imap_user']:<12} {row['folder']:<30} {row['messages']:>8} messages "
+              f"{row['unread']:>7} unread {row['bytes'] / 1048576:>9.1f} MB")
+    stats.close()
+
+if __name__ == "__main__":
+    main()
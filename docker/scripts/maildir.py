@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Maildir writer shared by the importer, the test downloader and the
+maildir delivery backend
+
+Messages are written to tmp/ under a unique name (time, microseconds, pid,
+counter, hostname) and only renamed into new/ or cur/ once complete, so
+Dovecot never sees a partial file and two writers can never overwrite each
+other. A MaildirBatch defers the fsyncs: it writes many messages, fsyncs
+them, renames them all and then fsyncs each target directory once.
+
+A writer given a MailboxStats reports what became visible (messages,
+unread, bytes) after every add or batch flush.
+"""
+
+import os
+import time
+import socket
+import base64
+import itertools
+import threading
+
+DEFAULT_BATCH_SIZE = 64
+
+_counter = itertools.count()
+_hostname = socket.gethostname().replace('/', '\\057').replace(':', '\\072')
+
+def unique_name():
+    """A Maildir base name that is unique across processes, threads and hosts"""
+    now = time.time()
+    seconds = int(now)
+    return f"{seconds}.M{int((now - seconds) * 1000000)}P{os.getpid()}Q{next(_counter)}.{_hostname}"
+
+def imap_utf7(name):
+    """Encode a folder name in IMAP modified UTF-7 (RFC 3501), as Dovecot stores it"""
+    result = []
+    pending = []
+
+    def flush():
+        if pending:
+            encoded = base64.b64encode(''.join(pending).encode('utf-16-be')).rstrip(b'=')
+            result.append('&' + encoded.decode('ascii').replace('/', ',') + '-')
+            pending.clear()
+
+    for ch in name:
+        if 0x20 <= ord(ch) <= 0x7e:
+            flush()
+            result.append('&-' if ch == '&' else ch)
+        else:
+            pending.append(ch)
+    flush()
+    return ''.join(result)
+
+def imap_utf7_decode(name):
+    """Decode an IMAP modified UTF-7 folder name; names that are not valid are returned as they are"""
+    result = []
+    position = 0
+    while position < len(name):
+        start = name.find('&', position)
+        if start < 0:
+            result.append(name[position:])
+            break
+        end = name.find('-', start)
+        if end < 0:
+            return name
+        result.append(name[position:start])
+        if end == start + 1:
+            result.append('&')
+        else:
+            encoded = name[start + 1:end].replace(',', '/')
+            try:
+                result.append(base64.b64decode(encoded + '=' * (-len(encoded) % 4)).decode('utf-16-be'))
+            except ValueError:
+                return name
+        position = end + 1
+    return ''.join(result)
+
+def folder_path(maildir_root, imap_user, folder=None):
+    """Maildir++ directory of an IMAP folder; nested folders use '/' or '.' as separator"""
+    base = os.path.join(str(maildir_root), imap_user, "Maildir")
+    if not folder or folder.upper() == "INBOX":
+        return base
+    parts = [imap_utf7(part) for part in folder.replace('/', '.').split('.') if part]
+    return os.path.join(base, '.' + '.'.join(parts))
+
+def _inherit_owner(path, anchor):
+    """Give directories created as root to the owner of the directory they were created in"""
+    st = os.stat(anchor)
+    if st.st_uid == 0:
+        return
+    directories = [os.path.join(path, sub) for sub in ("tmp", "new", "cur")]
+    while path != anchor and path.startswith(anchor):
+        directories.append(path)
+        path = os.path.dirname(path)
+    for directory in directories:
+        os.chown(directory, st.st_uid, st.st_gid)
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _unread(seen, flags):
+    """Whether a message stored with these arguments lacks the S flag (see MaildirWriter._target)"""
+    return not (seen or flags) or 'S' not in (flags or 'S')
+
+class MaildirWriter:
+    """Deliver raw messages into one Maildir (or Maildir++ folder)"""
+
+    def __init__(self, path, fsync=True, stats=None, catalog=None):
+        self.path = str(path)
+        self.fsync = fsync
+        self.stats = stats
+        self.catalog = catalog
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def ensure(self):
+        """Create tmp/new/cur once per writer"""
+        if self._ready:
+            return
+        with self._lock:
+            if self._ready:
+                return
+            anchor = self.path
+            while not os.path.exists(anchor):
+                anchor = os.path.dirname(anchor)
+            for sub in ("tmp", "new", "cur"):
+                os.makedirs(os.path.join(self.path, sub), exist_ok=True)
+            if anchor != self.path and os.geteuid() == 0:
+                # Dovecot runs as the mail user and must be able to rename in here
+                _inherit_owner(self.path, anchor)
+            if os.path.basename(self.path).startswith('.'):
+                marker = os.path.join(self.path, "maildirfolder")
+                if not os.path.exists(marker):
+                    open(marker, 'a').close()
+            self._ready = True
+
+    def _write_tmp(self, data, fsync):
+        """Write bytes or an iterable of byte chunks to tmp/; returns (name, tmp path, size)"""
+        self.ensure()
+        name = unique_name()
+        tmp_path = os.path.join(self.path, "tmp", name)
+        size = 0
+        with open(tmp_path, 'xb') as f:
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                f.write(data)
+                size = len(data)
+            else:
+                for chunk in data:
+                    f.write(chunk)
+                    size += len(chunk)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        return name, tmp_path, size
+
+    def _target(self, name, size, seen, flags):
+        if seen or flags:
+            return os.path.join(self.path, "cur", f"{name},S={size}:2,{''.join(sorted(flags or 'S'))}")
+        return os.path.join(self.path, "new", f"{name},S={size}")
+
+    def add(self, data, seen=False, flags=None):
+        """Deliver one message durably; returns its final path
+
+        seen (or explicit flags such as "RS") puts the message in cur/ with
+        the flags in its info suffix, otherwise it goes to new/.
+        """
+        name, tmp_path, size = self._write_tmp(data, self.fsync)
+        final_path = self._target(name, size, seen, flags)
+        try:
+            os.rename(tmp_path, final_path)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+        if self.fsync:
+            _fsync_dir(os.path.dirname(final_path))
+        if self.stats is not None:
+            self.stats.add_path(self.path, 1, int(_unread(seen, flags)), size)
+        if self.catalog is not None:
+            self.catalog.add_files(self.path, [final_path])
+        return final_path
+
+    def batch(self, size=DEFAULT_BATCH_SIZE):
+        return MaildirBatch(self, size)
+
+class MaildirBatch:
+    """Groups writes to a MaildirWriter so fsyncs are paid once per batch
+
+    Use as a context manager; messages become visible when the batch is
+    flushed (every size messages and on exit, also after an error so that
+    completed messages are kept). Not shared between threads.
+    """
+
+    def __init__(self, writer, size=DEFAULT_BATCH_SIZE):
+        self.writer = writer
+        self.size = size
+        self.pending = []
+        self.pending_unread = 0
+        self.pending_bytes = 0
+        self.written = 0
+        self.bytes = 0
+
+    def add(self, data, seen=False, flags=None):
+        name, tmp_path, size = self.writer._write_tmp(data, fsync=False)
+        self.pending.append((tmp_path, self.writer._target(name, size, seen, flags)))
+        self.pending_unread += _unread(seen, flags)
+        self.pending_bytes += size
+        self.bytes += size
+        if len(self.pending) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        if self.writer.fsync:
+            for tmp_path, _ in self.pending:
+                fd = os.open(tmp_path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+        directories = set()
+        for tmp_path, final_path in self.pending:
+            os.rename(tmp_path, final_path)
+            directories.add(os.path.dirname(final_path))
+        if self.writer.fsync:
+            for directory in directories:
+                _fsync_dir(directory)
+        if self.writer.stats is not None:
+            self.writer.stats.add_path(self.writer.path, len(self.pending), self.pending_unread, self.pending_bytes)
+        if self.writer.catalog is not None:
+            self.writer.catalog.add_files(self.writer.path, [final_path for _, final_path in self.pending])
+        self.written += len(self.pending)
+        self.pending = []
+        self.pending_unread = self.pending_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
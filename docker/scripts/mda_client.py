@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Minimal MDA used by fetchmail
+Streams the message on stdin to mail_daemon.py and exits with its result.
+Falls back to running process_mail.py directly when the daemon is not up.
+"""
+
+import os
+import sys
+import socket
+
+SOCKET_PATH = os.environ.get('MAIL_BRIDGE_SOCKET', '/var/run/mail-bridge/mda.sock')
+PROCESS_MAIL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'process_mail.py')
+
+# sysexits.h EX_TEMPFAIL - fetchmail keeps the message and retries later
+EX_TEMPFAIL = 75
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: mda_client.py <imap_user>", file=sys.stderr)
+        sys.exit(1)
+
+    imap_user = sys.argv[1]
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(SOCKET_PATH)
+    except OSError:
+        # Daemon not running - process in this interpreter instead
+        sock.close()
+        os.execv(sys.executable, [sys.executable, PROCESS_MAIL, imap_user])
+
+    try:
+        sock.sendall(imap_user.encode('utf-8') + b"\n")
+        stdin = sys.stdin.buffer
+        while True:
+            chunk = stdin.read(65536)
+            if not chunk:
+                break
+            sock.sendall(chunk)
+        sock.shutdown(socket.SHUT_WR)
+
+        reply = b""
+        while not reply.endswith(b"\n"):
+            data = sock.recv(64)
+            if not data:
+                break
+            reply += data
+        sys.exit(int(reply.strip()))
+    except (OSError, ValueError) as e:
+        print(f"mail-bridge daemon delivery failed: {e}", file=sys.stderr)
+        sys.exit(EX_TEMPFAIL)
+    finally:
+        sock.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Counters and latency histograms shared by every mail-bridge process
+
+Recording is an in-memory dict update; nothing touches the disk on the
+hot path. Each process adds what it recorded since the last flush to a
+SQLite file (every FLUSH_INTERVAL seconds from a background thread in the
+daemons, at exit in short-lived processes such as process_mail.py), so
+the stored values are the sum over all processes and restarts. The web
+interface renders that file in the Prometheus text format at /metrics.
+
+sqlite3 is only imported by flush() and render(), which keeps it off the
+import path of the per-message entry points (see test_import_time.py).
+
+Usage: python3 metrics.py [--path /maildata/.mail-bridge/metrics.db]
+"""
+
+import os
+import sys
+import time
+import atexit
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS_PATH = "/maildata/.mail-bridge/metrics.db"
+FLUSH_INTERVAL = 10
+
+# Upper bounds in seconds; every histogram also gets +Inf
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# name -> (type, help); only these are recorded and exported
+METRICS = {
+    'mailbridge_messages_total': ('counter', 'Messages handled by the filter/delivery pipeline, by IMAP user and result'),
+    'mailbridge_parse_seconds': ('histogram', 'Time to parse the header section (and body prefix) of a message'),
+    'mailbridge_filter_seconds': ('histogram', 'Time spent in apply_filter_rules'),
+    'mailbridge_rule_hits_total': ('counter', 'Messages routed by each filter rule ("(default)" when no rule matched)'),
+    'mailbridge_delivery_seconds': ('histogram', 'Time to hand a message to Dovecot, by delivery backend'),
+    'mailbridge_delivery_fallbacks_total': ('counter', 'LMTP deliveries that went to the fallback backend'),
+    'mailbridge_push_send_seconds': ('histogram', 'Time of one webhook request'),
+    'mailbridge_push_sent_total': ('counter', 'Webhook requests by result (sent, retry, failed)'),
+    'mailbridge_fetch_seconds': ('histogram', 'Duration of one POP3 poll (native fetcher), by account'),
+    'mailbridge_fetch_polls_total': ('counter', 'POP3 polls (native fetcher), by account'),
+    'mailbridge_fetch_errors_total': ('counter', 'Failed POP3 polls (native fetcher), by account'),
+    'mailbridge_fetch_messages_total': ('counter', 'Messages fetched and delivered (native fetcher), by account'),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (name, labels)
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    le REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (name, labels, le)
+);
+"""
+
+_enabled = True
+_path = DEFAULT_METRICS_PATH
+# (name, labels) -> value, and (name, labels, le) -> count, since the last flush
+_counters = {}
+_buckets = {}
+_lock = threading.Lock()
+_flusher = None
+_INF = float('inf')
+
+def configure(settings):
+    """Apply settings.metrics (enabled, path) from accounts.yaml"""
+    global _enabled, _path
+    metrics_settings = settings.get('metrics', {}) or {}
+    _enabled = metrics_settings.get('enabled', True)
+    _path = metrics_settings.get('path', DEFAULT_METRICS_PATH)
+
+def metrics_path(settings):
+    return (settings.get('metrics', {}) or {}).get('path', DEFAULT_METRICS_PATH)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(labels):
+    """Label set in exposition form, e.g. 'account="a",result="ok"'"""
+    if not labels:
+        return ''
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+
+def inc(name, value=1, **labels):
+    """Add value to a counter"""
+    if not _enabled:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, seconds, **labels):
+    """Record one duration in a histogram"""
+    if not _enabled:
+        return
+    label_text = _labels(labels)
+    # Only the smallest bucket that fits is counted; render() makes the counts cumulative
+    position = bisect.bisect_left(BUCKETS, seconds)
+    le = BUCKETS[position] if position < len(BUCKETS) else _INF
+    with _lock:
+        key = (name, label_text, le)
+        _buckets[key] = _buckets.get(key, 0) + 1
+        key = (name + '_sum', label_text)
+        _counters[key] = _counters.get(key, 0) + seconds
+        key = (name + '_count', label_text)
+        _counters[key] = _counters.get(key, 0) + 1
+
+class timer:
+    """Context manager observing the duration of its block"""
+
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+def _connect(path):
+    import sqlite3
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def flush():
+    """Add everything recorded since the last flush to the metrics file"""
+    global _counters, _buckets
+    with _lock:
+        counters, buckets = _counters, _buckets
+        _counters, _buckets = {}, {}
+    if not counters and not buckets:
+        return
+    try:
+        conn = _connect(_path)
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO counters (name, labels, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+                    [(name, labels, value) for (name, labels), value in counters.items()])
+                conn.executemany(
+                    "INSERT INTO buckets (name, labels, le, count) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (name, labels, le) DO UPDATE SET count = count + excluded.count",
+                    [(name, labels, le, count) for (name, labels, le), count in buckets.items()])
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning(f"Could not write metrics to {_path}: {e}")
+        # Keep them for the next attempt; the key space is small and bounded
+        with _lock:
+            for key, value in counters.items():
+                _counters[key] = _counters.get(key, 0) + value
+            for key, count in buckets.items():
+                _buckets[key] = _buckets.get(key, 0) + count
+
+atexit.register(flush)
+
+def start_flusher(interval=FLUSH_INTERVAL):
+    """Flush from a background thread every interval seconds (long-running processes)"""
+    global _flusher
+    if _flusher is not None:
+        return
+
+    def run():
+        while True:
+            time.sleep(interval)
+            flush()
+
+    _flusher = threading.Thread(target=run, name="metrics-flush", daemon=True)
+    _flusher.start()
+
+def _format(value):
+    if value == _INF:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _sample(name, labels, value, le=None):
+    if le is not None:
+        labels = f'{labels},le="{_format(le)}"' if labels else f'le="{_format(le)}"'
+    return f"{name}{{{labels}}} {_format(value)}" if labels else f"{name} {_format(value)}"
+
+def render(path=DEFAULT_METRICS_PATH, gauges=None):
+    """Stored metrics (plus gauges: {name: (help, value)}) in the Prometheus text format"""
+    counters, buckets = {}, {}
+    if os.path.exists(path):
+        conn = _connect(path)
+        try:
+            for name, labels, value in conn.execute("SELECT name, labels, value FROM counters"):
+                counters.setdefault(name, []).append((labels, value))
+            for name, labels, le, count in conn.execute("SELECT name, labels, le, count FROM buckets"):
+                buckets.setdefault(name, {}).setdefault(labels, {})[le] = count
+        finally:
+            conn.close()
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == 'counter':
+            for labels, value in sorted(counters.get(name, [])):
+                lines.append(_sample(name, labels, value))
+            continue
+        sums = dict(counters.get(name + '_sum', []))
+        for labels, counts in sorted(buckets.get(name, {}).items()):
+            total = 0
+            for le in BUCKETS + (_INF,):
+                total += counts.get(le, 0)
+                lines.append(_sample(name + '_bucket', labels, total, le))
+            lines.append(_sample(name + '_sum', labels, sums.get(labels, 0)))
+            lines.append(_sample(name + '_count', labels, total))
+    for name, (help_text, value) in (gauges or {}).items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(_sample(name, '', value))
+    return "\n".join(lines) + "\n"
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Print the stored metrics')
+    parser.add_argument('--path', default=DEFAULT_METRICS_PATH)
+    args = parser.parse_args()
+    if not os.path.exists(args.path):
+        print(f"❌ No metrics at {args.path}")
+        sys.exit(1)
+    sys.stdout.write(render(args.path))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+POP3 command pipelining on top of poplib
+
+poplib waits for every response before sending the next command, so a
+catch-up of thousands of messages costs one round trip each. When the
+server advertises PIPELINING (RFC 2449) pipeline() keeps a window of
+RETR/TOP/DELE commands in flight and reads the responses in order, so
+throughput is bounded by bandwidth instead of latency.
+
+POP3 and POP3_SSL are poplib's clients without its 2048-byte line limit:
+HTML mail that is not wrapped at 998 characters as RFC 5322 asks has far
+longer lines, and fetchmail delivers it.
+
+header_prepass() uses pipelined "TOP n 0" to read only the headers of
+pending messages and resolves the filter rules that can be decided from
+headers alone, so the fetcher can schedule those messages before any body
+has been downloaded.
+"""
+
+import poplib
+from collections import deque
+from email.parser import BytesHeaderParser
+from email import policy
+
+DEFAULT_WINDOW = 32
+# Longest line accepted in a response; longer ones still fail the read
+DEFAULT_MAX_LINE = 16 * 1024 * 1024
+
+class BodyNeeded(Exception):
+    """Raised by the body loader when a rule cannot be decided from headers"""
+
+class LongLines:
+    """poplib._getline with a per-connection max_line instead of poplib._MAXLINE"""
+
+    max_line = DEFAULT_MAX_LINE
+
+    def _getline(self):
+        line = self.file.readline(self.max_line + 1)
+        if len(line) > self.max_line:
+            raise poplib.error_proto('line too long')
+        if not line:
+            raise poplib.error_proto('-ERR EOF')
+        octets = len(line)
+        if line[-2:] == poplib.CRLF:
+            return line[:-2], octets
+        if line[:1] == poplib.CR:
+            return line[1:-1], octets
+        return line[:-1], octets
+
+class POP3(LongLines, poplib.POP3):
+    pass
+
+class POP3_SSL(LongLines, poplib.POP3_SSL):
+    pass
+
+def capabilities(pop):
+    """CAPA response as a dict, or {} when the server does not support CAPA"""
+    try:
+        return pop.capa()
+    except poplib.error_proto:
+        return {}
+
+def server_error(error):
+    """True if a poplib.error_proto is the server's -ERR answer, not a broken read"""
+    response = error.args[0] if error.args else None
+    # poplib raises a -ERR line as bytes; its own failures ('line too long', '-ERR EOF') are str
+    return isinstance(response, bytes) and response.startswith(b"-ERR")
+
+def pipeline(pop, commands, window=DEFAULT_WINDOW, multiline=True):
+    """Send commands with up to window outstanding; yields (command, result) in order
+
+    result is poplib's (response, lines, octets) tuple for multi-line
+    commands, the response line otherwise, or the poplib.error_proto raised
+    for a -ERR answer. With window=1 this is plain lock-step POP3.
+
+    Any other failure (a line over max_line, EOF, a socket error) leaves the
+    rest of a response unread, so every later response would be read from
+    the wrong place: it is raised, and the caller must drop the connection
+    without QUIT.
+    """
+    commands = iter(commands)
+    in_flight = deque()
+    exhausted = False
+    window = max(1, window)
+    read = pop._getlongresp if multiline else pop._getresp
+
+    while True:
+        # Top up in batches so a full window costs a single send
+        if not exhausted and len(in_flight) <= window // 2:
+            batch = []
+            while len(in_flight) + len(batch) < window:
+                command = next(commands, None)
+                if command is None:
+                    exhausted = True
+                    break
+                batch.append(command)
+            if batch:
+                pop.sock.sendall(b"".join(c.encode(pop.encoding) + poplib.CRLF for c in batch))
+                in_flight.extend(batch)
+        if not in_flight:
+            return
+
+        command = in_flight.popleft()
+        try:
+            result = read()
+        except poplib.error_proto as e:
+            if not server_error(e):
+                raise
+            result = e
+        yield command, result
+
+def header_route(rules, headers):
+    """The rule chosen from headers alone, False for no match, None if the body decides"""
+    subject = str(headers.get("Subject") or "").lower()
+    from_addr = str(headers.get("From") or "").lower()
+
+    def body_unknown():
+        raise BodyNeeded()
+
+    try:
+        rule = rules.match(subject, from_addr, body_unknown)
+    except BodyNeeded:
+        return None
+    return rule if rule is not None else False
+
+def header_prepass(pop, rules, numbers, window=DEFAULT_WINDOW):
+    """Fetch the headers of numbers with TOP n 0 and route them; returns {number: route}
+
+    Routes are as returned by header_route(). Messages whose TOP failed are
+    left out.
+    """
+    parser = BytesHeaderParser(policy=policy.compat32)
+    routes = {}
+    commands = (f"TOP {n} 0" for n in numbers)
+    for command, result in pipeline(pop, commands, window):
+        if isinstance(result, poplib.error_proto):
+            continue
+        number = int(command.split()[1])
+        routes[number] = header_route(rules, parser.parsebytes(b"\r\n".join(result[1])))
+    return routes
@@ -1,47 +1,108 @@
 #!/usr/bin/env python3
 
-import sys
-import email
-import subprocess
-import yaml
+# Runs once per message when the daemon is down, so startup is per-message
+# latency: push_queue (sqlite3, requests), dedup, mailbox_stats and catalog are
+# imported only once their feature is enabled. test_import_time.py keeps an eye on this.
 import os
 import sys
-import email
 import re
-import requests
+import shutil
+import tempfile
 from datetime import datetime
+from email.parser import BytesHeaderParser, BytesFeedParser
 import logging
-import subprocess
-from pathlib import Path
+
+from delivery import create_delivery_backend, DeliveryError, MessageStream
+import config_store
+import metrics
+
+# MAIL_BRIDGE_LOG_DIR moves the log out of /logs, e.g. for running outside the container
+LOG_DIR = os.environ.get('MAIL_BRIDGE_LOG_DIR', '/logs')
 
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler('/logs/process_mail.log'),
+        logging.FileHandler(os.path.join(LOG_DIR, 'process_mail.log')),
         logging.StreamHandler()
     ]
 )
 logger = logging.getLogger(__name__)
 
+# Upper bound on the header section read into memory
+MAX_HEADER_BYTES = 1024 * 1024
+
+_HEADER_END = re.compile(rb'\r?\n\r?\n')
+
 class MailProcessor:
-    def __init__(self, config_path="/config/accounts.yaml"):
-        self.config = self.load_config(config_path)
-        self.filter_rules = self.config.get('filter_rules', [])
+    def __init__(self, config_path="/config/accounts.yaml", snapshot=None, single_message=False):
+        # Parsed config and compiled rules are shared with every processor of this file version
+        self.snapshot = snapshot if snapshot is not None else config_store.load(config_path)
+        self.config = self.snapshot.data
+        self.filter_rules = self.snapshot.filter_rules
+        self.rules = self.snapshot.rules
+        metrics.configure(self.config.get('settings', {}))
+        
+        # Large messages are spooled to disk; rules only ever see a bounded prefix
+        processing = self.config.get('settings', {}).get('message_processing', {}) or {}
+        self.spool_threshold = processing.get('spool_threshold', 1024 * 1024)
+        self.body_scan_bytes = processing.get('body_scan_bytes', 256 * 1024)
+        self.spool_dir = processing.get('spool_dir')
         self.push_settings = self.config.get('settings', {}).get('push_notifications', {})
+        self.push_queue = None
+        # Set by a process running a PushWorker so new notifications go out at once
+        self.push_wakeup = None
         
-    def load_config(self, config_path):
-        """Load configuration from YAML file"""
+        # Resolve the delivery path once, not per message
         try:
-            with open(config_path, 'r') as f:
-                return yaml.safe_load(f)
-        except Exception as e:
-            logger.error(f"Failed to load config: {e}")
-            return {}
+            self.delivery = create_delivery_backend(self.config.get('settings', {}))
+            logger.info(f"Delivery backend: {self.delivery.name}")
+        except DeliveryError as e:
+            logger.error(f"{e}")
+            self.delivery = None
+        
+        # Messages delivered before (same Message-ID and body) are dropped
+        self.dedup = None
+        dedup_settings = self.config.get('settings', {}).get('dedup', {}) or {}
+        if dedup_settings.get('enabled', False):
+            try:
+                from dedup import DedupIndex, DEFAULT_DEDUP_PATH
+                # Loading the Bloom filter costs more than the one index lookup a single message needs
+                self.dedup = DedupIndex(dedup_settings.get('path', DEFAULT_DEDUP_PATH), bloom=not single_message)
+            except Exception as e:
+                logger.error(f"Failed to open dedup index: {e}")
+        
+        # Per-folder counts shown on the dashboard; its reconciler corrects anything missed here
+        self.mailbox_stats = None
+        stats_settings = self.config.get('settings', {}).get('mailbox_stats', {}) or {}
+        if stats_settings.get('enabled', True):
+            import mailbox_stats
+            root = mailbox_stats.maildir_root(self.config.get('settings', {}))
+            self.mailbox_stats = mailbox_stats.shared(root)
+        
+        # Searchable message list for the web interface; its sync links the row to Dovecot's file
+        self.catalog = None
+        if (self.config.get('settings', {}).get('catalog', {}) or {}).get('enabled', True):
+            import catalog
+            self.catalog = catalog.from_settings(self.config.get('settings', {}))
+        
+    def deliver(self, imap_user, folder, message):
+        """Hand a processed message (a MessageStream) to Dovecot"""
+        if self.delivery is None:
+            raise DeliveryError("No delivery backend available")
+        with metrics.timer('mailbridge_delivery_seconds', backend=self.delivery.name):
+            self.delivery.deliver(imap_user, folder, message)
+    
+    def close(self):
+        """Release the delivery backend (e.g. an open LMTP session) and the dedup index"""
+        if self.delivery is not None:
+            self.delivery.close()
+        if self.dedup is not None:
+            self.dedup.close()
     
     def send_push_notification(self, title, body, source="mail-bridge"):
-        """Send push notification via webhook"""
+        """Queue a push notification for the background webhook sender"""
         if not self.push_settings.get('enabled', False):
             return
             
@@ -51,28 +112,27 @@ class MailProcessor:
             return
             
         try:
+            from push_queue import PushQueue, build_payload, DEFAULT_QUEUE_PATH
+            if self.push_queue is None:
+                self.push_queue = PushQueue(self.push_settings.get('queue_path', DEFAULT_QUEUE_PATH))
             timeout = self.push_settings.get('timeout', 5)
-            response = requests.post(
-                webhook_url,
-                json={
-                    "title": title,
-                    "body": body,
-                    "source": source,
-                    "timestamp": datetime.now().isoformat()
-                },
-                timeout=timeout
-            )
-            logger.info(f"Push notification sent: {response.status_code}")
+            digest = self.push_settings.get('digest', {}) or {}
+            if digest.get('enabled', False):
+                # Held back and merged with other notifications carrying the same title
+                self.push_queue.enqueue(webhook_url, build_payload(title, body, source), timeout,
+                                        group_key=title, delay=digest.get('window', 60))
+            else:
+                self.push_queue.enqueue(webhook_url, build_payload(title, body, source), timeout)
+            logger.info(f"Push notification queued: {title}")
+            if self.push_wakeup is not None:
+                self.push_wakeup()
         except Exception as e:
-            logger.error(f"Failed to send push notification: {e}")
+            logger.error(f"Failed to queue push notification: {e}")
     
-    def apply_filter_rules(self, msg):
-        """Apply filtering rules to determine folder and actions"""
-        subject = (msg.get("Subject") or "").lower()
-        from_addr = (msg.get("From") or "").lower()
+    @staticmethod
+    def extract_body_text(msg):
+        """Return the lowercased text used for body_contains conditions"""
         body = ""
-        
-        # Extract body text for content filtering
         if msg.is_multipart():
             for part in msg.walk():
                 if part.get_content_type() == "text/plain":
@@ -86,6 +146,12 @@ class MailProcessor:
                 body = msg.get_payload(decode=True).decode('utf-8', errors='ignore').lower()
             except:
                 pass
+        return body
+    
+    def apply_filter_rules(self, msg):
+        """Apply filtering rules to determine folder and actions"""
+        subject = str(msg.get("Subject") or "").lower()
+        from_addr = str(msg.get("From") or "").lower()
         
         # Default folder and settings
         folder = "INBOX"
@@ -94,90 +160,122 @@ class MailProcessor:
         push_title = "New Email"
         push_body = msg.get("Subject", "(no subject)")
         
-        # Apply each rule
-        for rule in self.filter_rules:
+        # First matching rule wins; the body is only decoded if a body rule is reached
+        rule = self.rules.match(subject, from_addr, lambda: self.extract_body_text(msg))
+        
+        if rule is None:
+            metrics.inc('mailbridge_rule_hits_total', rule='(default)')
+        else:
             rule_name = rule.get('name', 'unnamed')
-            conditions = rule.get('conditions', {})
             action = rule.get('action', {})
+            logger.info(f"Filter rule '{rule_name}' matched")
+            metrics.inc('mailbridge_rule_hits_total', rule=rule_name)
             
-            # Check if conditions match
-            matches = True
-            
-            # Subject conditions
-            if 'subject_contains' in conditions:
-                subject_terms = conditions['subject_contains']
-                if isinstance(subject_terms, str):
-                    subject_terms = [subject_terms]
-                if not any(term.lower() in subject for term in subject_terms):
-                    matches = False
+            if 'folder' in action:
+                folder = action['folder']
             
-            # From conditions
-            if 'from_contains' in conditions:
-                from_terms = conditions['from_contains']
-                if isinstance(from_terms, str):
-                    from_terms = [from_terms]
-                if not any(term.lower() in from_addr for term in from_terms):
-                    matches = False
+            if 'mark_as' in action:
+                mark_as = action['mark_as']
             
-            # Body conditions
-            if 'body_contains' in conditions:
-                body_terms = conditions['body_contains']
-                if isinstance(body_terms, str):
-                    body_terms = [body_terms]
-                if not any(term.lower() in body for term in body_terms):
-                    matches = False
+            if 'push_notify' in action:
+                push_notify = action['push_notify']
             
-            # If rule matches, apply action
-            if matches:
-                logger.info(f"Filter rule '{rule_name}' matched")
-                
-                if 'folder' in action:
-                    folder = action['folder']
-                
-                if 'mark_as' in action:
-                    mark_as = action['mark_as']
-                
-                if 'push_notify' in action:
-                    push_notify = action['push_notify']
-                
-                if 'push_title' in action:
-                    push_title = action['push_title']
-                
-                # Break after first matching rule (can be changed for multiple rules)
-                break
+            if 'push_title' in action:
+                push_title = action['push_title']
         
         return folder, mark_as, push_notify, push_title, push_body
 
-def main():
-    # Get IMAP user from command line argument
-    if len(sys.argv) < 2:
-        logger.error("Missing IMAP user argument")
-        sys.exit(1)
+def spool_message(source, threshold, spool_dir=None):
+    """Copy a raw message into memory, or a temp file once it exceeds threshold"""
+    spool = tempfile.SpooledTemporaryFile(max_size=threshold, dir=spool_dir)
+    if isinstance(source, bytes):
+        spool.write(source)
+    else:
+        shutil.copyfileobj(source, spool, 64 * 1024)
+    spool.seek(0)
+    return spool
+
+def header_block(headers, eol):
+    """Encode extra header fields to put in front of the original message"""
+    lines = []
+    for name, value in headers:
+        # Never let a header value start a new header line
+        value = " ".join(str(value).splitlines())
+        lines.append(f"{name}: {value}".encode('utf-8') + eol)
+    return b"".join(lines)
+
+def process_message(processor, imap_user, source):
+    """Filter and deliver one raw message (bytes or binary stream), returning the MDA exit code"""
+    try:
+        spool = spool_message(source, processor.spool_threshold, processor.spool_dir)
+    except Exception as e:
+        logger.error(f"Failed to read email: {e}")
+        return 1
     
-    imap_user = sys.argv[1]
+    try:
+        return _process_spooled(processor, imap_user, spool)
+    finally:
+        spool.close()
+
+def _process_spooled(processor, imap_user, spool):
+    # Only the header section plus a bounded body prefix is ever held in memory
+    head = spool.read(MAX_HEADER_BYTES + processor.body_scan_bytes)
+    match = _HEADER_END.search(head, 0, MAX_HEADER_BYTES)
+    header_end = match.end() if match else min(len(head), MAX_HEADER_BYTES)
     
-    # Read raw email from stdin
     try:
-        raw_message = sys.stdin.read()
-        msg = email.message_from_string(raw_message)
+        with metrics.timer('mailbridge_parse_seconds'):
+            if processor.rules.needs_body:
+                parser = BytesFeedParser()
+                parser.feed(head[:header_end + processor.body_scan_bytes])
+                msg = parser.close()
+            else:
+                # No rule looks at the body - skip MIME parsing and decoding entirely
+                msg = BytesHeaderParser().parsebytes(head[:header_end])
     except Exception as e:
         logger.error(f"Failed to parse email: {e}")
-        sys.exit(1)
+        metrics.inc('mailbridge_messages_total', user=imap_user, result='parse_error')
+        return 1
     
-    # Initialize processor
-    processor = MailProcessor()
+    dedup_key = None
+    if processor.dedup is not None:
+        from dedup import body_digest, message_key
+        spool.seek(header_end)
+        body_hash = body_digest(iter(lambda: spool.read(64 * 1024), b""))
+        dedup_key = message_key(imap_user, head[:header_end], body_hash)
+        try:
+            claimed = processor.dedup.claim(dedup_key)
+        except Exception as e:
+            # A broken index must not hold up mail; at worst a duplicate is delivered
+            logger.warning(f"Could not check for a duplicate, delivering anyway: {e}")
+            dedup_key = None
+            claimed = True
+        if not claimed:
+            # Report success so the fetcher does not try again
+            logger.info(f"Skipping duplicate for {imap_user}: {msg.get('Message-ID', '(no Message-ID)')} "
+                        f"({processor.dedup.skipped} skipped so far)")
+            metrics.inc('mailbridge_messages_total', user=imap_user, result='duplicate')
+            return 0
     
     # Apply filtering rules
-    folder, mark_as, push_notify, push_title, push_body = processor.apply_filter_rules(msg)
+    with metrics.timer('mailbridge_filter_seconds'):
+        folder, mark_as, push_notify, push_title, push_body = processor.apply_filter_rules(msg)
     
     logger.info(f"Processing email for {imap_user} -> folder: {folder}")
     
-    # Add custom headers if needed
+    # Add custom headers in front of the original bytes instead of re-serialising
+    headers = []
     if mark_as:
-        msg["X-Marked-As"] = mark_as
+        headers.append(("X-Marked-As", mark_as))
     
-    msg["X-Processed-By"] = "mail-bridge"
-    msg["X-Processed-At"] = datetime.now().isoformat()
+    headers.append(("X-Processed-By", "mail-bridge"))
+    headers.append(("X-Processed-At", datetime.now().isoformat()))
+    
+    first_line_end = head.find(b"\n")
+    eol = b"\r\n" if first_line_end > 0 and head[first_line_end - 1:first_line_end] == b"\r" else b"\n"
+    envelope = head[:first_line_end + 1] if head.startswith(b"From ") else b""
+    # An mbox envelope line stays first
+    message = MessageStream(spool, head=envelope + header_block(headers, eol), start=len(envelope))
     
     # Send push notification if needed
     if push_notify:
@@ -185,58 +283,51 @@ def main():
     
     # Deliver to dovecot
     try:
-        # Try different Dovecot LDA paths
-        lda_paths = [
-            "/usr/lib/dovecot/dovecot-lda",
-            "/usr/libexec/dovecot/dovecot-lda", 
-            "/usr/bin/dovecot-lda",
-            "dovecot-lda"
-        ]
-        
-        lda_cmd = None
-        for path in lda_paths:
-            logger.info(f"Checking for dovecot-lda at: {path}")
-            if os.path.exists(path):
-                lda_cmd = path
-                logger.info(f"Found dovecot-lda at: {path}")
-                break
-            elif path == "dovecot-lda":
-                # Check if it's in PATH
-                result = subprocess.run(["which", "dovecot-lda"], capture_output=True, text=True)
-                if result.returncode == 0:
-                    lda_cmd = "dovecot-lda"
-                    logger.info(f"Found dovecot-lda in PATH at: {result.stdout.strip()}")
-                    break
-        
-        if lda_cmd is None:
-            logger.error("dovecot-lda not found in any standard location")
-            # List what's actually available
-            for path in ["/usr/lib/dovecot", "/usr/libexec/dovecot", "/usr/bin"]:
-                if os.path.exists(path):
-                    files = os.listdir(path)
-                    logger.info(f"Files in {path}: {[f for f in files if 'dovecot' in f]}")
-            raise FileNotFoundError("dovecot-lda not found in any standard location")
-            
-        logger.info(f"Using dovecot-lda command: {lda_cmd}")
-        proc = subprocess.Popen(
-            [
-                lda_cmd,
-                "-d", imap_user,
-                "-m", folder
-            ],
-            stdin=subprocess.PIPE
-        )
-        proc.communicate(msg.as_bytes())
-        
-        if proc.returncode == 0:
-            logger.info(f"Successfully delivered to {folder}")
-        else:
-            logger.error(f"Delivery failed with code {proc.returncode}")
-            sys.exit(1)
-            
+        processor.deliver(imap_user, folder, message)
+        logger.info(f"Successfully delivered to {folder}")
     except Exception as e:
         logger.error(f"Error delivering mail: {e}")
+        metrics.inc('mailbridge_messages_total', user=imap_user, result='failed')
+        if dedup_key is not None:
+            try:
+                processor.dedup.release([dedup_key])
+            except Exception as e:
+                logger.warning(f"Could not release the duplicate check: {e}")
+        return 1
+    
+    metrics.inc('mailbridge_messages_total', user=imap_user, result='delivered')
+    if dedup_key is not None:
+        try:
+            processor.dedup.commit([dedup_key], f"delivery:{imap_user}")
+        except Exception as e:
+            logger.warning(f"Could not record the message for duplicate checks: {e}")
+    if processor.mailbox_stats is not None:
+        try:
+            processor.mailbox_stats.add_folder(imap_user, folder, 1, 1, message.size())
+        except Exception as e:
+            logger.warning(f"Could not update mailbox statistics: {e}")
+    if processor.catalog is not None:
+        try:
+            processor.catalog.add_message(imap_user, folder, head, message.size())
+        except Exception as e:
+            logger.warning(f"Could not add message to the catalog: {e}")
+    return 0
+
+def main():
+    # Get IMAP user from command line argument
+    if len(sys.argv) < 2:
+        logger.error("Missing IMAP user argument")
         sys.exit(1)
+    
+    imap_user = sys.argv[1]
+    
+    # Initialize processor (this process handles one message, the daemon many)
+    processor = MailProcessor(single_message=True)
+    
+    # Stream the raw email from stdin
+    exit_code = process_message(processor, imap_user, sys.stdin.buffer)
+    processor.close()
+    sys.exit(exit_code)
 
 if __name__ == "__main__":
     main()
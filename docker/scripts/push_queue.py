@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Durable push notification queue
+
+MailProcessor only appends notifications to a SQLite queue; a PushWorker
+thread (run by mail_daemon.py) drains it with a pooled HTTP session and
+retries failures with exponential backoff, so a slow or broken webhook
+never holds up mail delivery.
+
+In digest mode notifications with the same group (push_title) are held
+for a window and then sent as one payload with a count and the first
+subjects, so a burst of mail costs one webhook call per group and window.
+
+Usage: python3 push_queue.py [--drain]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import threading
+import logging
+from contextlib import closing
+from datetime import datetime
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_PATH = "/maildata/.mail-bridge/push_queue.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    webhook_url TEXT NOT NULL,
+    timeout REAL NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    group_key TEXT
+);
+CREATE INDEX IF NOT EXISTS notifications_due ON notifications (status, next_attempt);
+"""
+
+class PushQueue:
+    """SQLite-backed queue of webhook notifications"""
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(notifications)")]
+            if 'group_key' not in columns:
+                conn.execute("ALTER TABLE notifications ADD COLUMN group_key TEXT")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def enqueue(self, webhook_url, payload, timeout=5, group_key=None, delay=0):
+        """Add a notification; returns immediately
+
+        With a group_key the notification waits delay seconds and is then
+        merged with every other pending notification of the same group.
+        """
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO notifications (webhook_url, timeout, payload, created_at, next_attempt, group_key) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (webhook_url, timeout, json.dumps(payload), now, now + delay, group_key)
+            )
+
+    def depth(self):
+        """Number of notifications still waiting to be sent"""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM notifications WHERE status = 'pending'"
+            ).fetchone()[0]
+
+    def failed(self):
+        """Number of notifications that ran out of retries"""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM notifications WHERE status = 'failed'"
+            ).fetchone()[0]
+
+    def claim(self, limit=20, lease=60, top_subjects=5):
+        """Return due notifications and hide them from other workers for lease seconds
+
+        A due notification that belongs to a digest group is returned as one
+        merged notification covering the whole group.
+        """
+        now = time.time()
+        claimed = []
+        with closing(self._connect()) as conn, conn:
+            rows = conn.execute(
+                "SELECT id, webhook_url, timeout, payload, attempts, group_key FROM notifications "
+                "WHERE status = 'pending' AND next_attempt <= ? ORDER BY id LIMIT ?",
+                (now, limit)
+            ).fetchall()
+            groups = set()
+            for row in rows:
+                group_key = row[5]
+                if group_key is None:
+                    conn.execute("UPDATE notifications SET next_attempt = ? WHERE id = ?",
+                                 (now + lease, row[0]))
+                    claimed.append(row[:5])
+                elif group_key not in groups:
+                    groups.add(group_key)
+                    claimed.append(self._collapse(conn, group_key, now + lease, top_subjects))
+        return claimed
+
+    def _collapse(self, conn, group_key, lease_until, top_subjects):
+        """Merge all pending notifications of a group into one digest notification"""
+        rows = conn.execute(
+            "SELECT id, webhook_url, timeout, payload, created_at FROM notifications "
+            "WHERE status = 'pending' AND group_key = ? ORDER BY id",
+            (group_key,)
+        ).fetchall()
+        first_id, webhook_url, timeout, payload, created_at = rows[0]
+
+        if len(rows) > 1:
+            subjects = [json.loads(row[3]).get('body', '') for row in rows]
+            shown = subjects[:top_subjects]
+            lines = [f"{len(rows)} new messages"] + [f"- {subject}" for subject in shown]
+            if len(rows) > len(shown):
+                lines.append(f"... and {len(rows) - len(shown)} more")
+            digest = json.loads(payload)
+            digest.update({
+                "body": "\n".join(lines),
+                "timestamp": datetime.now().isoformat(),
+                "digest": True,
+                "count": len(rows),
+                "subjects": shown,
+            })
+            payload = json.dumps(digest)
+            conn.executemany("DELETE FROM notifications WHERE id = ?", [(row[0],) for row in rows[1:]])
+
+        # The first row carries the merged payload and leaves its group
+        conn.execute(
+            "UPDATE notifications SET payload = ?, group_key = NULL, next_attempt = ? WHERE id = ?",
+            (payload, lease_until, first_id)
+        )
+        return (first_id, webhook_url, timeout, payload, 0)
+
+    def next_due(self):
+        """Timestamp of the earliest pending notification, or None"""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT MIN(next_attempt) FROM notifications WHERE status = 'pending'"
+            ).fetchone()[0]
+
+    def mark_sent(self, notification_id):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM notifications WHERE id = ?", (notification_id,))
+
+    def mark_failed(self, notification_id, attempts, next_attempt, error, give_up=False):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE notifications SET attempts = ?, next_attempt = ?, last_error = ?, status = ? "
+                "WHERE id = ?",
+                (attempts, next_attempt, error, 'failed' if give_up else 'pending', notification_id)
+            )
+
+def build_payload(title, body, source="mail-bridge"):
+    """Webhook JSON body (unchanged from the synchronous sender)"""
+    return {
+        "title": title,
+        "body": body,
+        "source": source,
+        "timestamp": datetime.now().isoformat()
+    }
+
+def worker_settings(push_settings):
+    """What a PushWorker is built from, to compare across config reloads; None when push is disabled"""
+    if not push_settings.get('enabled', False):
+        return None
+    retry = push_settings.get('retry', {}) or {}
+    digest = push_settings.get('digest', {}) or {}
+    return (push_settings.get('queue_path', DEFAULT_QUEUE_PATH), retry.get('max_attempts', 8),
+            retry.get('backoff_base', 5), retry.get('backoff_max', 3600), digest.get('top_subjects', 5))
+
+class PushWorker(threading.Thread):
+    """Background thread sending queued notifications"""
+
+    def __init__(self, queue, max_attempts=8, backoff_base=5, backoff_max=3600, pool_size=4,
+                 top_subjects=5):
+        super().__init__(name="push-worker", daemon=True)
+        self.queue = queue
+        self.top_subjects = top_subjects
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self._session = None
+
+    @classmethod
+    def from_settings(cls, push_settings):
+        queue = PushQueue(push_settings.get('queue_path', DEFAULT_QUEUE_PATH))
+        retry = push_settings.get('retry', {}) or {}
+        digest = push_settings.get('digest', {}) or {}
+        return cls(
+            queue,
+            max_attempts=retry.get('max_attempts', 8),
+            backoff_base=retry.get('backoff_base', 5),
+            backoff_max=retry.get('backoff_max', 3600),
+            top_subjects=digest.get('top_subjects', 5),
+        )
+
+    @property
+    def session(self):
+        # requests is imported here so delivery never pays for it
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+        return self._session
+
+    def notify(self):
+        """Wake the worker after something was enqueued"""
+        self.wakeup.set()
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+
+    def send(self, webhook_url, payload, timeout):
+        response = self.session.post(webhook_url, data=payload,
+                                     headers={"Content-Type": "application/json"},
+                                     timeout=timeout)
+        if response.status_code >= 300:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        return response.status_code
+
+    def run_once(self):
+        """Send every due notification; returns how many were attempted"""
+        rows = self.queue.claim(top_subjects=self.top_subjects)
+        for notification_id, webhook_url, timeout, payload, attempts in rows:
+            try:
+                with metrics.timer('mailbridge_push_send_seconds'):
+                    status = self.send(webhook_url, payload, timeout)
+                self.queue.mark_sent(notification_id)
+                metrics.inc('mailbridge_push_sent_total', result='sent')
+                logger.info(f"Push notification sent: {status}")
+            except Exception as e:
+                attempts += 1
+                give_up = attempts >= self.max_attempts
+                metrics.inc('mailbridge_push_sent_total', result='failed' if give_up else 'retry')
+                delay = min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+                delay *= random.uniform(0.8, 1.2)
+                self.queue.mark_failed(notification_id, attempts, time.time() + delay, str(e), give_up)
+                if give_up:
+                    logger.error(f"Giving up on push notification {notification_id} after {attempts} attempts: {e}")
+                else:
+                    logger.warning(f"Push notification failed ({e}), retry {attempts} in {delay:.0f}s")
+        return len(rows)
+
+    def run(self):
+        logger.info(f"Push worker draining {self.queue.path}")
+        while not self.stopping.is_set():
+            try:
+                if self.run_once():
+                    continue
+                next_due = self.queue.next_due()
+            except Exception as e:
+                logger.error(f"Push worker error: {e}")
+                next_due = None
+            wait = 30 if next_due is None else max(0.0, min(30, next_due - time.time()))
+            self.wakeup.wait(wait)
+            self.wakeup.clear()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    import config_store
+    snapshot = config_store.load()
+    if snapshot.error:
+        print(f"❌ Failed to load config: {snapshot.error}")
+        sys.exit(1)
+    push_settings = snapshot.settings.get('push_notifications', {}) or {}
+    worker = PushWorker.from_settings(push_settings)
+
+    if '--drain' in sys.argv:
+        while worker.run_once():
+            pass
+    print(f"📬 Pending: {worker.queue.depth()}  Failed: {worker.queue.failed()}")
+
+if __name__ == "__main__":
+    main()
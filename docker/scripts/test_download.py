@@ -11,6 +11,8 @@ import poplib
 import email
 from pathlib import Path
 
+from maildir import MaildirWriter, folder_path
+
 def download_last_n_emails(account, n=10):
     """Download only last N emails from POP3 account"""
     try:
@@ -37,30 +39,18 @@ def download_last_n_emails(account, n=10):
         start_msg = max(1, total_messages - n + 1)
         print(f"📥 Downloading messages {start_msg} to {total_messages} (last {n} emails)")
         
-        maildir_path = Path(f"/maildata/{imap_user}/Maildir")
-        maildir_path.mkdir(parents=True, exist_ok=True)
-        (maildir_path / "cur").mkdir(exist_ok=True)
-        (maildir_path / "new").mkdir(exist_ok=True)
-        (maildir_path / "tmp").mkdir(exist_ok=True)
+        maildir_path = folder_path("/maildata", imap_user)
+        writer = MaildirWriter(maildir_path)
         
         downloaded = 0
         for msg_num in range(start_msg, total_messages + 1):
             try:
                 # Retrieve message
-                raw_msg = b"\n".join(pop.retr(msg_num)[1])
+                raw_msg = b"\n".join(pop.retr(msg_num)[1]) + b"\n"
                 msg = email.message_from_bytes(raw_msg)
                 
-                # Generate filename
-                import time
-                import hashlib
-                timestamp = str(int(time.time()))
-                content_hash = hashlib.md5(raw_msg).hexdigest()[:8]
-                filename = f"{timestamp}.{content_hash}:2,S"
-                
-                # Save to new directory
-                target_file = maildir_path / "new" / filename
-                with open(target_file, 'wb') as f:
-                    f.write(raw_msg)
+                # Save to new directory (tmp -> new, unique name)
+                writer.add(raw_msg)
                 
                 downloaded += 1
                 subject = msg.get('subject', 'No subject')
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Test the native fetcher against a local stand-in POP3 server
+
+Runs AccountPoller.poll() against a POP3 server in this process
+(CAPA/UIDL/TOP/RETR/DELE, dot-stuffed responses, PIPELINING advertised)
+with Maildir delivery into a temporary directory, and checks that every
+message is delivered (including one with lines far over poplib's 2048
+bytes), leading dots are un-stuffed, seen UIDLs are not fetched again and
+keep: false deletes messages delivered earlier. A response that cannot be
+read (a line over fetcher.max_line) must end the poll without delivering
+anything read out of place and without deleting anything.
+
+Usage: python3 test_fetcher.py
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import socketserver
+
+# process_mail opens its log file on import
+SCRATCH = tempfile.mkdtemp(prefix='test_fetcher_')
+os.environ.setdefault('MAIL_BRIDGE_LOG_DIR', SCRATCH)
+
+import yaml
+
+from fetcher import AccountPoller
+from process_mail import MailProcessor
+from uidl_store import UIDLStore
+
+MESSAGES = [
+    b"From: alice@example.com\r\nSubject: First\r\nMessage-ID: <1@test>\r\n\r\nPlain body\r\n",
+    b"From: bob@example.com\r\nSubject: Dots\r\nMessage-ID: <2@test>\r\n\r\n.starts with a dot\r\n"
+    b"..two dots\r\n.\r\nlast line\r\n",
+    b"From: carol@example.com\r\nSubject: Third\r\nMessage-ID: <3@test>\r\n\r\n" + (b"x" * 900 + b"\r\n") * 40,
+    # Unwrapped HTML, as sent by mailers that ignore the 998-octet line limit of RFC 5322
+    b"From: dave@example.com\r\nSubject: Long lines\r\nMessage-ID: <4@test>\r\n\r\n<p>" + b"y" * 5000
+    + b"</p>\r\n<p>" + b"z" * 200000 + b"</p>\r\n",
+]
+
+class Mailbox:
+    """Messages on the stand-in server and the commands it received"""
+
+    def __init__(self, messages):
+        self.messages = {n: raw for n, raw in enumerate(messages, 1)}
+        self.uidls = {n: f"uid-{n}" for n in self.messages}
+        self.commands = []
+        self.lock = threading.Lock()
+
+class POP3Handler(socketserver.StreamRequestHandler):
+    """One POP3 session; DELE takes effect at QUIT"""
+
+    def send(self, line):
+        self.wfile.write(line + b"\r\n")
+
+    def send_lines(self, lines):
+        for line in lines:
+            self.send(b"." + line if line.startswith(b".") else line)
+        self.send(b".")
+
+    def handle(self):
+        mailbox = self.server.mailbox
+        deleted = set()
+        self.send(b"+OK stand-in POP3 server ready")
+        while True:
+            self.wfile.flush()
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, argument = line.strip().decode('ascii').partition(' ')
+            command = command.upper()
+            with mailbox.lock:
+                mailbox.commands.append(f"{command} {argument}".strip())
+                messages = {n: raw for n, raw in mailbox.messages.items() if n not in deleted}
+            if command in ('USER', 'PASS', 'NOOP', 'RSET'):
+                self.send(b"+OK")
+            elif command == 'CAPA':
+                self.send(b"+OK")
+                self.send_lines([b"UIDL", b"TOP", b"PIPELINING"])
+            elif command == 'STAT':
+                self.send(f"+OK {len(messages)} {sum(map(len, messages.values()))}".encode())
+            elif command == 'UIDL':
+                self.send(b"+OK")
+                self.send_lines([f"{n} {mailbox.uidls[n]}".encode() for n in sorted(messages)])
+            elif command in ('RETR', 'TOP'):
+                parts = argument.split()
+                raw = messages.get(int(parts[0]))
+                if raw is None:
+                    self.send(b"-ERR no such message")
+                    continue
+                if command == 'TOP':
+                    raw = raw.split(b"\r\n\r\n", 1)[0] + b"\r\n\r\n"
+                self.send(b"+OK")
+                self.send_lines(raw.rstrip(b"\r\n").split(b"\r\n"))
+            elif command == 'DELE':
+                deleted.add(int(argument))
+                self.send(b"+OK")
+            elif command == 'QUIT':
+                with mailbox.lock:
+                    for n in deleted:
+                        mailbox.messages.pop(n, None)
+                self.send(b"+OK bye")
+                self.wfile.flush()
+                return
+            else:
+                self.send(b"-ERR unknown command")
+
+def start_server(mailbox):
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), POP3Handler)
+    server.daemon_threads = True
+    server.mailbox = mailbox
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def write_config(directory, port, keep, max_line=None):
+    config = {
+        'accounts': [{'name': 'standin', 'pop_server': '127.0.0.1', 'pop_port': port, 'ssl': False,
+                      'user': 'test', 'password': 'test', 'imap_user': 'user1', 'keep': keep}],
+        'settings': {
+            'delivery': {'method': 'maildir', 'maildir_root': directory, 'fsync': False},
+            'fetcher': {'state_path': os.path.join(directory, 'uidl.db'), 'timeout': 10},
+            'metrics': {'enabled': False},
+            'dedup': {'enabled': False},
+            'mailbox_stats': {'enabled': False},
+            'catalog': {'enabled': False},
+        },
+    }
+    if max_line is not None:
+        config['settings']['fetcher']['max_line'] = max_line
+    path = os.path.join(directory, 'accounts.yaml')
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f)
+    return path, config
+
+def delivered_files(directory):
+    inbox = os.path.join(directory, 'user1', 'Maildir')
+    files = []
+    for sub in ('new', 'cur'):
+        path = os.path.join(inbox, sub)
+        if os.path.isdir(path):
+            files += [os.path.join(path, name) for name in os.listdir(path)]
+    return files
+
+def poller(directory, port, keep, max_line=None):
+    """A fresh AccountPoller and MailProcessor, as the fetcher builds them after a (re)start"""
+    config_path, config = write_config(directory, port, keep, max_line)
+    store = UIDLStore(config['settings']['fetcher']['state_path'])
+    return AccountPoller(config['accounts'][0], config['settings'], store), MailProcessor(config_path), store
+
+def test_fetcher():
+    print("=== Testing native fetcher ===")
+    directory = os.path.join(SCRATCH, 'maildata')
+    os.makedirs(directory)
+    mailbox = Mailbox(MESSAGES)
+    server = start_server(mailbox)
+    port = server.server_address[1]
+    ok = True
+
+    def expect(condition, passed, failed):
+        nonlocal ok
+        print(f"✅ {passed}" if condition else f"❌ {failed}")
+        ok = ok and condition
+
+    try:
+        account, processor, store = poller(directory, port, keep=True)
+        delivered = account.poll(processor)
+        files = delivered_files(directory)
+        expect(delivered == len(MESSAGES) and len(files) == len(MESSAGES),
+               f"First poll delivered all {len(MESSAGES)} messages",
+               f"First poll delivered {delivered} messages, {len(files)} files (expected {len(MESSAGES)})")
+
+        bodies = []
+        for path in files:
+            with open(path, 'rb') as f:
+                bodies.append(f.read().replace(b"\r\n", b"\n"))
+        dotted = [body for body in bodies if b"Subject: Dots" in body]
+        expect(len(dotted) == 1 and b"\n.starts with a dot\n..two dots\n.\nlast line\n" in dotted[0],
+               "Leading dots un-stuffed", f"Dot-stuffed message delivered as {dotted!r}")
+        long_lines = [body for body in bodies if b"Subject: Long lines" in body]
+        long_body = MESSAGES[3].split(b"\r\n\r\n", 1)[1].replace(b"\r\n", b"\n")
+        expect(len(long_lines) == 1 and long_lines[0].endswith(long_body),
+               "Lines over 2048 bytes delivered intact", "Message with long lines not delivered intact")
+
+        retrs = sum(1 for command in mailbox.commands if command.startswith('RETR'))
+        delivered = account.poll(processor)
+        retrs_again = sum(1 for command in mailbox.commands if command.startswith('RETR')) - retrs
+        expect(delivered == 0 and retrs_again == 0 and len(delivered_files(directory)) == len(MESSAGES),
+               "Second poll skipped seen UIDLs",
+               f"Second poll delivered {delivered} messages with {retrs_again} RETR commands")
+        processor.close()
+        store.close()
+
+        account, processor, store = poller(directory, port, keep=False)
+        del mailbox.commands[:]
+        delivered = account.poll(processor)
+        deles = sorted(command for command in mailbox.commands if command.startswith('DELE'))
+        expect(delivered == 0 and deles == [f"DELE {n}" for n in range(1, len(MESSAGES) + 1)]
+               and not mailbox.messages,
+               "keep: false deleted messages delivered earlier without fetching them again",
+               f"keep: false poll delivered {delivered} messages and sent {deles}")
+        processor.close()
+        store.close()
+    except Exception as e:
+        print(f"❌ Poll failed: {e}")
+        ok = False
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    # Message 2 has a line the fetcher will not read; 3-5 must neither be delivered out of place nor deleted
+    directory = os.path.join(SCRATCH, 'unreadable')
+    os.makedirs(directory)
+    messages = [MESSAGES[0], MESSAGES[3], MESSAGES[1], MESSAGES[2], MESSAGES[0].replace(b"<1@", b"<5@")]
+    mailbox = Mailbox(messages)
+    server = start_server(mailbox)
+    port = server.server_address[1]
+    try:
+        account, processor, store = poller(directory, port, keep=False, max_line=4096)
+        try:
+            account.poll(processor)
+            failed = None
+        except Exception as e:
+            failed = e
+        deles = [command for command in mailbox.commands if command.startswith('DELE')]
+        files = delivered_files(directory)
+        expect(failed is not None and len(files) == 1 and not deles and len(mailbox.messages) == len(messages),
+               "Unreadable response ended the poll with nothing deleted",
+               f"Poll past an unreadable response: error {failed!r}, {len(files)} files, sent {deles}")
+        processor.close()
+        store.close()
+
+        account, processor, store = poller(directory, port, keep=False)
+        delivered = account.poll(processor)
+        expect(delivered == len(messages) - 1 and len(delivered_files(directory)) == len(messages)
+               and not mailbox.messages,
+               "Next poll with a larger max_line delivered and deleted the rest",
+               f"Next poll delivered {delivered}, {len(mailbox.messages)} messages left on the server")
+        processor.close()
+        store.close()
+    except Exception as e:
+        print(f"❌ Poll failed: {e}")
+        ok = False
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    if ok:
+        print("\n🎉 Native fetcher test passed!")
+    return ok
+
+if __name__ == "__main__":
+    try:
+        success = test_fetcher()
+    finally:
+        shutil.rmtree(SCRATCH, ignore_errors=True)
+    sys.exit(0 if success else 1)
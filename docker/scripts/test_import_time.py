@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Import-time budget for the entry points
+
+fetchmail starts mda_client.py for every message, and process_mail.py when
+the daemon is not running, so whatever they import is paid per message.
+Each entry point is imported under `python -X importtime` a few times; the
+fastest run must stay within its budget and none may load a module that
+belongs to a feature it only uses on demand (push queue, dedup index,
+mailbox statistics, message catalog, password decryption, YAML parsing).
+
+Usage: python3 test_import_time.py [--runs 5] [--scale 1.0] [--verbose]
+--scale multiplies every budget, for slow machines.
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+import subprocess
+
+SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+WEB = os.path.join(os.path.dirname(SCRIPTS), "web")
+
+ON_DEMAND = ('requests', 'urllib3', 'cryptography', 'yaml', 'sqlite3', 'subprocess',
+             'push_queue', 'dedup', 'password_manager', 'mailbox_stats',
+             'catalog')
+
+# (module, directory, budget in ms or None, modules it must not import)
+ENTRY_POINTS = [
+    ('mda_client', SCRIPTS, 15, ON_DEMAND + ('process_mail', 'email', 'logging')),
+    ('process_mail', SCRIPTS, 100, ON_DEMAND),
+    ('app', WEB, None, ('requests', 'cryptography', 'password_manager', 'sqlite3', 'push_queue')),
+]
+
+def import_profile(module, directory, env=None):
+    """{module name: cumulative µs} of module and everything its import pulled in
+
+    -X importtime prints a module after its children; the children of a
+    top-level import are the lines since the previous top-level one (site
+    and whatever it loads come first and are left out).
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=directory, capture_output=True, text=True, env=env
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed")
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            _, cumulative, name = line.split("|")
+            cumulative = int(cumulative)
+        except ValueError:
+            continue
+        if not name.startswith("  ") and name.strip() != module:
+            # Another top-level import finished; what came before is not ours
+            times = {}
+            continue
+        times[name.strip()] = cumulative
+        if name.strip() == module:
+            break
+    return times
+
+def check(module, directory, budget, forbidden, runs, scale, verbose, env=None):
+    try:
+        profiles = [import_profile(module, directory, env) for _ in range(runs)]
+    except RuntimeError as e:
+        # An entry point that does not import is not within budget either
+        print(f"❌ {module} cannot be imported: {e}")
+        return False
+    best = min(profiles, key=lambda times: times.get(module, 0))
+    elapsed = best.get(module, 0) / 1000
+    ok = True
+
+    loaded = sorted(name for name in forbidden if any(
+        loaded == name or loaded.startswith(name + ".") for loaded in best))
+    if loaded:
+        print(f"❌ {module} imports on-demand modules at startup: {', '.join(loaded)}")
+        ok = False
+
+    if budget is not None:
+        limit = budget * scale
+        if elapsed > limit:
+            print(f"❌ {module} imports in {elapsed:.1f} ms, budget {limit:.0f} ms")
+            ok = False
+        elif ok:
+            print(f"✅ {module} imports in {elapsed:.1f} ms (budget {limit:.0f} ms)")
+    elif ok:
+        print(f"✅ {module} imports in {elapsed:.1f} ms without on-demand modules")
+
+    if verbose:
+        heaviest = sorted(((us, name) for name, us in best.items() if name != module), reverse=True)[:10]
+        for us, name in heaviest:
+            print(f"   {us / 1000:7.1f} ms  {name}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description='Check import time of the entry points')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply all budgets')
+    parser.add_argument('--verbose', action='store_true', help='Show the slowest imports')
+    args = parser.parse_args()
+
+    print("=== Testing import time ===")
+    # process_mail opens its log file on import; outside the container /logs does not exist
+    with tempfile.TemporaryDirectory(prefix='import_time_') as log_dir:
+        env = dict(os.environ, MAIL_BRIDGE_LOG_DIR=log_dir)
+        results = [check(module, directory, budget, forbidden, args.runs, args.scale, args.verbose, env)
+                   for module, directory, budget, forbidden in ENTRY_POINTS]
+    if all(results):
+        print("\n🎉 All entry points within budget!")
+        return True
+    return False
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Thunderbird profile layout
+
+Thunderbird keeps each folder as an mbox file without extension next to
+its .msf index; subfolders of "Foo" live in the directory "Foo.sbd". This
+module finds the mbox files of a profile, maps them to Maildir++ folder
+names and turns X-Mozilla-Status into Maildir flags.
+"""
+
+import os
+import re
+
+# Files in an account directory that are never folders
+_NOT_MBOX = ('.msf', '.dat', '.html', '.json', '.sqlite', '.js', '.mab', '.bak', '.tmp')
+
+_MOZILLA_STATUS = re.compile(rb'(?im)^X-Mozilla-Status:[ \t]*([0-9a-f]{1,8})[ \t]*\r?$')
+_HEADER_END = re.compile(rb'\r?\n\r?\n')
+
+MSG_FLAG_READ = 0x0001
+MSG_FLAG_REPLIED = 0x0002
+MSG_FLAG_MARKED = 0x0004
+MSG_FLAG_EXPUNGED = 0x0008
+MSG_FLAG_FORWARDED = 0x1000
+
+def is_mbox(path):
+    """True for an (empty or) mbox file Thunderbird uses as a folder"""
+    if not os.path.isfile(path) or path.endswith(_NOT_MBOX):
+        return False
+    with open(path, 'rb') as f:
+        start = f.read(5)
+    return start in (b"", b"From ")
+
+def account_dirs(path):
+    """Account directories below a profile, its Mail/ directory or an account directory itself"""
+    path = str(path)
+    roots = [os.path.join(path, name) for name in ("Mail", "ImapMail") if os.path.isdir(os.path.join(path, name))]
+    if not roots:
+        entries = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+        if any(is_mbox(entry) for entry in entries):
+            return [path]
+        roots = [path]
+    accounts = []
+    for root in roots:
+        for name in sorted(os.listdir(root)):
+            candidate = os.path.join(root, name)
+            if os.path.isdir(candidate) and not name.endswith('.sbd'):
+                accounts.append(candidate)
+    return accounts
+
+def folder_name(parts):
+    """IMAP folder for a Thunderbird folder path; Inbox and its subfolders map to the top level"""
+    if parts[0].lower() == 'inbox':
+        parts = parts[1:]
+        if not parts:
+            return "INBOX"
+    return "/".join(part.replace('/', '_').replace('.', '_') for part in parts)
+
+def profile_folders(account_dir, parents=()):
+    """Yield (mbox path, folder name) for every folder of an account, recursing into .sbd"""
+    for name in sorted(os.listdir(account_dir)):
+        path = os.path.join(account_dir, name)
+        if is_mbox(path):
+            yield path, folder_name(parents + (name,))
+    for name in sorted(os.listdir(account_dir)):
+        path = os.path.join(account_dir, name)
+        if name.endswith('.sbd') and os.path.isdir(path):
+            yield from profile_folders(path, parents + (name[:-4],))
+
+def mozilla_flags(raw_msg):
+    """Maildir flags from X-Mozilla-Status, "" for unread, or None for an expunged message
+
+    Messages without the header count as read, like any other import.
+    """
+    match = _HEADER_END.search(raw_msg)
+    header = raw_msg[:match.end()] if match else raw_msg
+    status = _MOZILLA_STATUS.search(header)
+    if status is None:
+        return "S"
+    value = int(status.group(1), 16)
+    if value & MSG_FLAG_EXPUNGED:
+        return None
+    flags = ""
+    if value & MSG_FLAG_MARKED:
+        flags += "F"
+    if value & MSG_FLAG_FORWARDED:
+        flags += "P"
+    if value & MSG_FLAG_REPLIED:
+        flags += "R"
+    if value & MSG_FLAG_READ:
+        flags += "S"
+    return flags
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Durable UIDL state for the native fetcher
+
+Records which POP3 UIDLs were already delivered, per account, so a poll
+is one UIDL listing plus a set difference instead of re-downloading the
+mailbox. UIDLs that disappear from the server are pruned so the store
+tracks the mailbox size, not its history.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from contextlib import closing
+
+DEFAULT_STATE_PATH = "/maildata/.mail-bridge/uidl.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen_uidls (
+    account TEXT NOT NULL,
+    uidl TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (account, uidl)
+) WITHOUT ROWID;
+"""
+
+def account_key(account):
+    """Stable state key for an account (survives renaming it in the web UI)"""
+    return f"{account.get('user')}@{account.get('pop_server')}:{account.get('pop_port', 995)}"
+
+class UIDLStore:
+    """SQLite store of delivered UIDLs, safe to share between fetch threads"""
+
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def load(self, account):
+        """All UIDLs delivered for an account"""
+        with self.lock:
+            rows = self.conn.execute("SELECT uidl FROM seen_uidls WHERE account = ?", (account,))
+            return {row[0] for row in rows}
+
+    def add(self, account, uidl):
+        """Record one delivered message; committed immediately so a crash cannot re-deliver it"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO seen_uidls (account, uidl, fetched_at) VALUES (?, ?, ?)",
+                (account, uidl, time.time())
+            )
+
+    def remove(self, account, uidls):
+        """Forget UIDLs that are no longer on the server"""
+        if not uidls:
+            return
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM seen_uidls WHERE account = ? AND uidl = ?",
+                [(account, uidl) for uidl in uidls]
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -6,22 +6,41 @@ Flask application for managing POP3 accounts and configuration
 
 import os
 import sys
-import yaml
+import signal
 import subprocess
+import threading
+import time
 import logging
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, send_file
 from datetime import datetime
 
 # Add scripts to path for imports
 sys.path.append('/scripts')
-from password_manager import PasswordManager
+import config_store
+import log_tail
+import metrics
+import mailbox_stats
+import catalog
 
 app = Flask(__name__)
 app.secret_key = 'mail-bridge-secret-key-change-in-production'
 
 # Configuration
-CONFIG_PATH = '/config/accounts.yaml'
-LOG_PATH = '/logs'
+CONFIG_PATH = os.environ.get('MAIL_BRIDGE_CONFIG', '/config/accounts.yaml')
+LOG_PATH = os.environ.get('MAIL_BRIDGE_LOG_DIR', '/logs')
+PROCESS_LOG = f'{LOG_PATH}/process_mail.log'
+MAX_LOG_LINES = 1000
+# Seconds between SSE keep-alive comments on a quiet log
+LOG_STREAM_KEEPALIVE = 15
+# A log stream ends after this many seconds and the browser reconnects where it left off,
+# so streams do not keep a worker thread (or a graceful reload) waiting forever
+LOG_STREAM_MAX_SECONDS = 300
+STARTED = datetime.now()
+# Written by fetchmail (--pidfile in entrypoint.sh) or the native fetcher
+FETCHER_PID_FILES = ['/var/run/mail-bridge/fetchmail.pid', '/var/run/mail-bridge/fetcher.pid']
+# Written by the gunicorn master (gunicorn.conf.py)
+WEB_PID_FILE = '/var/run/mail-bridge/web.pid'
+BACKGROUND_LOCK_FILE = '/var/run/mail-bridge/web-background.lock'
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -30,48 +49,57 @@ logger = logging.getLogger(__name__)
 class ConfigManager:
     def __init__(self):
         self.config_path = CONFIG_PATH
-        self.password_manager = PasswordManager()
+        self.store = config_store.get_store(CONFIG_PATH)
         
     def load_config(self):
-        """Load configuration from YAML file"""
-        try:
-            with open(self.config_path, 'r') as f:
-                config = yaml.safe_load(f)
-                # Decrypt passwords in accounts
-                if 'accounts' in config:
-                    for account in config['accounts']:
-                        if 'encrypted_password' in account:
-                            try:
-                                account['password'] = self.password_manager.decrypt(account['encrypted_password'])
-                            except Exception as e:
-                                logging.error(f"Failed to decrypt password for {account.get('name', 'unknown')}: {e}")
-                                account['password'] = ''
-                return config or {}
-        except FileNotFoundError:
-            return {'accounts': [], 'settings': {}, 'filter_rules': []}
-        except Exception as e:
-            logging.error(f"Error loading config: {e}")
-            return {'accounts': [], 'settings': {}, 'filter_rules': []}
+        """Cached configuration snapshot (shared, do not modify; passwords stay encrypted)"""
+        return self.store.get().data
+    
+    def load_config_for_edit(self, decrypt=False):
+        """Private copy of the configuration, optionally with all passwords decrypted"""
+        return self.store.get().for_edit(decrypt)
+    
+    def account_password(self, account):
+        """Decrypted password of an account from the cached configuration"""
+        return self.store.get().password(account)
     
     def save_config(self, config):
-        """Save configuration to YAML file with encrypted passwords"""
+        """Save configuration to YAML file with encrypted passwords and apply it"""
+        previous = self.store.get()
+        if not self.store.save(config):
+            return False
         try:
-            # Encrypt passwords before saving
-            if 'accounts' in config:
-                for account in config['accounts']:
-                    if 'password' in account and account['password']:
-                        # Encrypt the password
-                        encrypted = self.password_manager.encrypt(account['password'])
-                        account['encrypted_password'] = encrypted
-                        # Remove plain text password from saved config
-                        del account['password']
-            
-            with open(self.config_path, 'w') as f:
-                yaml.dump(config, f, default_flow_style=False, indent=2)
-            return True
+            self.apply_changes(previous)
         except Exception as e:
-            logger.error(f"Error saving config: {e}")
-            return False
+            logger.error(f"Saved configuration could not be applied: {e}")
+        return True
+    
+    def apply_changes(self, previous=None):
+        """Rewrite fetchmailrc if its content changed and wake fetchmail; returns a summary
+        
+        The native fetcher notices the new accounts.yaml by itself and only
+        restarts the accounts that changed.
+        """
+        from generate_config import update_fetchmailrc
+        snapshot = self.store.get()
+        summary = []
+        if previous is not None:
+            added, removed, changed = config_store.account_diff(previous.accounts, snapshot.accounts)
+            summary.append(f"{len(added)} added, {len(removed)} removed, {len(changed)} changed")
+        if update_fetchmailrc(snapshot.data):
+            # fetchmail reloads a changed rc file between polls; SIGUSR1 ends its sleep now
+            subprocess.run(['pkill', '-USR1', '-x', 'fetchmail'], capture_output=True)
+            summary.append("fetchmailrc updated")
+        else:
+            summary.append("fetchmailrc unchanged")
+        # Without a previous snapshot (Restart on the status page) the web server reloads as well
+        if previous is None or web_settings(previous.data) != web_settings(snapshot.data):
+            if reload_web_server():
+                summary.append("web server reloading")
+            elif previous is not None:
+                summary.append("web settings need a restart")
+        logger.info(f"Configuration applied: {', '.join(summary)}")
+        return ', '.join(summary)
     
     def test_pop3_connection(self, account):
         """Test POP3 connection for an account"""
@@ -83,7 +111,7 @@ class ConfigManager:
             pop_server = account.get('pop_server')
             pop_port = account.get('pop_port', 995)
             user = account.get('user')
-            password = account.get('password', '')  # Password is already decrypted in load_config()
+            password = self.account_password(account)
             use_ssl = account.get('ssl', True)
             
             if not all([pop_server, user, password]):
@@ -93,10 +121,12 @@ class ConfigManager:
                 if not password: missing.append("password")
                 return False, f"Missing required fields: {', '.join(missing)}"
             
+            # A server that never answers must not hold a request thread for good
+            timeout = web_settings(self.load_config()).get('connection_test_timeout', CONNECTION_TEST_TIMEOUT)
             if use_ssl:
-                pop = poplib.POP3_SSL(pop_server, pop_port)
+                pop = poplib.POP3_SSL(pop_server, pop_port, timeout=timeout)
             else:
-                pop = poplib.POP3(pop_server, pop_port)
+                pop = poplib.POP3(pop_server, pop_port, timeout=timeout)
             
             pop.user(user)
             pop.pass_(password)
@@ -123,29 +153,73 @@ class ConfigManager:
             error_msg += f"  Full error: {repr(e)}"
             return False, error_msg
     
+    def push_queue_stats(self, config):
+        """Pending/failed counts of the push notification queue"""
+        push_settings = config.get('settings', {}).get('push_notifications', {}) or {}
+        try:
+            from push_queue import PushQueue, DEFAULT_QUEUE_PATH
+            queue = PushQueue(push_settings.get('queue_path', DEFAULT_QUEUE_PATH))
+            return {'pending': queue.depth(), 'failed': queue.failed()}
+        except Exception as e:
+            logger.error(f"Error reading push queue: {e}")
+            return {'pending': None, 'failed': None}
+    
     def restart_services(self):
-        """Restart mail services after configuration change"""
+        """Apply the current configuration without restarting any service"""
         try:
-            # Regenerate fetchmail config
-            result = subprocess.run(
-                ['python3', '/scripts/generate_config.py'],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            
-            if result.returncode != 0:
-                return False, f"Config generation failed: {result.stderr}"
-            
-            # Restart fetchmail (if running)
-            # Note: In production, this would need proper service management
-            return True, "Configuration updated successfully"
-            
+            return True, f"Configuration updated successfully ({self.apply_changes()})"
         except Exception as e:
             return False, f"Restart failed: {str(e)}"
 
 config_manager = ConfigManager()
 
+def web_settings(config):
+    return config.get('settings', {}).get('web', {}) or {}
+
+class RequestLimit:
+    """At most size concurrent requests of one kind per worker process; more are turned away at once
+
+    Keeps slow requests (POP3 logins, log streams) from taking every thread
+    of a worker. The size is read from settings.web when first needed, so
+    a change applies with the next reload of the workers.
+    """
+    
+    def __init__(self, setting, default):
+        self.setting = setting
+        self.default = default
+        self.semaphore = None
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        if self.semaphore is None:
+            with self.lock:
+                if self.semaphore is None:
+                    size = web_settings(config_manager.load_config()).get(self.setting, self.default)
+                    self.semaphore = threading.BoundedSemaphore(max(1, int(size)))
+        return self.semaphore.acquire(blocking=False)
+    
+    def release(self):
+        self.semaphore.release()
+
+CONNECTION_TEST_TIMEOUT = 15
+CONNECTION_TESTS = RequestLimit('max_connection_tests', 4)
+LOG_STREAMS = RequestLimit('max_log_streams', 4)
+
+def read_pid(pid_path):
+    try:
+        with open(pid_path) as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+def reload_web_server():
+    """SIGHUP the gunicorn master serving this worker (graceful reload); False under the development server"""
+    pid = read_pid(WEB_PID_FILE)
+    if pid is None or pid != os.getppid():
+        return False
+    os.kill(pid, signal.SIGHUP)
+    return True
+
 @app.route('/')
 def index():
     """Main dashboard"""
@@ -155,11 +229,69 @@ def index():
     # Get basic stats
     total_accounts = len(accounts)
     active_accounts = sum(1 for acc in accounts if acc.get('enabled', True))
+    folders = mailbox_folders(config)
+    # Starts the catalog's background sync, so existing mail is searchable soon after startup
+    message_catalog(config)
     
     return render_template('dashboard.html', 
                          accounts=accounts,
                          total_accounts=total_accounts,
-                         active_accounts=active_accounts)
+                         active_accounts=active_accounts,
+                         folders=folders,
+                         total_messages=sum(f['messages'] for f in folders or []),
+                         total_unread=sum(f['unread'] for f in folders or []))
+
+_background_lock = None
+
+def background_worker():
+    """True in the one web process that runs the background threads (catalog sync, mailbox reconcile)
+
+    Every gunicorn worker would otherwise start its own. The first worker to
+    ask holds a lock file for its lifetime; when it exits, the next worker to
+    ask takes over.
+    """
+    global _background_lock
+    if _background_lock is not None:
+        return True
+    import fcntl
+    try:
+        os.makedirs(os.path.dirname(BACKGROUND_LOCK_FILE), exist_ok=True)
+        lock = open(BACKGROUND_LOCK_FILE, 'a')
+    except OSError:
+        return True
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return False
+    _background_lock = lock
+    return True
+
+def mailbox_folders(config):
+    """Per-folder counts from the mailbox statistics index (one row per folder, no Maildir walk)"""
+    settings = config.get('settings', {})
+    stats_settings = settings.get('mailbox_stats', {}) or {}
+    if not stats_settings.get('enabled', True):
+        return None
+    try:
+        stats = mailbox_stats.shared(mailbox_stats.maildir_root(settings))
+        # Keeps the index in step with what IMAP clients change; started on first use
+        if background_worker():
+            mailbox_stats.start_reconciler(stats, stats_settings.get('reconcile_interval',
+                                                                     mailbox_stats.RECONCILE_INTERVAL))
+        return stats.folders()
+    except Exception as e:
+        logger.error(f"Error reading mailbox statistics: {e}")
+        return None
+
+def message_catalog(config):
+    """The message catalog, with its background sync started on first use; None if disabled"""
+    settings = config.get('settings', {})
+    messages = catalog.from_settings(settings)
+    if messages is not None and background_worker():
+        catalog.start_sync(messages, (settings.get('catalog', {}) or {}).get('sync_interval',
+                                                                          catalog.SYNC_INTERVAL))
+    return messages
 
 @app.route('/accounts')
 def accounts():
@@ -172,7 +304,7 @@ def accounts():
 def add_account():
     """Add new account"""
     if request.method == 'POST':
-        config = config_manager.load_config()
+        config = config_manager.load_config_for_edit()
         
         account = {
             'name': request.form.get('name'),
@@ -211,7 +343,7 @@ def add_account():
 @app.route('/accounts/edit/<account_name>', methods=['GET', 'POST'])
 def edit_account(account_name):
     """Edit existing account"""
-    config = config_manager.load_config()
+    config = config_manager.load_config_for_edit()
     accounts = config.get('accounts', [])
     
     # Find the account
@@ -226,6 +358,14 @@ def edit_account(account_name):
         flash('Account not found', 'error')
         return redirect(url_for('accounts'))
     
+    # Only the edited account's password is decrypted, for the form
+    if 'encrypted_password' in account and 'password' not in account:
+        try:
+            account['password'] = config_manager.account_password(account)
+        except Exception as e:
+            logger.error(f"Failed to decrypt password for {account_name}: {e}")
+            account['password'] = ''
+    
     if request.method == 'POST':
         # Update account data
         account.update({
@@ -255,7 +395,7 @@ def edit_account(account_name):
 @app.route('/accounts/delete/<account_name>')
 def delete_account(account_name):
     """Delete account"""
-    config = config_manager.load_config()
+    config = config_manager.load_config_for_edit()
     accounts = config.get('accounts', [])
     
     # Remove the account
@@ -285,7 +425,13 @@ def test_account(account_name):
     if not account:
         return jsonify({'success': False, 'message': 'Account not found'})
     
-    success, message = config_manager.test_pop3_connection(account)
+    if not CONNECTION_TESTS.acquire():
+        return jsonify({'success': False,
+                        'message': 'Other connection tests are still running, try again in a moment'}), 429
+    try:
+        success, message = config_manager.test_pop3_connection(account)
+    finally:
+        CONNECTION_TESTS.release()
     return jsonify({'success': success, 'message': message})
 
 @app.route('/filters')
@@ -299,33 +445,178 @@ def filters():
 def status():
     """System status page"""
     # Get service status
-    try:
-        # Check if fetchmail is running
-        result = subprocess.run(['pgrep', '-f', 'fetchmail'], 
-                              capture_output=True, text=True)
-        fetchmail_running = bool(result.stdout.strip())
-    except:
-        fetchmail_running = False
-    
-    # Get recent logs
-    recent_logs = []
-    try:
-        with open(f'{LOG_PATH}/process_mail.log', 'r') as f:
-            lines = f.readlines()
-            recent_logs = lines[-10:]  # Last 10 lines
-    except:
-        recent_logs = ["No logs available"]
+    fetchmail_running = fetcher_running()
+    
+    # Get recent logs: read backwards from the end, so the cost does not grow with the log
+    log_offset = log_size()
+    recent_logs = log_tail.tail(PROCESS_LOG, 10) or ["No logs available"]
+    last_check = None
+    for line in reversed(recent_logs):
+        prefix = log_tail.parse_prefix(line.encode('utf-8'))
+        if prefix is not None:
+            last_check = prefix[0]
+            break
+    
+    config = config_manager.load_config()
+    push_queue = config_manager.push_queue_stats(config)
     
     return render_template('status.html', 
                          fetchmail_running=fetchmail_running,
-                         recent_logs=recent_logs)
+                         recent_logs=recent_logs,
+                         log_offset=log_offset,
+                         last_check=last_check,
+                         started=STARTED,
+                         config=config,
+                         push_queue=push_queue)
+
+def process_running(pid_path):
+    """True if the process named in a pid file is alive"""
+    pid = read_pid(pid_path)
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+def fetcher_running():
+    """Whether fetchmail or the native fetcher runs, from their pid files instead of pgrep"""
+    return any(process_running(path) for path in FETCHER_PID_FILES)
+
+def log_size():
+    try:
+        return os.path.getsize(PROCESS_LOG)
+    except OSError:
+        return 0
+
+def parse_time(value):
+    """datetime from an ISO 8601 query parameter, None if empty; raises ValueError"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+@app.route('/api/logs')
+def api_logs():
+    """API endpoint for log lines: the last ?lines=, or a ?since=/&until= time range, optionally ?level="""
+    lines = max(1, min(request.args.get('lines', 100, type=int), MAX_LOG_LINES))
+    level = request.args.get('level') or None
+    if level and level.upper() not in log_tail.LEVELS:
+        return jsonify({'error': f'Unknown level {level}'}), 400
+    try:
+        since = parse_time(request.args.get('since'))
+        until = parse_time(request.args.get('until'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if since or until:
+        logs = log_tail.log_index(PROCESS_LOG).records(since, until, level, limit=lines)
+    else:
+        logs = log_tail.tail(PROCESS_LOG, lines, level)
+    return jsonify({'lines': logs, 'offset': log_size()})
+
+@app.route('/api/logs/stream')
+def api_logs_stream():
+    """Server-Sent Events with every line appended to the log; the event id is its byte offset"""
+    # EventSource sends Last-Event-ID on reconnect, so no line is lost or repeated
+    start = request.headers.get('Last-Event-ID') or request.args.get('offset')
+    offset = int(start) if start and start.isdigit() else None
+    # Every open stream holds a worker thread
+    if not LOG_STREAMS.acquire():
+        return Response("Too many log streams open\n", status=503, mimetype='text/plain',
+                        headers={'Retry-After': '30'})
+    
+    def events():
+        yield "retry: 3000\n\n"
+        ends = time.monotonic() + LOG_STREAM_MAX_SECONDS
+        for item in log_tail.follow(PROCESS_LOG, offset, idle=LOG_STREAM_KEEPALIVE):
+            if item is None:
+                yield ": keep-alive\n\n"
+            else:
+                position, line = item
+                yield f"id: {position}\ndata: {line.rstrip(chr(13))}\n\n"
+            if time.monotonic() >= ends:
+                break
+    
+    response = Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(LOG_STREAMS.release)
+    return response
+
+@app.route('/api/logs/download')
+def api_logs_download():
+    """Download the whole processing log"""
+    if not os.path.exists(PROCESS_LOG):
+        return jsonify({'error': 'No logs available'}), 404
+    return send_file(PROCESS_LOG, mimetype='text/plain', as_attachment=True,
+                     download_name='process_mail.log')
 
 @app.route('/api/config')
 def api_config():
     """API endpoint for configuration"""
-    config = config_manager.load_config()
+    config = config_manager.load_config_for_edit(decrypt=True)
     return jsonify(config)
 
+@app.route('/api/mailboxes')
+def api_mailboxes():
+    """API endpoint for message, unread and byte counts per user and folder"""
+    folders = mailbox_folders(config_manager.load_config())
+    if folders is None:
+        return jsonify({'error': 'Mailbox statistics are not available'}), 503
+    return jsonify(folders)
+
+def message_page(search):
+    """JSON page of catalog.messages() or catalog.search() for the query parameters"""
+    messages = message_catalog(config_manager.load_config())
+    if messages is None:
+        return jsonify({'error': 'The message catalog is disabled'}), 503
+    args = (request.args.get('user') or None, request.args.get('folder') or None,
+            request.args.get('limit', 50, type=int), request.args.get('cursor') or None)
+    try:
+        if search:
+            rows, next_cursor = messages.search(request.args.get('q', ''), *args)
+        else:
+            rows, next_cursor = messages.messages(*args)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    for row in rows:
+        row['date'] = datetime.fromtimestamp(row['date']).isoformat()
+    return jsonify({'messages': rows, 'next_cursor': next_cursor})
+
+@app.route('/api/messages')
+def api_messages():
+    """API endpoint for cataloged messages, newest first (?user=, ?folder=, ?limit=, ?cursor=)"""
+    return message_page(search=False)
+
+@app.route('/api/messages/search')
+def api_messages_search():
+    """API endpoint for a full-text search of subject, sender and body text (?q= plus the list parameters)"""
+    return message_page(search=True)
+
+@app.route('/api/push/queue')
+def api_push_queue():
+    """API endpoint for push notification queue depth"""
+    return jsonify(config_manager.push_queue_stats(config_manager.load_config()))
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics, aggregated over every mail-bridge process"""
+    config = config_manager.load_config()
+    gauges = {'mailbridge_fetcher_up': ('Whether fetchmail or the native fetcher is running',
+                                        int(fetcher_running()))}
+    push_queue = config_manager.push_queue_stats(config)
+    if push_queue['pending'] is not None:
+        gauges['mailbridge_push_queue_pending'] = ('Push notifications waiting to be sent', push_queue['pending'])
+        gauges['mailbridge_push_queue_failed'] = ('Push notifications given up on', push_queue['failed'])
+    try:
+        body = metrics.render(metrics.metrics_path(config.get('settings', {})), gauges)
+    except Exception as e:
+        logger.error(f"Error reading metrics: {e}")
+        return Response(f"# Error reading metrics: {e}\n", status=500, mimetype='text/plain')
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/restart', methods=['POST'])
 def api_restart():
     """API endpoint to restart services"""
@@ -337,4 +628,11 @@ if __name__ == '__main__':
     os.makedirs('/app/templates', exist_ok=True)
     os.makedirs('/app/static', exist_ok=True)
     
-    app.run(host='0.0.0.0', port=8787, debug=True)
+    web = web_settings(config_manager.load_config())
+    if '--server' in sys.argv:
+        # entrypoint.sh asks which server to start: gunicorn (gunicorn.conf.py) or this development server
+        print(web.get('server', 'gunicorn'))
+        sys.exit(0)
+    
+    # The development server: one process, and the debugger only when asked for (it runs code from the browser)
+    app.run(host='0.0.0.0', port=8787, debug=bool(web.get('debug', False)), threaded=True)
@@ -0,0 +1,65 @@
+"""
+Gunicorn settings for the web interface, from settings.web in accounts.yaml
+
+entrypoint.sh runs `gunicorn -c gunicorn.conf.py app:app` in /app/web.
+Workers are gthread workers: each one serves `threads` requests at once,
+so a slow POP3 connection test or an open log stream (/api/logs/stream
+keeps its thread) no longer holds up every other page as Flask's
+development server did.
+
+SIGHUP to the master (pid in PID_FILE) reads this file and accounts.yaml
+again, starts new workers and lets the old ones finish their requests
+within graceful_timeout; the web interface sends it itself when the web
+settings change and on Restart (see app.py). timeout is the time a worker may go without
+reporting to the master before it is restarted. With gthread the worker's
+main loop reports, not the request threads, so a long request does not
+get its worker killed; long operations carry their own timeouts in app.py.
+"""
+
+import os
+import sys
+
+sys.path.append('/scripts')
+
+import config_store
+
+CONFIG_PATH = os.environ.get('MAIL_BRIDGE_CONFIG', '/config/accounts.yaml')
+PID_FILE = '/var/run/mail-bridge/web.pid'
+
+DEFAULTS = {
+    'bind': '0.0.0.0:8787',
+    'workers': 2,
+    'threads': 8,
+    'timeout': 60,
+    'graceful_timeout': 30,
+    'keepalive': 5,
+    # Workers are replaced after this many requests (0: never). A new worker
+    # needs a second or more to import the app, noticeable under load
+    'max_requests': 0,
+    'access_log': False,
+}
+
+web = dict(DEFAULTS, **(config_store.load(CONFIG_PATH).settings.get('web', {}) or {}))
+
+bind = web['bind'] if isinstance(web['bind'], list) else [web['bind']]
+worker_class = 'gthread'
+workers = max(1, int(web['workers']))
+threads = max(1, int(web['threads']))
+timeout = int(web['timeout'])
+graceful_timeout = int(web['graceful_timeout'])
+keepalive = int(web['keepalive'])
+max_requests = int(web['max_requests'])
+# Keeps the workers from being replaced all at the same moment
+max_requests_jitter = max_requests // 10
+pidfile = PID_FILE
+proc_name = 'mail-bridge-web'
+accesslog = '-' if web['access_log'] else None
+errorlog = '-'
+loglevel = 'info'
+
+def on_starting(server):
+    os.makedirs(os.path.dirname(PID_FILE), exist_ok=True)
+
+def on_reload(server):
+    server.log.info(f"Reloaded settings: {server.cfg.workers} workers x {server.cfg.threads} threads "
+                    f"on {', '.join(server.cfg.bind)}")